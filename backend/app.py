@@ -1,33 +1,39 @@
 """Flask application bootstrap."""
+import hmac
 import os
 import threading
 import time
 
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 
 from backend.config import get_config
+from backend.court_records import BUNDLED_COURTS_FILE, BUNDLED_SNAPSHOT_FILE
 
 db = SQLAlchemy(session_options={'expire_on_commit': False})
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FRONTEND_DIR = os.path.join(PROJECT_ROOT, 'frontend')
-BUNDLED_COURTS_FILE = os.path.join(PROJECT_ROOT, 'data', 'courts.json.gz')
 
 
 _seed_thread_started = False
 
 
-def _seed_courts_background(app):
+def _seed_courts_background(app, snapshot=None):
     """Import the bundled court data on first boot (runs in a thread so deploys
-    don't time out while ~18k rows insert)."""
+    don't time out while ~18k rows insert). With a compiled snapshot the rows
+    come from it, ids included, while the court index already serves it."""
     with app.app_context():
         try:
             from backend.models import Court
-            from backend.seed import import_courts_file
             if Court.query.count() > 0:
                 return
-            count = import_courts_file(BUNDLED_COURTS_FILE)
+            if snapshot is not None:
+                from backend.seed import hydrate_courts
+                count = hydrate_courts(snapshot, log=app.logger.info)
+            else:
+                from backend.seed import import_courts_file
+                count = import_courts_file(BUNDLED_COURTS_FILE, log=app.logger.info)
             app.logger.info('Auto-seeded %s courts from bundled data', count)
         except Exception:
             app.logger.exception('Court auto-seed failed')
@@ -37,7 +43,8 @@ def _maybe_auto_seed(app):
     global _seed_thread_started
     if _seed_thread_started or not app.config.get('AUTO_SEED_COURTS'):
         return
-    if not os.path.exists(BUNDLED_COURTS_FILE):
+    has_snapshot = os.path.exists(BUNDLED_SNAPSHOT_FILE)
+    if not has_snapshot and not os.path.exists(BUNDLED_COURTS_FILE):
         app.logger.warning('AUTO_SEED_COURTS set but %s is missing', BUNDLED_COURTS_FILE)
         return
     from backend.models import Court
@@ -47,8 +54,25 @@ def _maybe_auto_seed(app):
     except Exception:
         app.logger.exception('Could not check court count for auto-seed')
         return
+    snapshot = None
+    if has_snapshot:
+        from backend.services.court_index import get_court_index, load_snapshot
+        snapshot = load_snapshot(BUNDLED_SNAPSHOT_FILE)
+        if snapshot is not None:
+            get_court_index(app).use_snapshot(snapshot)
+        elif not os.path.exists(BUNDLED_COURTS_FILE):
+            return
     _seed_thread_started = True
-    threading.Thread(target=_seed_courts_background, args=(app,), daemon=True).start()
+    threading.Thread(target=_seed_courts_background, args=(app, snapshot), daemon=True).start()
+
+
+def _warm_court_index(app):
+    """Build the in-memory court index at boot so the first map pan is fast."""
+    from backend.services.court_index import get_court_index
+    try:
+        get_court_index(app).ensure_fresh()
+    except Exception:
+        app.logger.exception('Court index warm-up failed')
 
 
 def _ensure_pg_schema(app):
@@ -137,6 +161,11 @@ def _upgrade_schema(app):
         tables = inspector.get_table_names()
         is_postgres = db.engine.dialect.name == 'postgresql'
         statements = []
+        backfill_ratings = False
+        backfill_locations = False
+        backfill_fingerprints = False
+        # create_all runs after this and would build the table empty.
+        backfill_history = 'user' in tables and 'rating_history' not in tables
 
         if 'message' in tables:
             columns = {c['name'] for c in inspector.get_columns('message')}
@@ -155,6 +184,9 @@ def _upgrade_schema(app):
                 ('home_lng', 'ALTER TABLE "user" ADD COLUMN home_lng DOUBLE PRECISION'),
                 ('home_area', 'ALTER TABLE "user" ADD COLUMN home_area VARCHAR(120)'),
                 ('avatar_url', "ALTER TABLE \"user\" ADD COLUMN avatar_url VARCHAR(500) NOT NULL DEFAULT ''"),
+                ('loc_lat', 'ALTER TABLE "user" ADD COLUMN loc_lat DOUBLE PRECISION'),
+                ('loc_lng', 'ALTER TABLE "user" ADD COLUMN loc_lng DOUBLE PRECISION'),
+                ('geo_cell', 'ALTER TABLE "user" ADD COLUMN geo_cell INTEGER'),
             ):
                 if col not in user_cols:
                     # SQLite uses FLOAT/DATETIME; Postgres accepts these too.
@@ -162,6 +194,12 @@ def _upgrade_schema(app):
                                       .replace('DOUBLE PRECISION', 'FLOAT')
                                       .replace('TIMESTAMP', 'DATETIME'))
 
+            if 'geo_cell' not in user_cols:
+                statements.append(
+                    'CREATE INDEX IF NOT EXISTS ix_user_geo_cell_rating ON "user" (geo_cell, rating)'
+                )
+                backfill_locations = True
+
         if 'game' in tables:
             game_cols = {c['name'] for c in inspector.get_columns('game')}
             if is_postgres:
@@ -183,6 +221,21 @@ def _upgrade_schema(app):
             court_cols = {c['name'] for c in inspector.get_columns('court')}
             if 'photo_data' not in court_cols:
                 statements.append('ALTER TABLE court ADD COLUMN photo_data TEXT')
+            if 'source_hash' not in court_cols:
+                statements.extend([
+                    'ALTER TABLE court ADD COLUMN source_hash VARCHAR(40)',
+                    'ALTER TABLE court ADD COLUMN stale BOOLEAN NOT NULL DEFAULT FALSE',
+                ])
+                backfill_fingerprints = True
+            if 'rating_avg' not in court_cols:
+                statements.extend([
+                    'ALTER TABLE court ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0',
+                    'ALTER TABLE court ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0',
+                    'ALTER TABLE court ADD COLUMN rating_avg '
+                    + ('DOUBLE PRECISION' if is_postgres else 'FLOAT'),
+                    'CREATE INDEX IF NOT EXISTS ix_court_rating_avg ON court (rating_avg)',
+                ])
+                backfill_ratings = True
 
         if 'game_player' in tables:
             gp_cols = {c['name'] for c in inspector.get_columns('game_player')}
@@ -195,8 +248,25 @@ def _upgrade_schema(app):
         if statements:
             app.logger.warning('Applying schema upgrades: %s', statements)
             with db.engine.begin() as conn:
+                if is_postgres:
+                    # Index builds on big tables outlast DB_STATEMENT_TIMEOUT_MS.
+                    conn.execute(text('SET LOCAL statement_timeout = 0'))
                 for statement in statements:
                     conn.execute(text(statement))
+        if backfill_ratings:
+            from backend.services.court_ratings import rebuild_court_ratings
+            app.logger.warning('Backfilled rating aggregates for %s courts', rebuild_court_ratings())
+        if backfill_locations:
+            from backend.services.user_locations import rebuild_user_locations
+            app.logger.warning('Backfilled effective locations for %s users', rebuild_user_locations())
+        if backfill_fingerprints:
+            from backend.seed import fingerprint_courts
+            app.logger.warning('Fingerprinted %s courts for scraper sync', fingerprint_courts())
+        if backfill_history:
+            from backend.models import RatingHistory
+            from backend.services.rating_history import backfill_rating_history
+            RatingHistory.__table__.create(db.engine, checkfirst=True)
+            app.logger.warning('Backfilled %s rating history rows', backfill_rating_history())
     except Exception:
         app.logger.exception('Schema upgrade failed')
 
@@ -216,6 +286,17 @@ def create_app(config_name=None):
     db.init_app(app)
     _register_blueprints(app)
 
+    @app.before_request
+    def _start_background_workers():
+        if app.extensions.get('background_workers_started'):
+            return
+        app.extensions['background_workers_started'] = True
+        from backend.services.events import get_event_bus
+        get_event_bus(app).start()
+        if app.config.get('BACKGROUND_JOBS_ENABLED'):
+            from backend.jobs import get_scheduler
+            get_scheduler(app).start()
+
     @app.after_request
     def _security_headers(resp):
         resp.headers.setdefault('X-Content-Type-Options', 'nosniff')
@@ -237,11 +318,30 @@ def create_app(config_name=None):
         elif app.config.get('AUTO_CREATE_DB'):
             db.create_all()
         _maybe_auto_seed(app)
+        _warm_court_index(app)
 
     @app.get('/health')
     def health():
         return jsonify({'status': 'ok', 'env': app.config.get('APP_ENV')})
 
+    def health_token_ok():
+        token = app.config.get('HEALTH_TOKEN') or ''
+        return bool(token) and hmac.compare_digest(request.headers.get('X-Health-Token', ''), token)
+
+    @app.get('/health/jobs')
+    def health_jobs():
+        if not health_token_ok():
+            return jsonify({'error': 'forbidden'}), 403
+        from backend.jobs import get_scheduler
+        return jsonify(get_scheduler(app).metrics())
+
+    @app.get('/health/db')
+    def health_db():
+        if not health_token_ok():
+            return jsonify({'error': 'forbidden'}), 403
+        from backend.services.db_pool import pool_metrics
+        return jsonify(pool_metrics(db.engine))
+
     @app.get('/')
     def index():
         return send_from_directory(FRONTEND_DIR, 'index.html')
@@ -259,12 +359,14 @@ def _register_blueprints(app):
     from backend.routes.courts import courts_bp
     from backend.routes.games import games_bp
     from backend.routes.social import social_bp
+    from backend.routes.stream import stream_bp
 
     app.register_blueprint(auth_bp, url_prefix='/api')
     app.register_blueprint(courts_bp, url_prefix='/api')
     app.register_blueprint(games_bp, url_prefix='/api')
     app.register_blueprint(social_bp, url_prefix='/api')
     app.register_blueprint(chat_bp, url_prefix='/api')
+    app.register_blueprint(stream_bp, url_prefix='/api')
 
 
 app = create_app()
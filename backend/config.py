@@ -21,6 +21,12 @@ def _get_int(name, default):
         return default
 
 
+# gunicorn threads per worker (render.yaml / Dockerfile pass the same
+# variable to --threads). Streams and parked chat long-polls take at most
+# EVENT_STREAM_MAX_CLIENTS of them (3/4 by default) and hold no database
+# connection while parked; the rest serve ordinary requests.
+WEB_THREADS = _get_int('WEB_THREADS', 64)
+
 # The app keeps all of its tables in a dedicated Postgres schema so it can
 # never collide with tables left behind by older deployments in `public`.
 PG_SCHEMA = 'picklepals'
@@ -37,9 +43,36 @@ def _database_url():
 
 
 def _engine_options():
-    if _database_url().startswith('postgresql'):
-        return {'connect_args': {'options': f'-csearch_path={PG_SCHEMA}'}}
-    return {}
+    """Postgres pool sizing and timeouts, tunable per deploy.
+
+    Every gunicorn thread may hold a connection for the length of a request,
+    so DB_POOL_SIZE + DB_MAX_OVERFLOW caps concurrent database work per
+    worker; threads past that wait up to DB_POOL_TIMEOUT seconds (see
+    /health/db for checkout waits). By default the overflow makes the pool
+    as large as WEB_THREADS, so no thread ever waits on the pool itself;
+    lower DB_MAX_OVERFLOW when workers * WEB_THREADS would exceed the
+    server's max_connections. DB_STATEMENT_TIMEOUT_MS (0 = off) stops
+    a runaway query from pinning a connection.
+    """
+    if not _database_url().startswith('postgresql'):
+        return {}
+    from backend.services.db_pool import MeteredQueuePool
+    options = f'-csearch_path={PG_SCHEMA}'
+    statement_timeout_ms = _get_int('DB_STATEMENT_TIMEOUT_MS', 15000)
+    if statement_timeout_ms > 0:
+        options += f' -cstatement_timeout={statement_timeout_ms}'
+    return {
+        'connect_args': {'options': options},
+        'poolclass': MeteredQueuePool,
+        'pool_size': _get_int('DB_POOL_SIZE', 10),
+        'max_overflow': _get_int('DB_MAX_OVERFLOW', max(WEB_THREADS - _get_int('DB_POOL_SIZE', 10), 0)),
+        'pool_timeout': _get_int('DB_POOL_TIMEOUT', 10),
+        # Render's Postgres proxy drops idle connections; recycle before that
+        # and ping on checkout so a dropped one is replaced, not surfaced.
+        'pool_recycle': _get_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': _get_bool('DB_POOL_PRE_PING', default=True),
+        'slow_checkout_ms': _get_int('DB_SLOW_CHECKOUT_MS', 100),
+    }
 
 
 class BaseConfig:
@@ -59,10 +92,37 @@ class BaseConfig:
     AUTO_SEED_COURTS = _get_bool('AUTO_SEED_COURTS', default=False)
     RESET_DB_ON_BOOT = _get_bool('RESET_DB_ON_BOOT', default=False)
     PRESENCE_STALE_AFTER_SECONDS = _get_int('PRESENCE_STALE_AFTER_SECONDS', 7200)
+    PRESENCE_REAPER_INTERVAL_SECONDS = _get_int('PRESENCE_REAPER_INTERVAL_SECONDS', 60)
+    GAME_SWEEP_INTERVAL_SECONDS = _get_int('GAME_SWEEP_INTERVAL_SECONDS', 300)
+    GAME_REMINDER_INTERVAL_SECONDS = _get_int('GAME_REMINDER_INTERVAL_SECONDS', 60)
+    # Full rebuild of the in-memory players_here/upcoming_games counters; also
+    # how long a write made by another worker process can take to show up.
+    LIVE_COUNTERS_RECONCILE_SECONDS = _get_int('LIVE_COUNTERS_RECONCILE_SECONDS', 300)
+    # Full rebuild of the materialized leaderboards (rating changes reach them
+    # right away; this catches court state edits and raw SQL writes).
+    LEADERBOARDS_RECONCILE_SECONDS = _get_int('LEADERBOARDS_RECONCILE_SECONDS', 600)
+    # In-process job scheduler (backend/jobs.py). Started on the first request
+    # so CLI tools and imports never spin up threads.
+    BACKGROUND_JOBS_ENABLED = _get_bool('BACKGROUND_JOBS_ENABLED', default=True)
+    # Push events (backend/services/events.py): 'local' for a single worker
+    # process, 'postgres' (LISTEN/NOTIFY) when running several.
+    EVENT_BUS_BACKEND = os.getenv('EVENT_BUS_BACKEND', 'local')
+    # Each open /api/stream holds a gunicorn thread; keep headroom for requests.
+    EVENT_STREAM_MAX_CLIENTS = _get_int('EVENT_STREAM_MAX_CLIENTS', WEB_THREADS * 3 // 4)
+    EVENT_STREAM_MAX_SECONDS = _get_int('EVENT_STREAM_MAX_SECONDS', 55)
+    EVENT_STREAM_HEARTBEAT_SECONDS = _get_int('EVENT_STREAM_HEARTBEAT_SECONDS', 15)
+    # Users whose friend lists are kept in memory (backend/services/social_graph.py).
+    SOCIAL_GRAPH_CACHE_SIZE = _get_int('SOCIAL_GRAPH_CACHE_SIZE', 10000)
+    # How often the in-memory court index re-checks the court table for
+    # changes made by other processes (e.g. a CLI re-import).
+    COURT_INDEX_REFRESH_SECONDS = _get_int('COURT_INDEX_REFRESH_SECONDS', 60)
     RATE_LIMIT_ENABLED = _get_bool('RATE_LIMIT_ENABLED', default=True)
     # Largest legitimate request is a court-photo upload (~500KB image → ~700KB
     # base64 JSON); cap everything at 2MB so oversized bodies get 413s.
     MAX_CONTENT_LENGTH = _get_int('MAX_CONTENT_LENGTH', 2 * 1024 * 1024)
+    # Shared secret for the detailed /health/db and /health/jobs reports
+    # (sent as X-Health-Token); unset disables them. /health stays public.
+    HEALTH_TOKEN = os.getenv('HEALTH_TOKEN', '')
 
 
 class DevelopmentConfig(BaseConfig):
@@ -93,6 +153,7 @@ class TestingConfig(BaseConfig):
     }
     AUTO_CREATE_DB = True
     RATE_LIMIT_ENABLED = False
+    BACKGROUND_JOBS_ENABLED = False
 
 
 CONFIG_BY_NAME = {
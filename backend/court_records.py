@@ -0,0 +1,176 @@
+"""Scraper court records to normalized court rows.
+
+Shared by the importer (backend.seed) and the snapshot compiler
+(backend.snapshot). The compiler runs at build time with no app config and
+no database, so this module imports neither the app nor the models.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from backend.services.court_payloads import normalize_county_slug
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+BUNDLED_COURTS_FILE = os.path.join(DATA_DIR, 'courts.json.gz')
+# Compiled from BUNDLED_COURTS_FILE at build time (python -m backend.snapshot).
+BUNDLED_SNAPSHOT_FILE = os.path.join(DATA_DIR, 'courts.snapshot')
+
+
+def _coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in {'1', 'true', 'yes'}
+
+
+def _coerce_int(value, default=1):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _court_values(record):
+    """Column values for a scraper record (plain dict), or None if unusable."""
+    lat = record.get('latitude')
+    lng = record.get('longitude')
+    if lat is None or lng is None:
+        return None
+    name = str(record.get('name') or '').strip()
+    if not name:
+        return None
+    state = str(record.get('state') or '').strip().upper()[:2] or 'CA'
+    return {
+        'name': name[:255],
+        'address': str(record.get('address') or '').strip()[:255],
+        'city': str(record.get('city') or '').strip()[:120],
+        'state': state,
+        'county_slug': normalize_county_slug(record.get('county_slug'), fallback=''),
+        'zip_code': str(record.get('zip_code') or '').strip()[:12],
+        'latitude': float(lat),
+        'longitude': float(lng),
+        'indoor': _coerce_bool(record.get('indoor')),
+        'lighted': _coerce_bool(record.get('lighted')),
+        'num_courts': _coerce_int(record.get('num_courts'), default=1),
+        'surface_type': str(record.get('surface_type') or '').strip()[:120],
+        'court_type': str(record.get('court_type') or '').strip()[:40],
+        'open_play_schedule': str(record.get('open_play_schedule') or '').strip(),
+        'fees': str(record.get('fees') or '').strip()[:255],
+        'phone': str(record.get('phone') or '').strip()[:40],
+        'website': str(record.get('website') or '').strip()[:500],
+        'photo_url': str(record.get('photo_url') or '').strip()[:500],
+        'has_restrooms': _coerce_bool(record.get('has_restrooms')),
+        'has_water': _coerce_bool(record.get('has_water')),
+        'nets_provided': _coerce_bool(record.get('nets_provided')),
+        'verified': _coerce_bool(record.get('verified')),
+    }
+
+
+# Court columns filled from a scraper record (the keys of _court_values).
+SOURCE_FIELDS = (
+    'name', 'address', 'city', 'state', 'county_slug', 'zip_code', 'latitude', 'longitude',
+    'indoor', 'lighted', 'num_courts', 'surface_type', 'court_type', 'open_play_schedule',
+    'fees', 'phone', 'website', 'photo_url', 'has_restrooms', 'has_water', 'nets_provided',
+    'verified',
+)
+
+
+def fingerprint(values):
+    """Content hash of a court's SOURCE_FIELDS (stored as Court.source_hash)."""
+    payload = json.dumps([values[name] for name in SOURCE_FIELDS], separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+# Community uploads (POST /api/courts/<id>/photo) set photo_url to a path
+# under this prefix. They are not scraped data: syncs keep them and the
+# fingerprint hashes the empty photo_url they replaced.
+COMMUNITY_PHOTO_PREFIX = '/api/courts/'
+
+
+def scraped_values(values):
+    """Stored court values as the scraper last supplied them."""
+    if values['photo_url'].startswith(COMMUNITY_PHOTO_PREFIX):
+        return {**values, 'photo_url': ''}
+    return values
+
+
+def _court_key(values):
+    return values['name'].lower(), round(values['latitude'], 5), round(values['longitude'], 5)
+
+
+def iter_json_array(handle, chunk_size=1 << 16):
+    """Yield the items of a top-level JSON array, reading `handle` (text) a
+    chunk at a time so only one item is ever materialized."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = handle.read(chunk_size)
+        buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            fill()
+
+    if peek() != '[':
+        raise ValueError('does not contain a JSON list')
+    pos += 1
+    if peek() == ']':
+        return
+    while True:
+        peek()
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+            # A scalar cut off at the chunk edge ("12" of "123") still parses.
+            complete = end < len(buf) or eof
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            fill()
+            continue
+        pos = end
+        yield item
+        separator = peek()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f'malformed JSON list near offset {pos}')
+        pos += 1
+
+
+def _normalized_rows(records):
+    """Column dicts (with source_hash) for the usable scraper records."""
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        values = _court_values(record)
+        if values is not None:
+            yield {**values, 'source_hash': fingerprint(values)}
+
+
+def _new_court_rows(rows, seen):
+    """Normalized rows whose key isn't in `seen` (updated)."""
+    for values in rows:
+        key = _court_key(values)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield values
+
+
+def _court_file_records(path):
+    """Stream the records of a single JSON file (optionally gzipped)."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as handle:
+        try:
+            yield from iter_json_array(handle)
+        except ValueError as exc:
+            raise ValueError(f'{path}: {exc}') from exc
@@ -0,0 +1,181 @@
+"""In-process background job scheduler.
+
+Periodic maintenance (presence reaping, ranked auto-confirm, weekly session
+roll-forward, game reminders) used to run inline on feed and /me reads. Jobs
+are now registered here with an interval and jitter and run from a single
+daemon thread per worker process. Before each run the scheduler takes a
+per-job worker lease (backend.services.leases), so with several gunicorn
+workers a job still runs once per interval, not once per worker. Jobs that
+refresh per-process state (live counter and leaderboard reconciliation)
+register with exclusive=False and run in every worker.
+
+Each job keeps a short run history plus counters, exposed at /health/jobs.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from backend.app import db
+from backend.models import utcnow
+from backend.services.leases import acquire_lease
+
+HISTORY_SIZE = 20
+TICK_SECONDS = 1.0
+
+
+class Job:
+    def __init__(self, name, func, interval, jitter=0.0, exclusive=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.exclusive = exclusive
+        self.next_run = 0.0
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.stats = {
+            'runs': 0,
+            'errors': 0,
+            'skipped_not_leader': 0,
+            'total_result': 0,
+            'is_leader': False,
+        }
+
+    @property
+    def lease_ttl(self):
+        # Survive a couple of missed ticks before another worker takes over.
+        return max(self.interval * 3, 30)
+
+    def schedule_next(self, now):
+        self.next_run = now + self.interval + random.uniform(0, self.jitter)
+
+    def metrics(self):
+        return {
+            'interval_seconds': self.interval,
+            'jitter_seconds': self.jitter,
+            **self.stats,
+            'history': list(self.history),
+        }
+
+
+class Scheduler:
+    def __init__(self, app):
+        self.app = app
+        self.jobs = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, name, func, interval, jitter=0.0, exclusive=True):
+        """Register `func` (called inside an app context, returns a count of
+        rows it touched or None) to run every `interval` (+ up to `jitter`) seconds.
+        Non-exclusive jobs skip the lease and run in every worker process."""
+        job = Job(name, func, interval, jitter, exclusive)
+        # Stagger first runs so workers booted together don't all race for leases.
+        job.next_run = time.monotonic() + random.uniform(0, jitter or 1.0)
+        self.jobs[name] = job
+        return job
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='job-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(TICK_SECONDS):
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if now >= job.next_run:
+                    self.run_job(job.name)
+
+    def run_job(self, name):
+        """Run one job now (respecting its lease). Returns its result, or None
+        when skipped or failed."""
+        job = self.jobs[name]
+        job.schedule_next(time.monotonic())
+        started_at = utcnow().isoformat() + 'Z'
+        started = time.perf_counter()
+        entry = {'started_at': started_at, 'status': 'ok', 'result': None}
+        ran = False
+        with self.app.app_context():
+            try:
+                if job.exclusive and not acquire_lease(f'job:{name}', ttl_seconds=job.lease_ttl):
+                    job.stats['is_leader'] = False
+                    job.stats['skipped_not_leader'] += 1
+                    return None
+                job.stats['is_leader'] = ran = True
+                result = job.func()
+                entry['result'] = result
+                job.stats['runs'] += 1
+                if isinstance(result, int):
+                    job.stats['total_result'] += result
+                return result
+            except Exception as exc:
+                db.session.rollback()
+                job.stats['errors'] += 1
+                entry['status'] = 'error'
+                entry['error'] = f'{type(exc).__name__}: {exc}'[:200]
+                self.app.logger.exception('Background job %s failed', name)
+                return None
+            finally:
+                if ran:
+                    entry['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                    job.history.appendleft(entry)
+
+    def metrics(self):
+        return {name: job.metrics() for name, job in self.jobs.items()}
+
+
+def _register_default_jobs(scheduler):
+    from backend.routes.games import (
+        auto_confirm_stale_scores,
+        roll_forward_recurring,
+        send_game_reminders,
+    )
+    from backend.services.leaderboards import reconcile_leaderboards
+    from backend.services.live_counters import reconcile_live_counters
+    from backend.services.presence import expire_stale_presence
+
+    config = scheduler.app.config
+    scheduler.register(
+        'presence_reaper', expire_stale_presence,
+        interval=config.get('PRESENCE_REAPER_INTERVAL_SECONDS', 60), jitter=5,
+    )
+    scheduler.register(
+        'live_counters_reconcile', reconcile_live_counters,
+        interval=config.get('LIVE_COUNTERS_RECONCILE_SECONDS', 300), jitter=30,
+        exclusive=False,
+    )
+    scheduler.register(
+        'leaderboards_reconcile', reconcile_leaderboards,
+        interval=config.get('LEADERBOARDS_RECONCILE_SECONDS', 600), jitter=60,
+        exclusive=False,
+    )
+    scheduler.register(
+        'auto_confirm_scores', auto_confirm_stale_scores,
+        interval=config.get('GAME_SWEEP_INTERVAL_SECONDS', 300), jitter=30,
+    )
+    scheduler.register(
+        'roll_forward_recurring', roll_forward_recurring,
+        interval=config.get('GAME_SWEEP_INTERVAL_SECONDS', 300), jitter=30,
+    )
+    # Reminders have a 65-minute lead window, so a minute of lag is harmless.
+    scheduler.register(
+        'game_reminders', send_game_reminders,
+        interval=config.get('GAME_REMINDER_INTERVAL_SECONDS', 60), jitter=5,
+    )
+
+
+def get_scheduler(app=None):
+    app = app or current_app
+    scheduler = app.extensions.get('scheduler')
+    if scheduler is None:
+        scheduler = Scheduler(app)
+        _register_default_jobs(scheduler)
+        app.extensions['scheduler'] = scheduler
+    return scheduler
@@ -31,6 +31,10 @@ DEFAULT_RATING = 1200
 
 
 class User(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_user_geo_cell_rating', 'geo_cell', 'rating'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), nullable=False, unique=True, index=True)
     password_hash = db.Column(db.String(255), nullable=False)
@@ -53,6 +57,11 @@ class User(TimestampMixin, db.Model):
     home_lat = db.Column(db.Float)
     home_lng = db.Column(db.Float)
     home_area = db.Column(db.String(120))
+    # Effective location: last check-in, else home court. Maintained by
+    # backend.services.user_locations; geo_cell is its grid cell.
+    loc_lat = db.Column(db.Float)
+    loc_lng = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer)
 
     home_court = db.relationship('Court', foreign_keys=[home_court_id])
     checkins = db.relationship(
@@ -119,6 +128,15 @@ class Court(TimestampMixin, db.Model):
     has_water = db.Column(db.Boolean, nullable=False, default=False)
     nets_provided = db.Column(db.Boolean, nullable=False, default=False)
     verified = db.Column(db.Boolean, nullable=False, default=False)
+    # Review aggregates, maintained by backend.services.court_ratings.
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_avg = db.Column(db.Float, index=True)
+    # Scraper sync (python -m backend.seed --sync): fingerprint of the
+    # imported fields, and whether the court dropped out of the last feed
+    # (stale courts stay for history but leave the map and search).
+    source_hash = db.Column(db.String(40))
+    stale = db.Column(db.Boolean, nullable=False, default=False)
 
     checkins = db.relationship('CheckIn', back_populates='court', lazy='dynamic')
     games = db.relationship('Game', back_populates='court', lazy='dynamic')
@@ -205,21 +223,17 @@ class BlockedUser(TimestampMixin, db.Model):
 
 
 def is_blocked_between(user_a_id, user_b_id):
-    """True when either user has blocked the other."""
-    return db.session.query(BlockedUser.id).filter(
-        db.or_(
-            db.and_(BlockedUser.blocker_id == user_a_id, BlockedUser.blocked_id == user_b_id),
-            db.and_(BlockedUser.blocker_id == user_b_id, BlockedUser.blocked_id == user_a_id),
-        )
-    ).first() is not None
+    """True when either user has blocked the other (served from the social
+    graph cache, backend.services.social_graph)."""
+    from backend.services.social_graph import get_social_graph
+    return get_social_graph().is_blocked_between(user_a_id, user_b_id)
 
 
 def blocked_pair_ids(user_id):
-    """All user ids hidden from user_id: people they blocked or who blocked them."""
-    rows = BlockedUser.query.filter(
-        db.or_(BlockedUser.blocker_id == user_id, BlockedUser.blocked_id == user_id)
-    ).all()
-    return {r.blocked_id if r.blocker_id == user_id else r.blocker_id for r in rows}
+    """All user ids hidden from user_id: people they blocked or who blocked
+    them (cached, read-only)."""
+    from backend.services.social_graph import get_social_graph
+    return get_social_graph().blocked_ids(user_id)
 
 
 class Message(TimestampMixin, db.Model):
@@ -391,6 +405,21 @@ class GameInvite(TimestampMixin, db.Model):
     user = db.relationship('User')
 
 
+class RatingHistory(db.Model):
+    """Append-only log of rating changes: one row per player per finalized
+    ranked game (backend.services.rating_history)."""
+    __table_args__ = (
+        db.Index('ix_rating_history_user_time', 'user_id', 'recorded_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), index=True)
+    rating_before = db.Column(db.Integer, nullable=False)
+    rating_after = db.Column(db.Integer, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+
 class FavoriteCourt(TimestampMixin, db.Model):
     __table_args__ = (
         db.UniqueConstraint('user_id', 'court_id', name='uq_favorite_court'),
@@ -455,6 +484,14 @@ class Notification(TimestampMixin, db.Model):
         }
 
 
+class WorkerLease(TimestampMixin, db.Model):
+    """A named, expiring lock row so only one worker process runs a given
+    background task (e.g. the presence reaper) at a time."""
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(120), nullable=False, default='')
+    expires_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+
 def notify(user_id, kind, title, body='', related_user_id=None, related_game_id=None):
     db.session.add(Notification(
         user_id=user_id,
@@ -0,0 +1,211 @@
+"""Recompute every rating from scratch by replaying the ranked game log.
+
+Usage:
+    python -m backend.replay_ratings             # rewrite ratings, W/L, streaks, deltas
+    python -m backend.replay_ratings --dry-run   # only report what would change
+    python -m backend.replay_ratings --k 24      # replay with a different K factor
+
+Run after resolving a scoring dispute or tuning ELO_K. Completed ranked games
+are streamed in completion order and folded into flat per-player arrays with
+the same team-average ELO the app applies on confirmation
+(backend.routes.games.team_elo_delta). Per-game deltas and rating history are
+written in batches as the replay goes; player totals are written at the end,
+all in one transaction. Running app workers pick the new ratings up on their
+next leaderboard reconcile (LEADERBOARDS_RECONCILE_SECONDS).
+"""
+import argparse
+import time
+from array import array
+
+from sqlalchemy import delete, func, insert, select, update
+
+from backend.app import create_app, db
+from backend.models import DEFAULT_RATING, Game, GamePlayer, RatingHistory, User
+from backend.routes.games import ELO_K, team_elo_delta
+from backend.services.db_pool import lift_statement_timeout
+from backend.services.events import bulk_event, publish
+
+STREAM_BATCH = 5000
+WRITE_BATCH = 5000
+PROGRESS_EVERY = 50000
+
+
+class Ledger:
+    """Rating state for every player, in flat arrays indexed by slot."""
+
+    def __init__(self, user_ids):
+        n = len(user_ids)
+        self.slot = {uid: i for i, uid in enumerate(user_ids)}
+        self.user_ids = user_ids
+        self.rating = array('l', [DEFAULT_RATING]) * n
+        self.wins = array('l', [0]) * n
+        self.losses = array('l', [0]) * n
+        self.streak = array('l', [0]) * n
+        self.best = array('l', [0]) * n
+
+    def play(self, team1, team2, team1_won, k):
+        """Apply one game to the players in slots team1/team2 (mirrors
+        _apply_elo); returns team 1's delta."""
+        rating = self.rating
+        delta1 = team_elo_delta(
+            [rating[s] for s in team1], [rating[s] for s in team2], team1_won, k,
+        )
+        for s in team1:
+            rating[s] += delta1
+        for s in team2:
+            rating[s] -= delta1
+        winners, losers = (team1, team2) if team1_won else (team2, team1)
+        for s in winners:
+            self.wins[s] += 1
+            self.streak[s] += 1
+            self.best[s] = max(self.best[s], self.streak[s])
+        for s in losers:
+            self.losses[s] += 1
+            self.streak[s] = 0
+        return delta1
+
+    def totals(self, s):
+        return self.rating[s], self.wins[s], self.losses[s], self.streak[s], self.best[s]
+
+
+class BatchWriter:
+    """Buffers rows for one bulk statement, executing every WRITE_BATCH rows
+    (or only counting them on a dry run)."""
+
+    def __init__(self, statement, dry_run):
+        self.statement = statement
+        self.dry_run = dry_run
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        self.count += 1
+        if len(self.rows) >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.rows and not self.dry_run:
+            db.session.execute(self.statement, self.rows)
+        self.rows = []
+
+
+def _ranked_games():
+    """Yield (game_id, finished_at, team1_won, [(player_id, user_id, team,
+    rating_delta), …]) for completed ranked games, oldest first."""
+    finished_at = func.coalesce(Game.completed_at, Game.scheduled_at)
+    rows = db.session.execute(
+        select(
+            Game.id, finished_at, Game.score_team1, Game.score_team2,
+            GamePlayer.id, GamePlayer.user_id, GamePlayer.team, GamePlayer.rating_delta,
+        )
+        .join(GamePlayer, GamePlayer.game_id == Game.id)
+        .where(Game.game_type == 'ranked', Game.status == 'completed')
+        .order_by(finished_at, Game.id, GamePlayer.id)
+        .execution_options(yield_per=STREAM_BATCH)
+    )
+    game = None
+    for game_id, at, score1, score2, player_id, user_id, team, delta in rows:
+        if game is None or game[0] != game_id:
+            if game is not None:
+                yield game
+            game = (game_id, at, (score1 or 0) > (score2 or 0), [])
+        game[3].append((player_id, user_id, team, delta))
+    if game is not None:
+        yield game
+
+
+def replay(k=ELO_K, dry_run=False, log=print):
+    """Replay every completed ranked game. Returns counters: games, players
+    and per-game deltas changed, elapsed seconds and games/sec."""
+    started = time.perf_counter()
+    lift_statement_timeout(db.session)
+    current = {
+        uid: tuple(values) for uid, *values in db.session.execute(select(
+            User.id, User.rating, User.ranked_wins, User.ranked_losses,
+            User.current_streak, User.best_streak,
+        ))
+    }
+    ledger = Ledger(sorted(current))
+    deltas = BatchWriter(update(GamePlayer), dry_run)
+    history = BatchWriter(insert(RatingHistory), dry_run)
+    if not dry_run:
+        # History is derived from the game log; rebuilt alongside the ratings.
+        db.session.execute(delete(RatingHistory))
+
+    games = 0
+    for game_id, at, team1_won, players in _ranked_games():
+        team1 = [ledger.slot[uid] for _pid, uid, team, _d in players if team == 1]
+        team2 = [ledger.slot[uid] for _pid, uid, team, _d in players if team == 2]
+        if not team1 or not team2:
+            continue
+        before = {s: ledger.rating[s] for s in team1 + team2}
+        delta1 = ledger.play(team1, team2, team1_won, k)
+        for player_id, uid, team, old_delta in players:
+            if team not in (1, 2):
+                continue
+            new_delta = delta1 if team == 1 else -delta1
+            if new_delta != old_delta:
+                deltas.add({'id': player_id, 'rating_delta': new_delta})
+            s = ledger.slot[uid]
+            history.add({
+                'user_id': uid, 'game_id': game_id, 'recorded_at': at,
+                'rating_before': before[s], 'rating_after': ledger.rating[s],
+            })
+        games += 1
+        if games % PROGRESS_EVERY == 0:
+            log(f'  {games} games ({games / (time.perf_counter() - started):.0f}/s)')
+    deltas.flush()
+    history.flush()
+
+    players = BatchWriter(update(User), dry_run)
+    for s, uid in enumerate(ledger.user_ids):
+        totals = ledger.totals(s)
+        if totals != current[uid]:
+            rating, wins, losses, streak, best = totals
+            players.add({
+                'id': uid, 'rating': rating, 'ranked_wins': wins, 'ranked_losses': losses,
+                'current_streak': streak, 'best_streak': best,
+            })
+    players.flush()
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        # Core writes skip the ORM event hooks; /me caches drop on this.
+        publish([bulk_event('ratings')])
+
+    elapsed = time.perf_counter() - started
+    return {
+        'games': games,
+        'players_changed': players.count,
+        'deltas_changed': deltas.count,
+        'history_rows': history.count,
+        'seconds': round(elapsed, 3),
+        'games_per_second': round(games / elapsed) if elapsed else games,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute ratings by replaying ranked games.')
+    parser.add_argument('--k', type=int, default=ELO_K, help=f'ELO K factor (default {ELO_K})')
+    parser.add_argument('--dry-run', action='store_true', help='Report changes without writing')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        stats = replay(k=args.k, dry_run=args.dry_run)
+    verb = 'Would change' if args.dry_run else 'Changed'
+    print(
+        f"Replayed {stats['games']} ranked games in {stats['seconds']}s "
+        f"({stats['games_per_second']} games/s, K={args.k})."
+    )
+    print(
+        f"{verb} {stats['players_changed']} players and "
+        f"{stats['deltas_changed']} per-game deltas; "
+        f"{stats['history_rows']} rating history rows."
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,12 @@ import time
 from functools import wraps
 
 import jwt
-from flask import Blueprint, current_app, g, jsonify, request
+from flask import Blueprint, Response, current_app, g, jsonify, request
 
 from backend.app import db
 from backend.security import rate_limit
+from backend.services.game_payloads import serialize_games
+from backend.services.me_versions import get_me_versions
 from backend.models import (
     CheckIn,
     Court,
@@ -27,14 +29,19 @@ auth_bp = Blueprint('auth', __name__)
 _EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
 
 
-def _issue_token(user):
+def issue_token(user, scope=None, ttl=None):
+    """Session JWT, or with `scope` a narrow token that only the endpoint
+    checking that scope accepts (e.g. the short-lived stream ticket)."""
     now = int(time.time())
+    claims = {
+        'user_id': user.id,
+        'iat': now,
+        'exp': now + int(ttl or current_app.config.get('JWT_TTL_SECONDS', 2592000)),
+    }
+    if scope:
+        claims['scope'] = scope
     return jwt.encode(
-        {
-            'user_id': user.id,
-            'iat': now,
-            'exp': now + int(current_app.config.get('JWT_TTL_SECONDS', 2592000)),
-        },
+        claims,
         current_app.config['SECRET_KEY'],
         algorithm=current_app.config.get('JWT_ALGORITHM', 'HS256'),
     )
@@ -44,7 +51,10 @@ def optional_current_user():
     auth_header = str(request.headers.get('Authorization') or '').strip()
     if not auth_header.startswith('Bearer '):
         return None
-    token = auth_header.split(' ', 1)[1].strip()
+    return user_from_token(auth_header.split(' ', 1)[1].strip())
+
+
+def user_from_token(token, scope=None):
     if not token:
         return None
     try:
@@ -56,7 +66,7 @@ def optional_current_user():
     except Exception:
         return None
     user_id = payload.get('user_id')
-    if not user_id:
+    if not user_id or payload.get('scope') != scope:
         return None
     return db.session.get(User, user_id)
 
@@ -116,12 +126,19 @@ def _games_to_confirm_count(user_id):
 
 
 def _active_game_payload(user):
-    """The single most relevant game for the banner.
+    """The single most relevant game for the banner, plus when the banner next
+    changes on its own, or None.
+
+    The clock only moves a game across one boundary: its start, where an
+    upcoming game you're in goes live. A live game has no end time; it leaves
+    the banner through a write (score report, cancel, recurring roll-forward),
+    which publishes a user event like any other change.
 
     Priority: live game you're in > incoming challenge > score waiting on you
     > your score waiting on opponents > your next upcoming game."""
     now = utcnow()
     candidates = []
+    changes_at = None
 
     games = (
         Game.query.join(GamePlayer)
@@ -133,8 +150,7 @@ def _active_game_payload(user):
         .limit(25)
         .all()
     )
-    for game in games:
-        data = game.to_dict(user.id)
+    for game, data in zip(games, serialize_games(games, user.id)):
         if game.status == 'upcoming' and game.scheduled_at <= now:
             rank, banner_state = 0, 'live'
         elif data['awaiting_your_confirmation']:
@@ -143,6 +159,8 @@ def _active_game_payload(user):
             rank, banner_state = 4, 'waiting'
         else:
             rank, banner_state = 5, 'upcoming'
+        if game.status == 'upcoming' and game.scheduled_at > now:
+            changes_at = min(changes_at or game.scheduled_at, game.scheduled_at)
         data['banner_state'] = banner_state
         candidates.append((rank, data))
 
@@ -155,8 +173,7 @@ def _active_game_payload(user):
         .limit(15)
         .all()
     )
-    for game in invited_games:
-        data = game.to_dict(user.id)
+    for game, data in zip(invited_games, serialize_games(invited_games, user.id)):
         if data['is_joined'] or data['spots_left'] <= 0:
             continue
         is_challenge = game.notes.startswith('⚔️')
@@ -168,12 +185,13 @@ def _active_game_payload(user):
             candidates.append((3, data))
 
     if not candidates:
-        return None
+        return None, changes_at
     candidates.sort(key=lambda c: (c[0], c[1]['scheduled_at'] or ''))
-    return candidates[0][1]
+    return candidates[0][1], changes_at
 
 
-def _me_payload(user):
+def _me_snapshot(user):
+    """(/me payload, time after which it goes stale without any write)."""
     unread_messages = Message.query.filter_by(recipient_id=user.id, read_at=None).count()
     pending_requests = Friendship.query.filter_by(
         addressee_id=user.id, status='pending',
@@ -186,6 +204,7 @@ def _me_payload(user):
         .order_by(Notification.id.desc())
         .first()
     )
+    active_game, valid_until = _active_game_payload(user)
     return {
         'user': user.to_dict(),
         'presence': presence_payload(user.id),
@@ -194,8 +213,12 @@ def _me_payload(user):
         'unread_notifications': unread_notifications,
         'games_to_confirm': _games_to_confirm_count(user.id),
         'latest_notification': latest.to_dict() if latest else None,
-        'active_game': _active_game_payload(user),
-    }
+        'active_game': active_game,
+    }, valid_until
+
+
+def _me_payload(user):
+    return _me_snapshot(user)[0]
 
 
 @auth_bp.post('/auth/register')
@@ -219,7 +242,7 @@ def register():
     user.set_password(password)
     db.session.add(user)
     db.session.commit()
-    return jsonify({'token': _issue_token(user), **_me_payload(user)}), 201
+    return jsonify({'token': issue_token(user), **_me_payload(user)}), 201
 
 
 @auth_bp.post('/auth/login')
@@ -232,16 +255,31 @@ def login():
     user = User.query.filter_by(email=email).first()
     if not user or not user.check_password(password):
         return jsonify({'error': 'invalid_credentials'}), 401
-    return jsonify({'token': _issue_token(user), **_me_payload(user)})
+    return jsonify({'token': issue_token(user), **_me_payload(user)})
 
 
 @auth_bp.get('/me')
 @login_required
 def me():
-    # Lazy import: games.py imports from this module at load time.
-    from backend.routes.games import send_game_reminders
-    send_game_reminders()
-    return jsonify(_me_payload(g.current_user))
+    """Polled by every tab; revalidates with If-None-Match against the user's
+    version counter (backend.services.me_versions) and answers 304 while
+    nothing feeding the payload has changed."""
+    user_id = g.current_user.id
+    versions = get_me_versions()
+    headers = {'Cache-Control': 'private, no-cache', 'Vary': 'Authorization'}
+    etag = versions.valid_etag(user_id, utcnow())
+    if etag and request.if_none_match.contains(etag):
+        resp = Response(status=304, headers=headers)
+        resp.set_etag(etag)
+        return resp
+
+    etag = versions.etag(user_id)
+    payload, valid_until = _me_snapshot(g.current_user)
+    versions.remember(user_id, etag, valid_until)
+    resp = jsonify(payload)
+    resp.headers.update(headers)
+    resp.set_etag(etag)
+    return resp
 
 
 @auth_bp.patch('/me')
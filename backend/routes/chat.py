@@ -1,15 +1,57 @@
-"""Direct messaging between players, plus per-court chat rooms."""
-from flask import Blueprint, g, jsonify, request
+"""Direct messaging between players, plus per-court chat rooms.
+
+Both message endpoints long-poll with `since_id=…&wait=<seconds>`: when
+nothing is newer than since_id the request parks on the event bus until a
+message for that room/conversation commits or the wait runs out.
+"""
+import time
+
+from flask import Blueprint, current_app, g, jsonify, request
 from sqlalchemy import or_
 
 from backend.app import db
 from backend.models import Court, Message, User, blocked_pair_ids, is_blocked_between, utcnow
 from backend.security import rate_limit
+from backend.services.events import get_event_bus
 
 chat_bp = Blueprint('chat', __name__)
 
 from backend.routes.auth import login_required  # noqa: E402
 
+MAX_WAIT_SECONDS = 25
+
+
+def _long_poll(fetch, channel, matches):
+    """fetch() now; if it's empty and the client asked to wait, block until an
+    event on `channel` accepted by matches(event) arrives, then fetch again."""
+    wait = min(max(request.args.get('wait', default=0, type=float), 0.0), MAX_WAIT_SECONDS)
+    bus = get_event_bus()
+    # Waiting parks a worker thread: share the stream slots, and answer right
+    # away when they're all taken (the client just polls again).
+    if 'since_id' not in request.args or wait <= 0 or \
+            not bus.open_stream(current_app.config.get('EVENT_STREAM_MAX_CLIENTS', 48)):
+        return fetch()
+    # Subscribe before the first read so a message committed in between wakes us.
+    sub = bus.subscribe([channel])
+    try:
+        rows = fetch()
+        deadline = time.monotonic() + wait
+        while not rows:
+            # Don't hold a pooled connection (and open transaction) while parked.
+            db.session.commit()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            evt = sub.get(remaining)
+            if evt is None:
+                break
+            if matches(evt):
+                rows = fetch()
+        return rows
+    finally:
+        bus.unsubscribe(sub)
+        bus.close_stream()
+
 
 @chat_bp.get('/courts/<int:court_id>/chat')
 @login_required
@@ -18,11 +60,16 @@ def court_chat(court_id):
     if not court:
         return jsonify({'error': 'court_not_found'}), 404
     since_id = request.args.get('since_id', type=int)
-    query = Message.query.filter(Message.court_id == court_id)
-    if since_id:
-        messages = query.filter(Message.id > since_id).order_by(Message.id.asc()).all()
-    else:
-        messages = list(reversed(query.order_by(Message.id.desc()).limit(60).all()))
+
+    def fetch():
+        query = Message.query.filter(Message.court_id == court_id)
+        if since_id:
+            return query.filter(Message.id > since_id).order_by(Message.id.asc()).all()
+        return list(reversed(query.order_by(Message.id.desc()).limit(60).all()))
+
+    messages = _long_poll(
+        fetch, f'court:{court_id}', lambda evt: evt['type'] == 'court_message',
+    )
     return jsonify({
         'court': {'id': court.id, 'name': court.name},
         'items': [m.to_dict() for m in messages],
@@ -96,18 +143,23 @@ def thread(user_id):
         return jsonify({'error': 'user_not_found'}), 404
 
     since_id = request.args.get('since_id', type=int)
-    query = Message.query.filter(
-        Message.court_id.is_(None),
-        or_(
-            (Message.sender_id == me) & (Message.recipient_id == user_id),
-            (Message.sender_id == user_id) & (Message.recipient_id == me),
-        ),
+
+    def fetch():
+        query = Message.query.filter(
+            Message.court_id.is_(None),
+            or_(
+                (Message.sender_id == me) & (Message.recipient_id == user_id),
+                (Message.sender_id == user_id) & (Message.recipient_id == me),
+            ),
+        )
+        if since_id:
+            return query.filter(Message.id > since_id).order_by(Message.id.asc()).all()
+        return list(reversed(query.order_by(Message.id.desc()).limit(100).all()))
+
+    messages = _long_poll(
+        fetch, f'user:{me}',
+        lambda evt: evt['type'] == 'message' and user_id in (evt['sender_id'], evt['recipient_id']),
     )
-    if since_id:
-        query = query.filter(Message.id > since_id)
-        messages = query.order_by(Message.id.asc()).all()
-    else:
-        messages = list(reversed(query.order_by(Message.id.desc()).limit(100).all()))
 
     now = utcnow()
     changed = False
@@ -3,23 +3,45 @@ import base64
 import json
 import math
 import re
+import struct
 import time
 import urllib.parse
 import urllib.request
 from datetime import timedelta
 
 from flask import Blueprint, Response, current_app, g, jsonify, request
-from sqlalchemy import func
 
 from backend.app import db
 from backend.models import CheckIn, Court, CourtReview, FavoriteCourt, Game, GamePlayer, utcnow
 from backend.routes.auth import active_checkin_for, login_required, optional_current_user, presence_payload
 from backend.routes.social import friend_ids
 from backend.security import rate_limit
+from backend.services.court_index import (
+    MAX_CLUSTER_ZOOM,
+    cluster_key,
+    get_court_index,
+    haversine_miles,
+    tile_bounds,
+)
+from backend.services.court_ratings import rating_fields, record_review_rating
+from backend.services.game_payloads import serialize_games
+from backend.services.live_counters import get_live_counters
 
 courts_bp = Blueprint('courts', __name__)
 
 MAX_COURT_RESULTS = 300
+MAX_SUGGESTIONS = 20
+# Below this zoom a tile would hold a large share of the country; the map uses
+# /courts/clusters there instead.
+TILE_MIN_ZOOM = 6
+TILE_MAX_ZOOM = MAX_CLUSTER_ZOOM
+TILE_MAX_AGE = 60 * 60
+# Binary tile layout (little-endian): magic, format version, record count,
+# then per court: id u32, lat f32, lng f32, num_courts u16, flags u8.
+TILE_HEADER = struct.Struct('<4sHI')
+TILE_RECORD = struct.Struct('<IffHB')
+TILE_FLAG_INDOOR = 1
+TILE_FLAG_LIGHTED = 2
 
 # --- Geocoding (OpenStreetMap Nominatim proxy) ---
 _GEOCODE_CACHE = {}
@@ -121,140 +143,101 @@ def geocode_reverse():
     return jsonify({'label': place['label'] if place else ''})
 
 
-def cleanup_stale_presence():
-    """Auto check-out anyone whose presence ping is older than the staleness window."""
-    cutoff = utcnow() - timedelta(
-        seconds=int(current_app.config.get('PRESENCE_STALE_AFTER_SECONDS', 7200) or 7200),
-    )
-    stale = CheckIn.query.filter(
-        CheckIn.checked_out_at.is_(None),
-        CheckIn.last_presence_ping_at < cutoff,
-    ).all()
-    for checkin in stale:
-        checkin.checked_out_at = cutoff
-    if stale:
-        db.session.commit()
-
-
-def haversine_miles(lat1, lng1, lat2, lng2):
-    radius_miles = 3958.8
-    p1, p2 = math.radians(lat1), math.radians(lat2)
-    dlat = math.radians(lat2 - lat1)
-    dlng = math.radians(lng2 - lng1)
-    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
-    return 2 * radius_miles * math.asin(math.sqrt(a))
-
-
-def _rating_summary_for(court_ids):
-    """Batch {court_id: {avg, count}} for a list of courts."""
-    if not court_ids:
-        return {}
-    rows = (
-        db.session.query(
-            CourtReview.court_id,
-            func.avg(CourtReview.rating),
-            func.count(CourtReview.id),
-        )
-        .filter(CourtReview.court_id.in_(court_ids))
-        .group_by(CourtReview.court_id)
-        .all()
-    )
-    return {
-        cid: {'rating_avg': round(float(avg), 1), 'rating_count': int(count)}
-        for cid, avg, count in rows
-    }
-
-
-def _active_counts_for(court_ids):
-    if not court_ids:
+def _active_counts_for(court_ids=None):
+    """({court_id: players checked in}, {court_id: upcoming games}); every
+    court with activity when court_ids is None."""
+    if court_ids is not None and not court_ids:
         return {}, {}
-    rows = (
-        db.session.query(CheckIn.court_id, func.count(CheckIn.id))
-        .filter(CheckIn.court_id.in_(court_ids), CheckIn.checked_out_at.is_(None))
-        .group_by(CheckIn.court_id)
-        .all()
-    )
-    players = {court_id: count for court_id, count in rows}
-    game_rows = (
-        db.session.query(Game.court_id, func.count(Game.id))
-        .filter(
-            Game.court_id.in_(court_ids),
-            Game.status == 'upcoming',
-            Game.scheduled_at >= utcnow(),
-        )
-        .group_by(Game.court_id)
-        .all()
-    )
-    games = {court_id: count for court_id, count in game_rows}
-    return players, games
+    return get_live_counters().counts(court_ids)
 
 
 @courts_bp.get('/courts')
 def list_courts():
-    """Court search: by map bounds (west,south,east,north) or lat/lng radius, plus text query."""
-    cleanup_stale_presence()
-    query = Court.query.filter(Court.latitude.isnot(None), Court.longitude.isnot(None))
-
+    """Court search: by map bounds (west,south,east,north) or lat/lng radius, plus text query
+    (token-prefix match, most relevant first)."""
     text = str(request.args.get('q') or '').strip()
-    if text:
-        like = f'%{text}%'
-        query = query.filter(
-            Court.name.ilike(like) | Court.city.ilike(like) | Court.address.ilike(like)
-        )
-
-    if str(request.args.get('lighted') or '') in {'1', 'true'}:
-        query = query.filter(Court.lighted.is_(True))
-    if str(request.args.get('indoor') or '') in {'1', 'true'}:
-        query = query.filter(Court.indoor.is_(True))
+    lighted_only = str(request.args.get('lighted') or '') in {'1', 'true'}
+    indoor_only = str(request.args.get('indoor') or '') in {'1', 'true'}
+    active_only = str(request.args.get('active') or '') in {'1', 'true'}
 
     bbox = str(request.args.get('bbox') or '').strip()
     lat = request.args.get('lat', type=float)
     lng = request.args.get('lng', type=float)
 
+    box = None
     if bbox:
         try:
             west, south, east, north = [float(part) for part in bbox.split(',')]
         except (TypeError, ValueError):
             return jsonify({'error': 'invalid_bbox'}), 400
-        query = query.filter(
-            Court.latitude >= south, Court.latitude <= north,
-            Court.longitude >= west, Court.longitude <= east,
-        )
+        box = (south, west, north, east)
     elif lat is not None and lng is not None:
         radius = min(max(request.args.get('radius', default=25.0, type=float), 1.0), 100.0)
         lat_delta = radius / 69.0
         lng_delta = radius / max(0.1, 69.0 * math.cos(math.radians(lat)))
-        query = query.filter(
-            Court.latitude.between(lat - lat_delta, lat + lat_delta),
-            Court.longitude.between(lng - lng_delta, lng + lng_delta),
-        )
+        box = (lat - lat_delta, lng - lng_delta, lat + lat_delta, lng + lng_delta)
 
     limit = min(request.args.get('limit', default=MAX_COURT_RESULTS, type=int), MAX_COURT_RESULTS)
     sort = str(request.args.get('sort') or 'distance').strip().lower()
-    if sort == 'rating':
-        # Order by review average in SQL so the ranking survives the limit cut.
-        rating_sq = (
-            db.session.query(
-                CourtReview.court_id.label('court_id'),
-                func.avg(CourtReview.rating).label('rating_avg'),
-                func.count(CourtReview.id).label('rating_count'),
-            )
-            .group_by(CourtReview.court_id)
-            .subquery()
+
+    index = get_court_index()
+    index.ensure_fresh()
+    if sort != 'rating' or index.serving_snapshot:
+        # Spatial/amenity/text lookups resolve ids from the in-memory index and
+        # only load the winning rows by primary key. (While a cold start
+        # serves the compiled snapshot there are no reviews to rank by, and
+        # rows not yet in the table come from the snapshot.)
+        if text:
+            entries = index.search(text)
+            if box:
+                south, west, north, east = box
+                entries = [
+                    e for e in entries
+                    if south <= e.lat <= north and west <= e.lng <= east
+                ]
+        else:
+            entries = index.within(*box) if box else index.all()
+            entries.sort(key=lambda e: (-e.num_courts, e.id))
+        if lighted_only:
+            entries = [e for e in entries if e.lighted]
+        if indoor_only:
+            entries = [e for e in entries if e.indoor]
+        if active_only:
+            playing = get_live_counters().courts_with_players()
+            entries = [e for e in entries if e.id in playing]
+        ids = [e.id for e in entries[:limit * 3]]
+        by_id = {c.id: c for c in Court.query.filter(Court.id.in_(ids)).all()} if ids else {}
+        courts = [by_id.get(cid) or index.snapshot_court(cid) for cid in ids]
+        courts = [court for court in courts if court is not None]
+    else:
+        query = Court.query.filter(
+            Court.latitude.isnot(None), Court.longitude.isnot(None), Court.stale.is_(False),
         )
-        query = query.outerjoin(rating_sq, Court.id == rating_sq.c.court_id).order_by(
-            rating_sq.c.rating_avg.desc().nullslast(),
-            rating_sq.c.rating_count.desc().nullslast(),
+        if text:
+            query = query.filter(Court.id.in_([e.id for e in index.search(text)]))
+        if lighted_only:
+            query = query.filter(Court.lighted.is_(True))
+        if indoor_only:
+            query = query.filter(Court.indoor.is_(True))
+        if active_only:
+            query = query.filter(Court.id.in_(get_live_counters().courts_with_players()))
+        if box:
+            south, west, north, east = box
+            query = query.filter(
+                Court.latitude >= south, Court.latitude <= north,
+                Court.longitude >= west, Court.longitude <= east,
+            )
+        courts = query.order_by(
+            Court.rating_avg.desc().nullslast(),
+            Court.rating_count.desc(),
             Court.num_courts.desc(),
             Court.id.asc(),
-        )
-    else:
-        query = query.order_by(Court.num_courts.desc(), Court.id.asc())
-    courts = query.limit(limit * 3).all()
+        ).limit(limit * 3).all()
 
     items = []
     for court in courts:
         item = court.to_summary_dict()
+        item.update(rating_fields(court))
         if lat is not None and lng is not None:
             item['distance_miles'] = round(
                 haversine_miles(lat, lng, court.latitude, court.longitude), 1,
@@ -266,21 +249,162 @@ def list_courts():
 
     ids = [c['id'] for c in items]
     players, games = _active_counts_for(ids)
-    ratings = _rating_summary_for(ids)
     for item in items:
         item['players_here'] = players.get(item['id'], 0)
         item['upcoming_games'] = games.get(item['id'], 0)
-        summary = ratings.get(item['id'])
-        item['rating_avg'] = summary['rating_avg'] if summary else None
-        item['rating_count'] = summary['rating_count'] if summary else 0
 
     return jsonify({'items': items, 'count': len(items)})
 
 
+@courts_bp.get('/courts/suggest')
+def suggest_courts():
+    """Typeahead: top court matches for a partial query, served from the
+    in-memory search index without touching the database."""
+    text = str(request.args.get('q') or '').strip()
+    limit = min(max(request.args.get('limit', default=8, type=int), 1), MAX_SUGGESTIONS)
+    if not text:
+        return jsonify({'items': []})
+    index = get_court_index()
+    index.ensure_fresh()
+    return jsonify({'items': [
+        {
+            'id': e.id, 'name': e.name, 'city': e.city, 'state': e.state,
+            'latitude': e.lat, 'longitude': e.lng, 'num_courts': e.num_courts,
+        }
+        for e in index.search(text, limit)
+    ]})
+
+
+@courts_bp.get('/courts/clusters')
+def court_clusters():
+    """Zoomed-out map view: cluster centroids with court counts and live
+    players/games totals for a bbox at a given map zoom."""
+    try:
+        west, south, east, north = [
+            float(part) for part in str(request.args.get('bbox') or '').split(',')
+        ]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid_bbox'}), 400
+    zoom = min(max(request.args.get('zoom', default=5, type=int), 0), MAX_CLUSTER_ZOOM)
+
+    index = get_court_index()
+    index.ensure_fresh()
+    entries = None
+    lighted_only = str(request.args.get('lighted') or '') in {'1', 'true'}
+    indoor_only = str(request.args.get('indoor') or '') in {'1', 'true'}
+    if lighted_only or indoor_only:
+        entries = [
+            e for e in index.within(south, west, north, east)
+            if (e.lighted or not lighted_only) and (e.indoor or not indoor_only)
+        ]
+    cells = index.clusters(zoom, south, west, north, east, entries=entries)
+
+    # Only courts with activity contribute to live totals, so walk those
+    # instead of every court in the view.
+    players, games = _active_counts_for()
+    allowed = {e.id for e in entries} if entries is not None else None
+    live = {}
+    for counts, slot in ((players, 0), (games, 1)):
+        for court_id, count in counts.items():
+            entry = index.get(court_id)
+            if entry is None or (allowed is not None and court_id not in allowed):
+                continue
+            key = cluster_key(entry.lat, entry.lng, zoom)
+            if key in cells:
+                live.setdefault(key, [0, 0])[slot] += count
+
+    items = []
+    for key, (count, sum_lat, sum_lng, s, w, n, e, first_id) in cells.items():
+        players_here, upcoming_games = live.get(key, (0, 0))
+        items.append({
+            'lat': round(sum_lat / count, 5),
+            'lng': round(sum_lng / count, 5),
+            'count': count,
+            'court_id': first_id if count == 1 else None,
+            'bounds': [w, s, e, n],
+            'players_here': players_here,
+            'upcoming_games': upcoming_games,
+        })
+    items.sort(key=lambda c: -c['count'])
+    return jsonify({'items': items, 'zoom': zoom, 'total': sum(c['count'] for c in items)})
+
+
+@courts_bp.get('/courts/tiles/<int:z>/<int:x>/<int:y>.<fmt>')
+def court_tile(z, x, y, fmt):
+    """Static court geometry for one z/x/y map tile, cacheable by browsers,
+    the service worker and CDNs. Live counts come from /courts/live."""
+    if fmt not in ('json', 'bin'):
+        return jsonify({'error': 'tile_not_found'}), 404
+    if not (TILE_MIN_ZOOM <= z <= TILE_MAX_ZOOM) or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'tile_not_found'}), 404
+
+    index = get_court_index()
+    index.ensure_fresh()
+    etag = f'{index.version}-{z}-{x}-{y}-{fmt}'
+    headers = {'Cache-Control': f'public, max-age={TILE_MAX_AGE}'}
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304, headers=headers)
+        resp.set_etag(etag)
+        return resp
+
+    south, west, north, east = tile_bounds(z, x, y)
+    # Half-open on the east/north edges so a court on a tile boundary lands
+    # in exactly one tile.
+    entries = sorted(
+        (e for e in index.within(south, west, north, east) if e.lat < north and e.lng < east),
+        key=lambda e: e.id,
+    )
+    rows = [
+        (e.id, e.lat, e.lng, e.num_courts,
+         (TILE_FLAG_INDOOR if e.indoor else 0) | (TILE_FLAG_LIGHTED if e.lighted else 0))
+        for e in entries
+    ]
+    if fmt == 'bin':
+        body = TILE_HEADER.pack(b'TSCT', 1, len(rows)) + b''.join(
+            TILE_RECORD.pack(cid, lat, lng, min(num, 0xFFFF), flags)
+            for cid, lat, lng, num, flags in rows
+        )
+        resp = Response(body, mimetype='application/octet-stream', headers=headers)
+    else:
+        resp = jsonify({'z': z, 'x': x, 'y': y, 'version': index.version, 'courts': rows})
+        resp.headers.update(headers)
+    resp.set_etag(etag)
+    return resp
+
+
+@courts_bp.get('/courts/live')
+def courts_live():
+    """Live overlay for tiled markers: only courts in the bbox with players
+    checked in or upcoming games."""
+    try:
+        west, south, east, north = [
+            float(part) for part in str(request.args.get('bbox') or '').split(',')
+        ]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid_bbox'}), 400
+    index = get_court_index()
+    index.ensure_fresh()
+    players, games = _active_counts_for()
+    items = []
+    for court_id in sorted(set(players) | set(games)):
+        entry = index.get(court_id)
+        if entry is None or not (south <= entry.lat <= north and west <= entry.lng <= east):
+            continue
+        items.append({
+            'id': court_id,
+            'players_here': players.get(court_id, 0),
+            'upcoming_games': games.get(court_id, 0),
+        })
+    return jsonify({'items': items})
+
+
 @courts_bp.get('/courts/<int:court_id>')
 def court_detail(court_id):
-    cleanup_stale_presence()
     court = db.session.get(Court, court_id)
+    if not court:
+        index = get_court_index()
+        index.ensure_fresh()
+        court = index.snapshot_court(court_id)
     if not court:
         return jsonify({'error': 'court_not_found'}), 404
 
@@ -331,8 +455,8 @@ def court_detail(court_id):
     payload['players_here'] = players_here
     payload['friends_here'] = sum(1 for p in players_here if p['is_friend'])
     viewer_id = current_user.id if current_user else None
-    payload['games'] = [game.to_dict(viewer_id) for game in upcoming]
-    payload['recent_results'] = [game.to_dict(viewer_id) for game in recent_completed]
+    payload['games'] = serialize_games(upcoming, viewer_id)
+    payload['recent_results'] = serialize_games(recent_completed, viewer_id)
     payload['is_checked_in'] = bool(
         current_user and any(c.user_id == current_user.id for c in active)
     )
@@ -342,9 +466,7 @@ def court_detail(court_id):
         ).first()
     )
 
-    summary = _rating_summary_for([court.id]).get(court.id)
-    payload['rating_avg'] = summary['rating_avg'] if summary else None
-    payload['rating_count'] = summary['rating_count'] if summary else 0
+    payload.update(rating_fields(court))
     recent_reviews = (
         CourtReview.query.filter_by(court_id=court.id)
         .order_by(CourtReview.updated_at.desc())
@@ -371,12 +493,7 @@ def court_reviews(court_id):
         .limit(50)
         .all()
     )
-    summary = _rating_summary_for([court.id]).get(court.id)
-    return jsonify({
-        'items': [r.to_dict() for r in reviews],
-        'rating_avg': summary['rating_avg'] if summary else None,
-        'rating_count': summary['rating_count'] if summary else 0,
-    })
+    return jsonify({'items': [r.to_dict() for r in reviews], **rating_fields(court)})
 
 
 @courts_bp.post('/courts/<int:court_id>/reviews')
@@ -396,18 +513,16 @@ def upsert_review(court_id):
     comment = str(payload.get('comment') or '').strip()[:500]
 
     review = CourtReview.query.filter_by(court_id=court.id, user_id=g.current_user.id).first()
+    old_rating = review.rating if review else None
     if not review:
         review = CourtReview(court_id=court.id, user_id=g.current_user.id)
         db.session.add(review)
     review.rating = rating
     review.comment = comment
+    record_review_rating(court.id, old_rating, rating)
     db.session.commit()
-    summary = _rating_summary_for([court.id]).get(court.id)
-    return jsonify({
-        'review': review.to_dict(),
-        'rating_avg': summary['rating_avg'] if summary else None,
-        'rating_count': summary['rating_count'] if summary else 0,
-    }), 201
+    db.session.refresh(court)
+    return jsonify({'review': review.to_dict(), **rating_fields(court)}), 201
 
 
 _PHOTO_DATA_RE = re.compile(r'^data:image/(jpeg|png|webp);base64,([A-Za-z0-9+/=]+)$')
@@ -480,7 +595,6 @@ def toggle_favorite(court_id):
 @courts_bp.get('/courts/favorites')
 @login_required
 def list_favorites():
-    cleanup_stale_presence()
     favorites = (
         FavoriteCourt.query.filter_by(user_id=g.current_user.id)
         .order_by(FavoriteCourt.id.desc())
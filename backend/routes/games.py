@@ -1,8 +1,8 @@
 """Game scheduling, joining, and ranked match results."""
-import math
 from datetime import UTC, datetime, timedelta
 
 from flask import Blueprint, g, jsonify, request
+from sqlalchemy.orm import joinedload
 
 from backend.app import db
 from backend.models import (
@@ -14,6 +14,7 @@ from backend.models import (
     GameInvite,
     GamePlayer,
     User,
+    iso,
     notify,
     utcnow,
 )
@@ -21,6 +22,17 @@ from backend.routes.auth import login_required, optional_current_user
 from backend.routes.courts import haversine_miles
 from backend.routes.social import friend_ids
 from backend.security import rate_limit
+from backend.services.game_feed import (
+    PAGE_SIZE,
+    feed_since,
+    nearby_page,
+    time_page,
+    visible_clause,
+)
+from backend.services.game_payloads import prefetch_games, serialize_games
+from backend.services.leaderboards import GLOBAL, get_leaderboards, region_label, state_near
+from backend.services.rating_history import rating_series, record_rating_changes
+from backend.services.user_locations import geo_cell, near_clause, within_radius
 
 games_bp = Blueprint('games', __name__)
 
@@ -43,7 +55,8 @@ def _parse_scheduled_at(raw):
 
 
 def auto_confirm_stale_scores():
-    """Finalize ranked scores that opponents never confirmed within the window."""
+    """Finalize ranked scores that opponents never confirmed within the window.
+    Runs as a background job; returns the number of games finalized."""
     cutoff = utcnow() - timedelta(hours=SCORE_AUTO_CONFIRM_HOURS)
     stale = Game.query.filter(
         Game.status == 'awaiting_confirmation',
@@ -53,19 +66,20 @@ def auto_confirm_stale_scores():
         _finalize_game(game)
     if stale:
         db.session.commit()
+    return len(stale)
 
 
 def send_game_reminders():
-    """Notify each player about an hour before their game starts. Lazy sweep
-    (like auto_confirm_stale_scores) — runs on feed/me reads; reminded_at on
-    game_player guarantees at most one reminder per player per occurrence."""
+    """Notify each player about an hour before their game starts. Runs as a
+    background job; reminded_at on game_player guarantees at most one reminder
+    per player per occurrence. Returns the number of reminders sent."""
     now = utcnow()
     due = Game.query.filter(
         Game.status == 'upcoming',
         Game.scheduled_at > now,
         Game.scheduled_at <= now + timedelta(minutes=REMINDER_LEAD_MINUTES),
     ).all()
-    changed = False
+    sent = 0
     for game in due:
         court_name = game.court.name if game.court else 'the court'
         for player in game.players:
@@ -79,21 +93,22 @@ def send_game_reminders():
                 related_game_id=game.id,
             )
             player.reminded_at = now
-            changed = True
-    if changed:
+            sent += 1
+    if sent:
         db.session.commit()
+    return sent
 
 
 def roll_forward_recurring():
     """Advance weekly open-play sessions to their next occurrence once the last
-    one is ~3h past, resetting the RSVP list to just the host (re-RSVP weekly)."""
+    one is ~3h past, resetting the RSVP list to just the host (re-RSVP weekly).
+    Runs as a background job; returns the number of sessions advanced."""
     cutoff = utcnow() - timedelta(hours=3)
     due = Game.query.filter(
         Game.recurrence == 'weekly',
         Game.status == 'upcoming',
         Game.scheduled_at < cutoff,
     ).all()
-    changed = False
     now = utcnow()
     for game in due:
         nxt = game.scheduled_at
@@ -106,82 +121,80 @@ def roll_forward_recurring():
                 game.players.remove(player)
             else:
                 player.reminded_at = None  # remind again for the new occurrence
-        changed = True
-    if changed:
+    if due:
         db.session.commit()
+    return len(due)
 
 
 @games_bp.get('/games')
 def list_games():
-    """Upcoming games feed, optionally sorted by distance from lat/lng."""
-    auto_confirm_stale_scores()
-    roll_forward_recurring()
-    send_game_reminders()
+    """Upcoming games feed, nearest first when lat/lng is given.
+
+    Paged: pass the response's next_cursor back as cursor= for the next page
+    (see backend.services.game_feed)."""
     lat = request.args.get('lat', type=float)
     lng = request.args.get('lng', type=float)
     truthy = {'1', 'true', 'yes'}
     mine = str(request.args.get('mine') or '').strip() in truthy
     friends_only = str(request.args.get('friends') or '').strip() in truthy
+    cursor = request.args.get('cursor') or None
+    limit = min(max(request.args.get('limit', default=PAGE_SIZE, type=int), 1), PAGE_SIZE)
     current_user = optional_current_user()
     viewer_id = current_user.id if current_user else None
     viewer_friends = friend_ids(viewer_id) if viewer_id else set()
 
-    if mine:
-        if not current_user:
-            return jsonify({'error': 'authentication_required'}), 401
-        # My games: everything still in play, including scores awaiting confirmation.
-        query = Game.query.filter(
-            Game.status.in_(['upcoming', 'awaiting_confirmation']),
-        ).join(GamePlayer).filter(GamePlayer.user_id == current_user.id)
-    elif friends_only:
-        if not current_user:
-            return jsonify({'error': 'authentication_required'}), 401
-        if not viewer_friends:
-            return jsonify({'items': []})
-        # Upcoming games a friend created or joined (creator is always a player).
-        query = (
-            Game.query.filter(
-                Game.scheduled_at >= utcnow() - timedelta(hours=2),
+    distances = {}
+    try:
+        if mine:
+            if not current_user:
+                return jsonify({'error': 'authentication_required'}), 401
+            # My games: everything still in play, including scores awaiting confirmation.
+            games, next_cursor = time_page(Game.query.filter(
+                Game.status.in_(['upcoming', 'awaiting_confirmation']),
+                Game.players.any(GamePlayer.user_id == viewer_id),
+            ), cursor, limit)
+        elif friends_only:
+            if not current_user:
+                return jsonify({'error': 'authentication_required'}), 401
+            if not viewer_friends:
+                return jsonify({'items': [], 'next_cursor': None})
+            # Upcoming games a friend created or joined (creator is always a
+            # player) that you're not already in: the Friends feed is about
+            # discovering games.
+            games, next_cursor = time_page(Game.query.filter(
+                Game.scheduled_at >= feed_since(),
                 Game.status == 'upcoming',
+                Game.players.any(GamePlayer.user_id.in_(viewer_friends)),
+                ~Game.players.any(GamePlayer.user_id == viewer_id),
+                visible_clause(viewer_id, viewer_friends),
+            ), cursor, limit)
+        elif lat is not None and lng is not None:
+            radius = min(max(request.args.get('radius', default=50.0, type=float), 1.0), 200.0)
+            ranked, next_cursor = nearby_page(
+                lat, lng, radius, viewer_id, viewer_friends, cursor, limit,
             )
-            .join(GamePlayer)
-            .filter(GamePlayer.user_id.in_(viewer_friends))
-            .distinct()
-        )
-    else:
-        query = Game.query.filter(
-            Game.scheduled_at >= utcnow() - timedelta(hours=2),
-            Game.status == 'upcoming',
-        )
-    if not mine and not friends_only and lat is not None and lng is not None:
-        radius = min(max(request.args.get('radius', default=50.0, type=float), 1.0), 200.0)
-        lat_delta = radius / 69.0
-        lng_delta = radius / max(0.1, 69.0 * math.cos(math.radians(lat)))
-        query = query.join(Court).filter(
-            Court.latitude.between(lat - lat_delta, lat + lat_delta),
-            Court.longitude.between(lng - lng_delta, lng + lng_delta),
-        )
-
-    games = query.order_by(Game.scheduled_at.asc()).limit(150).all()
+            games = [game for game, _distance in ranked]
+            distances = {game.id: distance for game, distance in ranked}
+        else:
+            games, next_cursor = time_page(Game.query.filter(
+                Game.scheduled_at >= feed_since(),
+                Game.status == 'upcoming',
+                visible_clause(viewer_id, viewer_friends),
+            ), cursor, limit)
+    except ValueError:
+        return jsonify({'error': 'invalid_cursor'}), 400
 
     items = []
-    for game in games:
-        # In the public/nearby and friends feeds, only show games the viewer may see.
-        if not mine and not game.visible_to(viewer_id, viewer_friends):
-            continue
-        item = game.to_dict(viewer_id)
-        # The Friends feed is about discovering games you're not already in.
-        if friends_only and item['is_joined']:
-            continue
+    for game, item in zip(games, serialize_games(games, viewer_id)):
         court = game.court
-        if lat is not None and lng is not None and court and court.latitude is not None:
+        if game.id in distances:
+            item['distance_miles'] = round(distances[game.id], 1)
+        elif lat is not None and lng is not None and court and court.latitude is not None:
             item['distance_miles'] = round(
                 haversine_miles(lat, lng, court.latitude, court.longitude), 1,
             )
         items.append(item)
-    if lat is not None and lng is not None and not mine and not friends_only:
-        items.sort(key=lambda i: (i.get('distance_miles', 1e9), i['scheduled_at']))
-    return jsonify({'items': items[:100]})
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 
 @games_bp.get('/games/history')
@@ -194,7 +207,7 @@ def my_game_history():
         .limit(50)
         .all()
     )
-    return jsonify({'items': [game.to_dict(g.current_user.id) for game in games]})
+    return jsonify({'items': serialize_games(games, g.current_user.id)})
 
 
 @games_bp.post('/games')
@@ -380,13 +393,20 @@ def _expected_score(rating_a, rating_b):
     return 1.0 / (1.0 + 10 ** ((rating_b - rating_a) / 400.0))
 
 
+def team_elo_delta(team1_ratings, team2_ratings, team1_won, k=ELO_K):
+    """Team 1's rating change (team 2 gets the negation) under team-average
+    ELO. Shared with the offline replay (backend.replay_ratings)."""
+    avg1 = sum(team1_ratings) / len(team1_ratings)
+    avg2 = sum(team2_ratings) / len(team2_ratings)
+    actual1 = 1.0 if team1_won else 0.0
+    return round(k * (actual1 - _expected_score(avg1, avg2)))
+
+
 def _apply_elo(team1_users, team2_users, team1_won):
     """Update ratings + win streaks using team-average ELO; returns {user_id: delta}."""
-    avg1 = sum(u.rating for u in team1_users) / len(team1_users)
-    avg2 = sum(u.rating for u in team2_users) / len(team2_users)
-    expected1 = _expected_score(avg1, avg2)
-    actual1 = 1.0 if team1_won else 0.0
-    delta1 = round(ELO_K * (actual1 - expected1))
+    delta1 = team_elo_delta(
+        [u.rating for u in team1_users], [u.rating for u in team2_users], team1_won,
+    )
     deltas = {}
     winners = team1_users if team1_won else team2_users
     losers = team2_users if team1_won else team1_users
@@ -426,6 +446,7 @@ def _finalize_game(game, actor_id=None):
         for uid, delta in deltas.items():
             if uid in by_user:
                 by_user[uid].rating_delta = delta
+        record_rating_changes(game.id, team1_users + team2_users, deltas, game.completed_at)
         for uid, delta in deltas.items():
             if uid == actor_id:
                 continue
@@ -650,7 +671,6 @@ def decline_challenge(game_id):
 @games_bp.get('/games/results')
 def recent_results():
     """Feed of recently finished games: yours, your friends', and nearby ones."""
-    auto_confirm_stale_scores()
     lat = request.args.get('lat', type=float)
     lng = request.args.get('lng', type=float)
     current_user = optional_current_user()
@@ -665,7 +685,7 @@ def recent_results():
         .all()
     )
     items = []
-    for game in games:
+    for game in prefetch_games(games):
         player_ids = {p.user_id for p in game.players}
         involves_me = viewer_id in player_ids
         involves_friend = bool(friends & player_ids)
@@ -690,51 +710,111 @@ def recent_results():
 
 @games_bp.get('/leaderboard')
 def leaderboard():
-    """Ranked players, globally or scoped to an area (lat/lng/radius miles).
-
-    Area scoping uses each player's last-known location, falling back to
-    their home court — same source as players-nearby discovery."""
+    """Ranked players in a region, best first.
+
+    scope=global (default), state (state=XX, else the state at lat/lng, else
+    the viewer's) or metro (the grid cell at lat/lng, else the viewer's) read
+    the materialized boards and page with offset/limit; signed-in viewers
+    also get their own rank there. Without a scope, lat/lng/radius keeps the
+    exact-radius board, using each player's last-known location, falling
+    back to their home court — same source as players-nearby discovery."""
     lat = request.args.get('lat', type=float)
     lng = request.args.get('lng', type=float)
+    scope = str(request.args.get('scope') or '').strip().lower()
 
-    query = User.query.filter(User.ranked_wins + User.ranked_losses > 0)
-
-    if lat is not None and lng is not None:
+    if not scope and lat is not None and lng is not None:
         radius = min(max(request.args.get('radius', default=50.0, type=float), 1.0), 250.0)
-        lat_delta = radius / 69.0
-        lng_delta = radius / max(0.1, 69.0 * math.cos(math.radians(lat)))
-        lat_lo, lat_hi = lat - lat_delta, lat + lat_delta
-        lng_lo, lng_hi = lng - lng_delta, lng + lng_delta
-
-        from sqlalchemy import and_, or_
-        from sqlalchemy.orm import aliased
-        home = aliased(Court)
-        candidates = (
-            query.outerjoin(home, User.home_court_id == home.id)
-            .filter(or_(
-                and_(User.last_lat.between(lat_lo, lat_hi),
-                     User.last_lng.between(lng_lo, lng_hi)),
-                and_(User.last_lat.is_(None),
-                     home.latitude.between(lat_lo, lat_hi),
-                     home.longitude.between(lng_lo, lng_hi)),
-            ))
-            .order_by(User.rating.desc())
-            .limit(200)
-            .all()
+        # Rank on (id, location) rows from the (geo_cell, rating) index and
+        # load full rows only for the 50 that make the board.
+        ranked = (
+            db.session.query(User.id, User.loc_lat, User.loc_lng)
+            .filter(User.ranked_wins + User.ranked_losses > 0, near_clause(lat, lng, radius))
+            .order_by(User.rating.desc(), User.id)
         )
-        # Exact-distance pass over the bounding-box candidates.
-        users = []
-        for user in candidates:
-            ulat, ulng = user.last_lat, user.last_lng
-            if ulat is None and user.home_court:
-                ulat, ulng = user.home_court.latitude, user.home_court.longitude
-            if ulat is None or ulng is None:
-                continue
-            if haversine_miles(lat, lng, ulat, ulng) <= radius:
-                users.append(user)
-            if len(users) >= 50:
-                break
+        top_ids = [row.id for row, _distance in within_radius(ranked, lat, lng, radius)[:50]]
+        by_id = {
+            u.id: u for u in User.query.options(joinedload(User.home_court)).filter(User.id.in_(top_ids))
+        } if top_ids else {}
+        return jsonify({'items': [by_id[uid].to_public_dict() for uid in top_ids]})
+
+    viewer = optional_current_user()
+    boards = get_leaderboards()
+    viewer_regions = dict(boards.regions_of(viewer.id)) if viewer else {}
+    if scope in ('', 'global'):
+        region = GLOBAL
+    elif scope == 'state':
+        state = str(request.args.get('state') or '').strip().upper()
+        if not state and lat is not None and lng is not None:
+            state = state_near(lat, lng)
+        state = state or viewer_regions.get('state')
+        if not state:
+            return jsonify({'error': 'state_required'}), 400
+        region = ('state', state)
+    elif scope == 'metro':
+        if lat is not None and lng is not None:
+            cell = geo_cell(lat, lng)
+        else:
+            cell = viewer_regions.get('metro')
+        if cell is None:
+            return jsonify({'error': 'location_required'}), 400
+        region = ('metro', cell)
     else:
-        users = query.order_by(User.rating.desc()).limit(50).all()
-
-    return jsonify({'items': [u.to_public_dict() for u in users]})
+        return jsonify({'error': 'invalid_scope'}), 400
+
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+    limit = min(max(request.args.get('limit', default=50, type=int), 1), 100)
+    ranked, total = boards.page(region, offset, limit)
+    by_id = {
+        u.id: u for u in User.query.options(joinedload(User.home_court))
+        .filter(User.id.in_([uid for _rank, uid in ranked]))
+    } if ranked else {}
+    items = []
+    for rank, uid in ranked:
+        # A player who just left the board can still be in a stale slot.
+        if uid in by_id:
+            items.append({**by_id[uid].to_public_dict(), 'rank': rank})
+    me = boards.rank(region, viewer.id) if viewer else None
+    return jsonify({
+        'items': items,
+        'total': total,
+        'next_offset': offset + limit if offset + limit < total else None,
+        'region': {'scope': region[0], 'key': region[1], 'label': region_label(region)},
+        'me': {'rank': me[0], 'total': me[1]} if me else None,
+    })
+
+
+@games_bp.get('/users/<int:user_id>/rating-history')
+@login_required
+def rating_history(user_id):
+    """A player's rating after each ranked game, oldest first.
+
+    since/until (ISO timestamps) bound the range; long histories are thinned
+    server-side to at most `points` games (default 120) that keep the curve's
+    shape, so charts cost the same for players with thousands of games."""
+    user = db.session.get(User, user_id)
+    if not user:
+        return jsonify({'error': 'user_not_found'}), 404
+    since = until = None
+    if request.args.get('since'):
+        since = _parse_scheduled_at(request.args.get('since'))
+        if since is None:
+            return jsonify({'error': 'invalid_since'}), 400
+    if request.args.get('until'):
+        until = _parse_scheduled_at(request.args.get('until'))
+        if until is None:
+            return jsonify({'error': 'invalid_until'}), 400
+    points = min(max(request.args.get('points', default=120, type=int), 3), 1000)
+
+    rows, total = rating_series(user.id, since, until, points)
+    return jsonify({
+        'user_id': user.id,
+        'rating': user.rating,
+        'total': total,
+        'downsampled': len(rows) < total,
+        'items': [{
+            'at': iso(row.recorded_at),
+            'rating': row.rating_after,
+            'delta': row.rating_after - row.rating_before,
+            'game_id': row.game_id,
+        } for row in rows],
+    })
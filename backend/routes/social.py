@@ -2,14 +2,13 @@
 import math
 
 from flask import Blueprint, g, jsonify, request
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import aliased
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import joinedload, selectinload
 
 from backend.app import db
 from backend.models import (
     BlockedUser,
     CheckIn,
-    Court,
     FavoriteCourt,
     Friendship,
     Game,
@@ -25,29 +24,23 @@ from backend.models import (
 from datetime import timedelta
 from backend.routes.auth import login_required
 from backend.security import rate_limit
+from backend.services.events import publish, user_event
+from backend.services.game_payloads import serialize_games
+from backend.services.leaderboards import get_leaderboards, region_label
+from backend.services.social_graph import get_social_graph
+from backend.services.user_locations import near_clause, within_radius
 
 social_bp = Blueprint('social', __name__)
 
-
-def _haversine_miles(lat1, lng1, lat2, lng2):
-    radius = 3958.8
-    p1, p2 = math.radians(lat1), math.radians(lat2)
-    dlat = math.radians(lat2 - lat1)
-    dlng = math.radians(lng2 - lng1)
-    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
-    return 2 * radius * math.asin(math.sqrt(a))
+NEARBY_PLAYERS_PAGE = 60
+# Candidate rows fetched (closest first) before the block-list and exact
+# radius passes; the slack covers blocked users and the box's corners.
+NEARBY_PLAYERS_CANDIDATES = 4 * NEARBY_PLAYERS_PAGE
 
 
 def friend_ids(user_id):
-    """IDs of all accepted friends of the given user."""
-    rows = Friendship.query.filter(
-        Friendship.status == 'accepted',
-        or_(Friendship.requester_id == user_id, Friendship.addressee_id == user_id),
-    ).all()
-    return {
-        f.addressee_id if f.requester_id == user_id else f.requester_id
-        for f in rows
-    }
+    """IDs of all accepted friends of the given user (cached, read-only)."""
+    return get_social_graph().friend_ids(user_id)
 
 
 def _friendship_between(user_a, user_b):
@@ -59,25 +52,66 @@ def _friendship_between(user_a, user_b):
     ).first()
 
 
-def _friend_entry(friendship, viewer_id):
+def _friendships_with(viewer_id, user_ids):
+    """{other user id: Friendship} between the viewer and each of user_ids
+    (any status, either direction), in one query."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    rows = Friendship.query.filter(or_(
+        and_(Friendship.requester_id == viewer_id, Friendship.addressee_id.in_(user_ids)),
+        and_(Friendship.addressee_id == viewer_id, Friendship.requester_id.in_(user_ids)),
+    ))
+    return {
+        f.addressee_id if f.requester_id == viewer_id else f.requester_id: f
+        for f in rows
+    }
+
+
+def _relationship_fields(friendship, viewer_id):
+    return {
+        'friendship_status': friendship.status if friendship else None,
+        'friendship_id': friendship.id if friendship else None,
+        'outgoing': bool(friendship and friendship.requester_id == viewer_id),
+    }
+
+
+def _active_checkins(user_ids):
+    """{user_id: latest open CheckIn (court loaded)} in one query."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    rows = (
+        CheckIn.query.options(joinedload(CheckIn.court))
+        .filter(CheckIn.user_id.in_(user_ids), CheckIn.checked_out_at.is_(None))
+        .order_by(CheckIn.id.desc())
+        .all()
+    )
+    active = {}
+    for checkin in rows:
+        active.setdefault(checkin.user_id, checkin)
+    return active
+
+
+def _checked_in_court(checkin):
+    if not checkin or not checkin.court:
+        return None
+    return {
+        'id': checkin.court.id,
+        'name': checkin.court.name,
+        'looking_for_game': bool(checkin.looking_for_game),
+    }
+
+
+def _friend_entry(friendship, viewer_id, checkins=None):
     other = friendship.other_user(viewer_id)
+    if checkins is None:
+        checkins = _active_checkins([other.id])
     entry = other.to_public_dict()
     entry['friendship_id'] = friendship.id
     entry['status'] = friendship.status
     entry['outgoing'] = friendship.requester_id == viewer_id
-    checkin = (
-        CheckIn.query.filter_by(user_id=other.id, checked_out_at=None)
-        .order_by(CheckIn.id.desc())
-        .first()
-    )
-    if checkin and checkin.court:
-        entry['checked_in_court'] = {
-            'id': checkin.court.id,
-            'name': checkin.court.name,
-            'looking_for_game': bool(checkin.looking_for_game),
-        }
-    else:
-        entry['checked_in_court'] = None
+    entry['checked_in_court'] = _checked_in_court(checkins.get(other.id))
     return entry
 
 
@@ -93,78 +127,54 @@ def players_nearby():
     text = str(request.args.get('q') or '').strip()
     skill = str(request.args.get('skill') or '').strip().lower()
 
-    lat_delta = radius / 69.0
-    lng_delta = radius / max(0.1, 69.0 * math.cos(math.radians(lat)))
-    lat_lo, lat_hi = lat - lat_delta, lat + lat_delta
-    lng_lo, lng_hi = lng - lng_delta, lng + lng_delta
-
-    home = aliased(Court)
-    hidden = blocked_pair_ids(g.current_user.id)
-    query = (
-        User.query.outerjoin(home, User.home_court_id == home.id)
-        .filter(User.id != g.current_user.id)
-        .filter(or_(
-            and_(User.last_lat.between(lat_lo, lat_hi), User.last_lng.between(lng_lo, lng_hi)),
-            and_(User.last_lat.is_(None),
-                 home.latitude.between(lat_lo, lat_hi),
-                 home.longitude.between(lng_lo, lng_hi)),
-        ))
-    )
-    if hidden:
-        query = query.filter(User.id.notin_(hidden))
+    # Cheap pass first: ids and effective locations only, straight off the
+    # (geo_cell, rating) index. At a 250-mile radius the box can hold a whole
+    # region, so SQL ranks it the way the page is ranked (checked in first,
+    # then an equirectangular distance proxy) and returns only the closest
+    # candidates. Full rows are loaded for the returned page only.
+    checked_in = exists().where(CheckIn.user_id == User.id, CheckIn.checked_out_at.is_(None))
+    dlat = User.loc_lat - lat
+    dlng = (User.loc_lng - lng) * math.cos(math.radians(lat))
+    proxy = dlat * dlat + dlng * dlng
+    query = db.session.query(
+        User.id, User.loc_lat, User.loc_lng, checked_in.label('checked_in'),
+    ).filter(near_clause(lat, lng, radius), User.id != g.current_user.id)
     if text:
         query = query.filter(User.display_name.ilike(f'%{text}%'))
     if skill in SKILL_LEVELS:
         query = query.filter(User.skill_level == skill)
+    rows = query.order_by(checked_in.desc(), proxy, User.id).limit(NEARBY_PLAYERS_CANDIDATES).all()
+    shown = set(get_social_graph().filter_blocked(g.current_user.id, [row.id for row in rows]))
+    hits = within_radius([row for row in rows if row.id in shown], lat, lng, radius)
 
-    candidates = query.limit(300).all()
-
+    # Active players first, then closest.
+    hits.sort(key=lambda hit: (not hit[0].checked_in, hit[1], hit[0].id))
+    page = hits[:NEARBY_PLAYERS_PAGE]
+
+    page_ids = [row.id for row, _distance in page]
+    users = {
+        u.id: u for u in
+        User.query.options(joinedload(User.home_court)).filter(User.id.in_(page_ids))
+    } if page_ids else {}
     my_friends = friend_ids(g.current_user.id)
-    # One pass to know who's checked in right now.
-    candidate_ids = [u.id for u in candidates]
-    active = {}
-    if candidate_ids:
-        rows = (
-            CheckIn.query.filter(
-                CheckIn.user_id.in_(candidate_ids),
-                CheckIn.checked_out_at.is_(None),
-            )
-            .order_by(CheckIn.id.desc())
-            .all()
-        )
-        for ci in rows:
-            active.setdefault(ci.user_id, ci)
+    # One pass each to know who's checked in right now and how they relate to
+    # the viewer.
+    active = _active_checkins(page_ids)
+    friendships = _friendships_with(g.current_user.id, page_ids)
 
     items = []
-    for user in candidates:
-        ploc = (user.last_lat, user.last_lng)
-        if ploc[0] is None and user.home_court:
-            ploc = (user.home_court.latitude, user.home_court.longitude)
-        if ploc[0] is None or ploc[1] is None:
-            continue
-        distance = _haversine_miles(lat, lng, ploc[0], ploc[1])
-        if distance > radius:
-            continue
+    for row, distance in page:
+        user = users[row.id]
         entry = user.to_public_dict()
         entry['distance_miles'] = round(distance, 1)
-        friendship = _friendship_between(g.current_user.id, user.id)
         entry['is_friend'] = user.id in my_friends
-        entry['friendship_status'] = friendship.status if friendship else None
-        entry['friendship_id'] = friendship.id if friendship else None
-        entry['outgoing'] = bool(friendship and friendship.requester_id == g.current_user.id)
-        ci = active.get(user.id)
-        entry['checked_in_court'] = (
-            {'id': ci.court.id, 'name': ci.court.name, 'looking_for_game': bool(ci.looking_for_game)}
-            if ci and ci.court else None
-        )
+        entry.update(_relationship_fields(friendships.get(user.id), g.current_user.id))
+        entry['checked_in_court'] = _checked_in_court(active.get(user.id))
         entry['last_seen_at'] = (
             user.last_location_at.isoformat() + 'Z' if user.last_location_at else None
         )
         items.append(entry)
-
-    # Active players first, then closest.
-    items.sort(key=lambda i: (i['checked_in_court'] is None, i['distance_miles']))
-    return jsonify({'items': items[:60], 'count': len(items)})
+    return jsonify({'items': items, 'count': len(hits)})
 
 
 @social_bp.get('/users/search')
@@ -175,23 +185,17 @@ def search_users():
         return jsonify({'items': []})
     like = f'%{text}%'
     hidden = blocked_pair_ids(g.current_user.id)
-    query = User.query.filter(
+    users = User.query.filter(
         User.id != g.current_user.id,
         or_(User.display_name.ilike(like), User.email.ilike(like)),
-    )
-    if hidden:
-        query = query.filter(User.id.notin_(hidden))
-    users = query.order_by(User.display_name.asc()).limit(20).all()
+    ).order_by(User.display_name.asc()).limit(20 + len(hidden)).all()
+    shown = set(get_social_graph().filter_blocked(g.current_user.id, [u.id for u in users]))
+    users = [u for u in users if u.id in shown][:20]
+    friendships = _friendships_with(g.current_user.id, [u.id for u in users])
     items = []
     for user in users:
         entry = user.to_public_dict()
-        friendship = _friendship_between(g.current_user.id, user.id)
-        if friendship:
-            entry['friendship_status'] = friendship.status
-            entry['friendship_id'] = friendship.id
-            entry['outgoing'] = friendship.requester_id == g.current_user.id
-        else:
-            entry['friendship_status'] = None
+        entry.update(_relationship_fields(friendships.get(user.id), g.current_user.id))
         items.append(entry)
     return jsonify({'items': items})
 
@@ -207,13 +211,23 @@ def user_profile(user_id):
         blocker_id=g.current_user.id, blocked_id=user.id,
     ).first())
 
-    friendship = _friendship_between(g.current_user.id, user.id)
-    if friendship:
-        payload['friendship_status'] = friendship.status
-        payload['friendship_id'] = friendship.id
-        payload['outgoing'] = friendship.requester_id == g.current_user.id
-    else:
-        payload['friendship_status'] = None
+    payload.update(_relationship_fields(
+        _friendships_with(g.current_user.id, [user.id]).get(user.id), g.current_user.id,
+    ))
+    if user.id != g.current_user.id:
+        payload['mutual_friends'] = len(
+            get_social_graph().mutual_friend_ids(g.current_user.id, user.id),
+        )
+    # Where they stand on each board they're on ("#37 in Costa Mesa, CA").
+    boards = get_leaderboards()
+    payload['ranks'] = []
+    for region in boards.regions_of(user.id):
+        standing = boards.rank(region, user.id)
+        if standing:
+            payload['ranks'].append({
+                'scope': region[0], 'key': region[1], 'label': region_label(region),
+                'rank': standing[0], 'total': standing[1],
+            })
 
     recent = (
         Game.query.join(GamePlayer)
@@ -222,7 +236,7 @@ def user_profile(user_id):
         .limit(10)
         .all()
     )
-    payload['recent_games'] = [game.to_dict(user.id) for game in recent]
+    payload['recent_games'] = serialize_games(recent, user.id)
 
     # Upcoming games this player is in — only those the viewer is allowed to see.
     viewer_friends = friend_ids(g.current_user.id)
@@ -237,11 +251,10 @@ def user_profile(user_id):
         .limit(20)
         .all()
     )
-    payload['upcoming_games'] = [
-        game.to_dict(g.current_user.id)
-        for game in upcoming
-        if game.visible_to(g.current_user.id, viewer_friends)
-    ][:8]
+    payload['upcoming_games'] = serialize_games(
+        [game for game in upcoming if game.visible_to(g.current_user.id, viewer_friends)][:8],
+        g.current_user.id,
+    )
 
     # Home + favorite courts.
     courts = []
@@ -288,9 +301,10 @@ def block_user(user_id):
 @social_bp.post('/users/<int:user_id>/unblock')
 @login_required
 def unblock_user(user_id):
-    BlockedUser.query.filter_by(
-        blocker_id=g.current_user.id, blocked_id=user_id,
-    ).delete()
+    # Row by row through the ORM (there's at most one) so the social graph
+    # cache and event bus see the change.
+    for block in BlockedUser.query.filter_by(blocker_id=g.current_user.id, blocked_id=user_id):
+        db.session.delete(block)
     db.session.commit()
     return jsonify({'blocked': False})
 
@@ -298,15 +312,19 @@ def unblock_user(user_id):
 @social_bp.get('/friends')
 @login_required
 def list_friends():
-    rows = Friendship.query.filter(
+    rows = Friendship.query.options(
+        selectinload(Friendship.requester).joinedload(User.home_court),
+        selectinload(Friendship.addressee).joinedload(User.home_court),
+    ).filter(
         or_(
             Friendship.requester_id == g.current_user.id,
             Friendship.addressee_id == g.current_user.id,
         )
     ).all()
+    checkins = _active_checkins(f.other_user(g.current_user.id).id for f in rows)
     friends, incoming, outgoing = [], [], []
     for friendship in rows:
-        entry = _friend_entry(friendship, g.current_user.id)
+        entry = _friend_entry(friendship, g.current_user.id, checkins)
         if friendship.status == 'accepted':
             friends.append(entry)
         elif friendship.requester_id == g.current_user.id:
@@ -418,6 +436,11 @@ def list_notifications():
 @social_bp.post('/notifications/read')
 @login_required
 def mark_notifications_read():
-    Notification.query.filter_by(user_id=g.current_user.id, read=False).update({'read': True})
+    marked = Notification.query.filter_by(
+        user_id=g.current_user.id, read=False,
+    ).update({'read': True})
     db.session.commit()
+    if marked:
+        # Bulk UPDATE: the ORM event hooks never see these rows.
+        publish([user_event(g.current_user.id, 'notifications_read')])
     return jsonify({'ok': True})
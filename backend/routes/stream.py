@@ -0,0 +1,92 @@
+"""Server-Sent Events push channel (/api/stream).
+
+One long-lived response per tab delivers the user's events (new messages,
+notifications, friend requests, presence and game changes; see
+backend.services.events) so the frontend can refresh on change instead of
+polling. Streams are capped per worker and end after EVENT_STREAM_MAX_SECONDS;
+the app reconnects and its pollers take over whenever no stream is open.
+
+EventSource can't send headers, so the stream authenticates with a ticket in
+the query string: a JWT scoped to the stream and valid for
+STREAM_TICKET_SECONDS, fetched with the session token just before each
+connection. Access logs see only the ticket, never the session token.
+
+`court=<id>` adds that court's channel, so an open court chat is served by
+the stream instead of a second parked long-poll.
+"""
+import json
+import time
+
+from flask import Blueprint, Response, current_app, g, jsonify, request
+
+from backend.routes.auth import issue_token, login_required, user_from_token
+from backend.security import rate_limit
+from backend.services.events import get_event_bus
+
+stream_bp = Blueprint('stream', __name__)
+
+RECONNECT_MS = 3000
+BUSY_RETRY_MS = 60000
+STREAM_TICKET_SECONDS = 60
+
+
+def _sse(kind, data):
+    return f'event: {kind}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+@stream_bp.post('/stream/ticket')
+@login_required
+@rate_limit(30, 60)
+def stream_ticket():
+    ticket = issue_token(g.current_user, scope='stream', ttl=STREAM_TICKET_SECONDS)
+    return jsonify({'ticket': ticket, 'expires_in': STREAM_TICKET_SECONDS})
+
+
+@stream_bp.get('/stream')
+@rate_limit(30, 60)
+def event_stream():
+    user = user_from_token(str(request.args.get('ticket') or '').strip(), scope='stream')
+    if not user:
+        return jsonify({'error': 'authentication_required'}), 401
+    channels = [f'user:{user.id}']
+    court_id = request.args.get('court', type=int)
+    if court_id:
+        channels.append(f'court:{court_id}')
+
+    config = current_app.config
+    bus = get_event_bus()
+    limit = config.get('EVENT_STREAM_MAX_CLIENTS', 48)
+    if bus.open_streams >= limit:
+        resp = jsonify({'error': 'stream_capacity'})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '60'
+        return resp
+    max_seconds = config.get('EVENT_STREAM_MAX_SECONDS', 55)
+    heartbeat = config.get('EVENT_STREAM_HEARTBEAT_SECONDS', 15)
+
+    def generate():
+        # The slot and subscription are taken only once the body is being
+        # sent, so a response that never starts streaming holds neither.
+        if not bus.open_stream(limit):
+            yield f'retry: {BUSY_RETRY_MS}\n\n' + _sse('busy', {})
+            return
+        # Subscribed before `ready`, which is the client's cue to refetch.
+        sub = bus.subscribe(channels)
+        try:
+            yield f'retry: {RECONNECT_MS}\n\n' + _sse('ready', {'user_id': user.id})
+            deadline = time.monotonic() + max_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                evt = sub.get(min(heartbeat, remaining))
+                yield _sse(evt['type'], evt) if evt else ': keepalive\n\n'
+        finally:
+            bus.unsubscribe(sub)
+            bus.close_stream()
+
+    resp = Response(generate(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    # Stop proxies (nginx, Render's edge) from buffering the stream.
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
@@ -3,110 +3,232 @@
 Usage:
     python -m backend.seed --courts-dir "../pickleball court web scraper/output"
     python -m backend.seed --demo          # also create demo users/games near Orange County, CA
+    python -m backend.seed --sync --courts-file data/courts.json.gz [--dry-run]
+    python -m backend.seed --courts-dir out/ --jobs 8   # parse per-county files on 8 processes
+
+A plain import only adds courts it hasn't seen (deduplicated on name and
+coordinates). --sync treats the export as the complete court list: each
+record's fingerprint (Court.source_hash) is compared with the stored one, so
+unchanged courts are skipped, edited ones are rewritten in bulk, and courts
+missing from the export are marked stale (hidden from the map and search but
+kept for their games and reviews). --dry-run reports the diff without writing.
+
+With --courts-dir, --jobs N parses and normalizes the JSON files on N worker
+processes; rows come back as plain tuples in sorted file order and a single
+writer deduplicates and inserts them, so the result matches a serial run.
 """
 import argparse
 import json
 import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
 
+from sqlalchemy import insert, select, text, update
+
 from backend.app import create_app, db
+from backend.court_records import (
+    COMMUNITY_PHOTO_PREFIX,
+    SOURCE_FIELDS,
+    _court_file_records,
+    _court_key,
+    _new_court_rows,
+    _normalized_rows,
+    fingerprint,
+    scraped_values,
+)
 from backend.models import CheckIn, Court, Friendship, Game, GamePlayer, Message, User, utcnow
-from backend.services.court_payloads import normalize_county_slug
+from backend.services.court_index import mark_courts_changed
+from backend.services.court_ratings import rebuild_court_ratings
+from backend.services.db_pool import lift_statement_timeout
+from backend.services.events import bulk_event, publish
+from backend.services.user_locations import rebuild_user_locations
 
 DEFAULT_COURTS_DIR = os.path.join(
     os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
     'pickleball court web scraper',
     'output',
 )
+IMPORT_BATCH = 1000
+PROGRESS_EVERY = 5000
+SYNC_SAMPLES = 10
+# A sync refuses to stale more than this share of the active courts (at
+# least SYNC_MAX_STALE_MIN) without allow_mass_stale: a truncated export
+# would otherwise take most of the map down.
+SYNC_MAX_STALE_FRACTION = 0.05
+SYNC_MAX_STALE_MIN = 25
 
 
-def _coerce_bool(value):
-    if isinstance(value, bool):
-        return value
-    return str(value or '').strip().lower() in {'1', 'true', 'yes'}
+class SyncAborted(RuntimeError):
+    """A court sync refused to apply its diff; nothing was written."""
 
 
-def _coerce_int(value, default=1):
-    try:
-        return max(0, int(value))
-    except (TypeError, ValueError):
-        return default
-
-
-def _court_from_record(record):
-    lat = record.get('latitude')
-    lng = record.get('longitude')
-    if lat is None or lng is None:
-        return None
-    name = str(record.get('name') or '').strip()
-    if not name:
-        return None
-    state = str(record.get('state') or '').strip().upper()[:2] or 'CA'
-    return Court(
-        name=name[:255],
-        address=str(record.get('address') or '').strip()[:255],
-        city=str(record.get('city') or '').strip()[:120],
-        state=state,
-        county_slug=normalize_county_slug(record.get('county_slug'), fallback=''),
-        zip_code=str(record.get('zip_code') or '').strip()[:12],
-        latitude=float(lat),
-        longitude=float(lng),
-        indoor=_coerce_bool(record.get('indoor')),
-        lighted=_coerce_bool(record.get('lighted')),
-        num_courts=_coerce_int(record.get('num_courts'), default=1),
-        surface_type=str(record.get('surface_type') or '').strip()[:120],
-        court_type=str(record.get('court_type') or '').strip()[:40],
-        open_play_schedule=str(record.get('open_play_schedule') or '').strip(),
-        fees=str(record.get('fees') or '').strip()[:255],
-        phone=str(record.get('phone') or '').strip()[:40],
-        website=str(record.get('website') or '').strip()[:500],
-        photo_url=str(record.get('photo_url') or '').strip()[:500],
-        has_restrooms=_coerce_bool(record.get('has_restrooms')),
-        has_water=_coerce_bool(record.get('has_water')),
-        nets_provided=_coerce_bool(record.get('nets_provided')),
-        verified=_coerce_bool(record.get('verified')),
-    )
+def _existing_court_keys():
+    """Dedup keys of every court already stored (three columns, no ORM rows)."""
+    rows = db.session.execute(select(Court.name, Court.latitude, Court.longitude))
+    return {
+        (name.lower(), round(lat, 5), round(lng, 5))
+        for name, lat, lng in rows if lat is not None and lng is not None
+    }
 
 
-def import_court_records(records, seen=None):
-    """Insert court records, deduplicating on (name, lat, lng). Returns count added."""
-    if seen is None:
-        seen = {
-            (c.name.lower(), round(c.latitude, 5), round(c.longitude, 5))
-            for c in Court.query.all()
-        }
-    imported = 0
-    for record in records:
-        if not isinstance(record, dict):
-            continue
-        court = _court_from_record(record)
-        if court is None:
-            continue
-        key = (court.name.lower(), round(court.latitude, 5), round(court.longitude, 5))
-        if key in seen:
+def _column_defaults():
+    """Python-side defaults for every court column (COPY doesn't apply them,
+    and executemany batches need uniform keys)."""
+    defaults = {}
+    for column in Court.__table__.columns:
+        if column.primary_key:
             continue
-        seen.add(key)
-        db.session.add(court)
-        imported += 1
-    db.session.flush()
-    return imported
+        default = column.default
+        if default is None:
+            defaults[column.name] = None
+        elif default.is_callable:
+            defaults[column.name] = default.arg(None)
+        else:
+            defaults[column.name] = default.arg
+    return defaults
 
 
-def import_courts_file(path):
-    """Import courts from a single JSON file (optionally gzipped)."""
-    import gzip
-    opener = gzip.open if path.endswith('.gz') else open
-    with opener(path, 'rt') as handle:
-        records = json.load(handle)
-    if not isinstance(records, list):
-        raise ValueError(f'{path} does not contain a JSON list')
-    imported = import_court_records(records)
+def _copy_rows(columns, rows):
+    """COPY a batch of rows into court (Postgres)."""
+    cursor = db.session.connection().connection.driver_connection.cursor()
+    names = ', '.join(f'"{name}"' for name in columns)
+    with cursor, cursor.copy(f'COPY court ({names}) FROM STDIN') as copy:
+        for row in rows:
+            copy.write_row([row[name] for name in columns])
+
+
+def insert_court_rows(rows, batch_size=IMPORT_BATCH, log=None, with_ids=False):
+    """Insert court column dicts in batches: COPY on Postgres, executemany
+    Core INSERTs elsewhere. Rows carry their own 'id' when with_ids is set.
+    Runs in the caller's transaction; returns the number of rows inserted."""
+    defaults = _column_defaults()
+    columns = (['id'] if with_ids else []) + list(defaults)
+    use_copy = db.engine.dialect.name == 'postgresql'
+    lift_statement_timeout(db.session)
+    started = time.perf_counter()
+    inserted = 0
+    batch = []
+
+    def write():
+        nonlocal inserted, batch
+        if use_copy:
+            _copy_rows(columns, batch)
+        else:
+            db.session.execute(insert(Court), batch)
+        before, inserted, batch = inserted, inserted + len(batch), []
+        if log and inserted // PROGRESS_EVERY > before // PROGRESS_EVERY:
+            log(f'  {inserted} courts ({inserted / (time.perf_counter() - started):.0f} rows/s)')
+
+    for values in rows:
+        batch.append({**defaults, **values})
+        if len(batch) >= batch_size:
+            write()
+    if batch:
+        write()
+    if log and inserted:
+        elapsed = time.perf_counter() - started
+        log(f'Inserted {inserted} courts in {elapsed:.2f}s ({inserted / max(elapsed, 1e-9):.0f} rows/s)')
+    return inserted
+
+
+def import_court_rows(rows, seen=None, log=None):
+    """Insert normalized court rows, deduplicating on (name, lat, lng).
+    Returns count added."""
+    if seen is None:
+        seen = _existing_court_keys()
+    return insert_court_rows(_new_court_rows(rows, seen), log=log)
+
+
+def import_court_records(records, seen=None, log=None):
+    """Insert scraper records, deduplicating on (name, lat, lng). Returns count added."""
+    return import_court_rows(_normalized_rows(records), seen=seen, log=log)
+
+
+def _finish_import(imported):
     db.session.commit()
+    if imported:
+        # Core inserts skip the ORM hooks that normally flag the index.
+        mark_courts_changed()
+        publish([bulk_event('courts')])
     return imported
 
 
-def import_courts(courts_dir):
+def hydrate_courts(snapshot, log=None):
+    """Insert every court of a compiled snapshot (backend.snapshot), keeping
+    its id, into the (empty) court table. Returns the number inserted."""
+    inserted = insert_court_rows(snapshot.rows(), log=log, with_ids=True)
+    if db.engine.dialect.name == 'postgresql':
+        # Explicit ids don't advance the serial; later imports continue after them.
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('court', 'id'), (SELECT MAX(id) FROM court))"
+        ))
+    return _finish_import(inserted)
+
+
+def import_courts_file(path, log=None):
+    """Import courts from a single JSON file (optionally gzipped), streamed."""
+    return _finish_import(import_court_records(_court_file_records(path), log=log))
+
+
+_ROW_FIELDS = SOURCE_FIELDS + ('source_hash',)
+
+
+def _parse_court_file(path):
+    """Parse and normalize one scraper file (runs in a worker process).
+    Returns (rows as _ROW_FIELDS tuples, error message or None)."""
+    try:
+        with open(path) as handle:
+            records = json.load(handle)
+    except (OSError, ValueError) as exc:
+        return [], f'Skipping {path}: {exc}'
+    if not isinstance(records, list):
+        return [], None
+    return [tuple(values[name] for name in _ROW_FIELDS) for values in _normalized_rows(records)], None
+
+
+def _rows_from_files(paths, jobs=1, errors=None):
+    """Normalized rows from every file, in `paths` order. With jobs > 1 the
+    files are parsed on a process pool, at most a few files ahead of the
+    consumer. Files that fail to parse are skipped (and their messages
+    appended to `errors` when given)."""
+    if jobs <= 1 or len(paths) < 2:
+        results = map(_parse_court_file, paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = _ordered_results(executor, paths, window=jobs * 4)
+    try:
+        for rows, error in results:
+            if error:
+                print(error, file=sys.stderr)
+                if errors is not None:
+                    errors.append(error)
+            for row in rows:
+                yield dict(zip(_ROW_FIELDS, row))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _ordered_results(executor, paths, window):
+    pending = deque()
+    remaining = iter(paths)
+    for path in remaining:
+        pending.append(executor.submit(_parse_court_file, path))
+        if len(pending) >= window:
+            break
+    while pending:
+        result = pending.popleft().result()
+        path = next(remaining, None)
+        if path is not None:
+            pending.append(executor.submit(_parse_court_file, path))
+        yield result
+
+
+def _court_json_files(courts_dir):
     json_files = []
     for root, _dirs, files in os.walk(courts_dir):
         for filename in files:
@@ -114,25 +236,184 @@ def import_courts(courts_dir):
                 json_files.append(os.path.join(root, filename))
     if not json_files:
         print(f'No JSON files found under {courts_dir}', file=sys.stderr)
+    return sorted(json_files)
+
+
+def import_courts(courts_dir, log=None, jobs=1):
+    json_files = _court_json_files(courts_dir)
+    if not json_files:
         return 0
+    imported = import_court_rows(_rows_from_files(json_files, jobs=jobs), log=log)
+    return _finish_import(imported)
+
+
+def _stored_fingerprints():
+    """{dedup key: (court id, source_hash, stale, latitude, longitude,
+    photo_url)}, oldest court per key."""
+    rows = db.session.execute(
+        select(
+            Court.id, Court.name, Court.latitude, Court.longitude, Court.source_hash, Court.stale,
+            Court.photo_url,
+        ).order_by(Court.id)
+    )
+    stored = {}
+    for court_id, name, lat, lng, digest, stale, photo_url in rows:
+        if lat is not None and lng is not None:
+            stored.setdefault(
+                (name.lower(), round(lat, 5), round(lng, 5)),
+                (court_id, digest, stale, lat, lng, photo_url),
+            )
+    return stored
+
 
-    seen = {
-        (c.name.lower(), round(c.latitude, 5), round(c.longitude, 5))
-        for c in Court.query.all()
+def _changed_fields(court_id, values):
+    """Names of the SOURCE_FIELDS whose stored value differs from `values`."""
+    columns = [getattr(Court, name) for name in SOURCE_FIELDS]
+    old = scraped_values(dict(zip(
+        SOURCE_FIELDS, db.session.execute(select(*columns).where(Court.id == court_id)).one(),
+    )))
+    return [name for name in SOURCE_FIELDS if old[name] != values[name]]
+
+
+def sync_courts(records, dry_run=False, log=None, allow_mass_stale=False):
+    """sync_court_rows() for raw scraper records."""
+    return sync_court_rows(
+        _normalized_rows(records), dry_run=dry_run, log=log, allow_mass_stale=allow_mass_stale,
+    )
+
+
+def sync_court_rows(rows, dry_run=False, log=None, errors=None, allow_mass_stale=False):
+    """Make the court table match `rows` (normalized), the complete export.
+
+    New courts are inserted, courts whose fingerprint changed (or that come
+    back after going stale) are updated in bulk by primary key, unchanged
+    ones are skipped, and stored courts absent from the export are marked
+    stale. Returns counters plus a few samples of each kind; on a dry run
+    nothing is written.
+
+    The export is only trusted when it is whole: SyncAborted is raised, with
+    everything rolled back, when it has no rows, when a file failed to parse
+    (reading `rows` raised, or left messages in `errors`), or when it would
+    stale more than the mass-stale limit and allow_mass_stale isn't set."""
+    started = time.perf_counter()
+    lift_statement_timeout(db.session)
+    stored = _stored_fingerprints()
+    active = sum(1 for entry in stored.values() if not entry[2])
+    now = utcnow()
+    report = {
+        'added': 0, 'changed': 0, 'unchanged': 0, 'stale': 0,
+        'stale_limit': max(SYNC_MAX_STALE_MIN, int(active * SYNC_MAX_STALE_FRACTION)),
+        'samples': {'added': [], 'changed': [], 'stale': []},
     }
-    imported = 0
-    for path in sorted(json_files):
-        try:
-            with open(path) as handle:
-                records = json.load(handle)
-        except (OSError, ValueError) as exc:
-            print(f'Skipping {path}: {exc}', file=sys.stderr)
-            continue
-        if not isinstance(records, list):
-            continue
-        imported += import_court_records(records, seen=seen)
+    samples = report['samples']
+    updates = []
+    read = 0
+    moved = False
+
+    def abort(reason):
+        db.session.rollback()
+        raise SyncAborted(f'{reason}; nothing was written')
+
+    def counted(rows):
+        nonlocal read
+        for values in rows:
+            read += 1
+            yield values
+
+    def flush_updates():
+        if updates and not dry_run:
+            db.session.execute(update(Court), updates)
+        updates.clear()
+
+    def diff():
+        """Yield the rows to insert, queueing updates along the way."""
+        nonlocal moved
+        seen = set()
+        for values in _new_court_rows(counted(rows), seen):
+            digest = values['source_hash']
+            current = stored.pop(_court_key(values), None)
+            if current is None:
+                report['added'] += 1
+                if len(samples['added']) < SYNC_SAMPLES:
+                    samples['added'].append(values['name'])
+                yield values
+                continue
+            court_id, stored_digest, stale, lat, lng, photo_url = current
+            if digest == stored_digest and not stale:
+                report['unchanged'] += 1
+                continue
+            report['changed'] += 1
+            moved = moved or (values['latitude'], values['longitude']) != (lat, lng)
+            if len(samples['changed']) < SYNC_SAMPLES:
+                # Read before this court's update batch is written.
+                samples['changed'].append((values['name'], _changed_fields(court_id, values)))
+            update_values = {**values, 'id': court_id, 'stale': False, 'updated_at': now}
+            if photo_url.startswith(COMMUNITY_PHOTO_PREFIX):
+                update_values['photo_url'] = photo_url  # never replace a community upload
+            updates.append(update_values)
+            if len(updates) >= IMPORT_BATCH:
+                flush_updates()
+
+    try:
+        if dry_run:
+            for _values in diff():
+                pass
+        else:
+            insert_court_rows(diff(), log=log)
+    except (OSError, ValueError) as exc:
+        abort(f'export unreadable ({exc})')
+    flush_updates()
+    if errors:
+        abort(f'{len(errors)} file(s) failed to parse')
+    if not read:
+        abort('export has no courts')
+
+    gone = [entry[0] for entry in stored.values() if not entry[2]]
+    report['stale'] = len(gone)
+    if len(gone) > report['stale_limit'] and not dry_run and not allow_mass_stale:
+        abort(
+            f"{len(gone)} of {active} courts would be marked stale (limit "
+            f"{report['stale_limit']}); pass --allow-mass-stale if the export really dropped them"
+        )
+    if gone:
+        samples['stale'] = [
+            name for (name,) in db.session.execute(
+                select(Court.name).where(Court.id.in_(gone[:SYNC_SAMPLES]))
+            )
+        ]
+        if not dry_run:
+            for start in range(0, len(gone), IMPORT_BATCH):
+                db.session.execute(
+                    update(Court)
+                    .where(Court.id.in_(gone[start:start + IMPORT_BATCH]))
+                    .values(stale=True, updated_at=now)
+                )
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        _finish_import(report['added'] + report['changed'] + report['stale'])
+        if moved:
+            # Core updates skip the hook that follows a home court's move.
+            rebuild_user_locations()
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def fingerprint_courts():
+    """Fill Court.source_hash for courts stored before sync existed. Returns
+    the number of courts fingerprinted."""
+    lift_statement_timeout(db.session)
+    columns = [getattr(Court, name) for name in SOURCE_FIELDS]
+    rows = db.session.execute(select(Court.id, *columns).where(Court.source_hash.is_(None))).all()
+    updates = [
+        {'id': court_id, 'source_hash': fingerprint(scraped_values(dict(zip(SOURCE_FIELDS, values))))}
+        for court_id, *values in rows
+    ]
+    for start in range(0, len(updates), IMPORT_BATCH):
+        db.session.execute(update(Court), updates[start:start + IMPORT_BATCH])
     db.session.commit()
-    return imported
+    return len(updates)
 
 
 DEMO_USERS = [
@@ -208,25 +489,73 @@ def seed_demo():
     print(f'Demo data ready: {len(users)} users (password: "pickleball").')
 
 
+def print_sync_report(report, dry_run=False):
+    print(
+        f"{'Would sync' if dry_run else 'Synced'} courts in {report['seconds']}s: "
+        f"{report['added']} added, {report['changed']} changed, "
+        f"{report['unchanged']} unchanged, {report['stale']} marked stale."
+    )
+    if dry_run and report['stale'] > report['stale_limit']:
+        print(f"  ! over the mass-stale limit ({report['stale_limit']}): a real run needs --allow-mass-stale")
+    samples = report['samples']
+    for name in samples['added']:
+        print(f'  + {name}')
+    for name, fields in samples['changed']:
+        print(f"  ~ {name} ({', '.join(fields) or 'reactivated'})")
+    for name in samples['stale']:
+        print(f'  - {name}')
+
+
 def main():
     parser = argparse.ArgumentParser(description='Seed the pickleball database.')
     parser.add_argument('--courts-dir', default=DEFAULT_COURTS_DIR)
     parser.add_argument('--courts-file', help='Single JSON(.gz) court export, e.g. data/courts.json.gz')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes parsing --courts-dir files (0 = one per CPU)')
     parser.add_argument('--skip-courts', action='store_true')
+    parser.add_argument('--sync', action='store_true',
+                        help='Treat the export as complete: update changed courts, mark missing ones stale')
+    parser.add_argument('--dry-run', action='store_true', help='With --sync, report the diff without writing')
+    parser.add_argument('--allow-mass-stale', action='store_true',
+                        help='With --sync, allow staling more courts than the safety limit')
     parser.add_argument('--demo', action='store_true')
+    parser.add_argument('--rebuild-ratings', action='store_true',
+                        help='Recompute court rating aggregates from reviews')
+    parser.add_argument('--rebuild-locations', action='store_true',
+                        help="Recompute players' effective locations (home court / last check-in)")
     args = parser.parse_args()
 
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+
     app = create_app()
     with app.app_context():
         db.create_all()
-        if not args.skip_courts:
+        if args.sync:
+            errors = []
+            if args.courts_file:
+                rows = _normalized_rows(_court_file_records(args.courts_file))
+            else:
+                rows = _rows_from_files(_court_json_files(args.courts_dir), jobs=jobs, errors=errors)
+            try:
+                report = sync_court_rows(
+                    rows, dry_run=args.dry_run, log=print, errors=errors,
+                    allow_mass_stale=args.allow_mass_stale,
+                )
+            except SyncAborted as exc:
+                sys.exit(f'Sync aborted: {exc}')
+            print_sync_report(report, args.dry_run)
+        elif not args.skip_courts:
             if args.courts_file:
-                count = import_courts_file(args.courts_file)
+                count = import_courts_file(args.courts_file, log=print)
             else:
-                count = import_courts(args.courts_dir)
+                count = import_courts(args.courts_dir, log=print, jobs=jobs)
             print(f'Imported {count} new courts (total: {Court.query.count()}).')
         if args.demo:
             seed_demo()
+        if args.rebuild_ratings:
+            print(f'Rebuilt rating aggregates ({rebuild_court_ratings()} courts corrected).')
+        if args.rebuild_locations:
+            print(f'Rebuilt player locations ({rebuild_user_locations()} users corrected).')
 
 
 if __name__ == '__main__':
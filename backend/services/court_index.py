@@ -0,0 +1,297 @@
+"""In-process spatial grid index over court coordinates.
+
+Map pans hit /courts with a new bbox every time; resolving that against ~18.5k
+rows with four float range filters is the hottest query in the app. The index
+buckets every court into fixed-size lat/lng cells so bbox lookups only visit
+the handful of cells the box overlaps, without touching the database.
+
+The same snapshot backs a zoom-level cluster pyramid: per zoom, courts are
+grouped into cells roughly a quarter of a map tile wide so zoomed-out views
+get a handful of centroids instead of thousands of markers, and the text
+search index (backend.services.court_search) behind q= and /courts/suggest.
+
+One index lives per app (app.extensions['court_index']). It is built at boot,
+marked dirty whenever a court's indexed columns change through the ORM (bulk
+importers call mark_courts_changed() themselves), and cheaply re-validated
+against the court table every COURT_INDEX_REFRESH_SECONDS so imports run from
+another process (python -m backend.seed) are picked up too.
+
+On a cold start with an empty court table the index can be built from a
+compiled snapshot instead (use_snapshot(); see backend.snapshot), so the map
+and search work while the table is hydrated. The first check that finds
+courts in the table rebuilds from it and drops the snapshot.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect as sa_inspect
+
+from backend.app import db
+from backend.models import Court
+from backend.services.court_search import SearchIndex
+
+CELL_DEGREES = 0.25
+MAX_CLUSTER_ZOOM = 18
+# Cluster cells per map tile edge at a given zoom (~64px cells on 256px tiles).
+CLUSTER_CELLS_PER_TILE = 4
+
+IndexedCourt = namedtuple('IndexedCourt', 'id lat lng num_courts indoor lighted name city state')
+
+# Columns whose changes require a rebuild; anything else (photos, fees, …)
+# never affects index lookups.
+_INDEXED_ATTRS = (
+    'latitude', 'longitude', 'num_courts', 'indoor', 'lighted',
+    'name', 'city', 'state', 'address', 'stale',
+)
+
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    radius_miles = 3958.8
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
+    return 2 * radius_miles * math.asin(math.sqrt(a))
+
+
+def _cell(lat, lng, size=CELL_DEGREES):
+    return int(math.floor(lat / size)), int(math.floor(lng / size))
+
+
+def cluster_cell_degrees(zoom):
+    return 360.0 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+
+
+def cluster_key(lat, lng, zoom):
+    return _cell(lat, lng, cluster_cell_degrees(zoom))
+
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) of a web-mercator z/x/y map tile."""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def _group(entries, size):
+    """{cell: [count, sum_lat, sum_lng, south, west, north, east, first_id]}"""
+    cells = {}
+    for e in entries:
+        key = _cell(e.lat, e.lng, size)
+        agg = cells.get(key)
+        if agg is None:
+            cells[key] = [1, e.lat, e.lng, e.lat, e.lng, e.lat, e.lng, e.id]
+            continue
+        agg[0] += 1
+        agg[1] += e.lat
+        agg[2] += e.lng
+        agg[3] = min(agg[3], e.lat)
+        agg[4] = min(agg[4], e.lng)
+        agg[5] = max(agg[5], e.lat)
+        agg[6] = max(agg[6], e.lng)
+    return cells
+
+
+class CourtIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._checked_at = 0.0
+        self._fingerprint = None
+        # Compiled snapshot to serve while the court table is empty, and the
+        # one the current build came from (None once built from the table).
+        self._court_snapshot = None
+        self._serving = None
+        # (grid cells, entries by id, cluster pyramid by zoom, text search) —
+        # swapped as one tuple so concurrent readers never mix two builds.
+        self._snapshot = ({}, {}, {}, SearchIndex(()))
+
+    def __len__(self):
+        return len(self._snapshot[1])
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def use_snapshot(self, snapshot):
+        self._court_snapshot = snapshot
+        self._dirty = True
+
+    @property
+    def serving_snapshot(self):
+        return self._serving is not None
+
+    def snapshot_court(self, court_id):
+        """Transient (never added to the session) Court from the snapshot
+        being served, or None."""
+        snapshot = self._serving
+        values = snapshot.court_values(court_id) if snapshot is not None else None
+        if values is None:
+            return None
+        return Court(id=court_id, rating_sum=0, rating_count=0, stale=False, **values)
+
+    @property
+    def version(self):
+        """Court-table version token: changes whenever courts change, and is
+        identical across processes/restarts for the same data (safe for ETags)."""
+        source = self._fingerprint
+        if self._serving is not None:
+            source = (source, self._serving.digest)
+        return hashlib.sha1(repr(source).encode()).hexdigest()[:16]
+
+    def _table_fingerprint(self):
+        return tuple(db.session.query(
+            func.count(Court.id), func.max(Court.id), func.max(Court.updated_at),
+        ).one())
+
+    def ensure_fresh(self):
+        """Rebuild if courts changed since the last build. Called on every read;
+        only touches the database once per refresh window."""
+        refresh_after = current_app.config.get('COURT_INDEX_REFRESH_SECONDS', 60)
+        now = time.monotonic()
+        if not self._dirty and now - self._checked_at < refresh_after:
+            return
+        with self._lock:
+            if not self._dirty and now - self._checked_at < refresh_after:
+                return
+            # Fingerprint first: a court written mid-build then just causes one
+            # extra rebuild on the next check instead of being missed.
+            fingerprint = self._table_fingerprint()
+            if self._dirty or fingerprint != self._fingerprint:
+                if fingerprint[0]:
+                    self._court_snapshot = None
+                self._build(self._court_snapshot)
+            self._fingerprint = fingerprint
+            self._checked_at = now
+
+    def _build(self, snapshot=None):
+        if snapshot is not None:
+            rows = snapshot.index_rows()
+        else:
+            rows = db.session.query(
+                Court.id, Court.latitude, Court.longitude,
+                Court.num_courts, Court.indoor, Court.lighted,
+                Court.name, Court.city, Court.state, Court.address,
+            ).filter(Court.latitude.isnot(None), Court.longitude.isnot(None), Court.stale.is_(False))
+        cells = {}
+        by_id = {}
+        docs = []
+        for cid, lat, lng, num_courts, indoor, lighted, name, city, state, address in rows:
+            entry = IndexedCourt(
+                cid, lat, lng, num_courts or 0, bool(indoor), bool(lighted), name, city, state,
+            )
+            by_id[cid] = entry
+            cells.setdefault(_cell(lat, lng), []).append(entry)
+            docs.append((cid, name, city, state, address))
+        self._snapshot = (cells, by_id, {}, SearchIndex(docs))
+        self._serving = snapshot
+        self._dirty = False
+
+    def get(self, court_id):
+        return self._snapshot[1].get(court_id)
+
+    def all(self):
+        return list(self._snapshot[1].values())
+
+    def within(self, south, west, north, east):
+        """Courts inside an inclusive lat/lng box (same semantics as the SQL filter)."""
+        if south > north or west > east:
+            return []
+        lo_i, lo_j = _cell(south, west)
+        hi_i, hi_j = _cell(north, east)
+        cells = self._snapshot[0]
+        if (hi_i - lo_i + 1) * (hi_j - lo_j + 1) > len(cells):
+            # Box covers more cells than are populated: walk the populated ones.
+            buckets = [
+                bucket for (i, j), bucket in cells.items()
+                if lo_i <= i <= hi_i and lo_j <= j <= hi_j
+            ]
+        else:
+            buckets = [
+                cells[(i, j)]
+                for i in range(lo_i, hi_i + 1)
+                for j in range(lo_j, hi_j + 1)
+                if (i, j) in cells
+            ]
+        return [
+            entry for bucket in buckets for entry in bucket
+            if south <= entry.lat <= north and west <= entry.lng <= east
+        ]
+
+    def search(self, query, limit=None):
+        """Entries matching a text query, most relevant (then largest) first."""
+        by_id, search = self._snapshot[1], self._snapshot[3]
+        ids = search.search(query, limit, rank_key=lambda cid: (-by_id[cid].num_courts, cid))
+        return [by_id[cid] for cid in ids]
+
+    def clusters(self, zoom, south, west, north, east, entries=None):
+        """Cluster cells at `zoom` overlapping the box, as {cell: aggregate}.
+
+        Without `entries` the cached pyramid level is used; pre-filtered
+        entries (amenity filters) are grouped on the fly instead."""
+        size = cluster_cell_degrees(zoom)
+        if entries is None:
+            state = self._snapshot
+            _cells, by_id, pyramid, _search = state
+            cells = pyramid.get(zoom)
+            if cells is None:
+                cells = _group(by_id.values(), size)
+                with self._lock:
+                    # Only cache into the build the level was computed from.
+                    if self._snapshot is state:
+                        pyramid[zoom] = cells
+        else:
+            cells = _group(entries, size)
+        lo_i, lo_j = _cell(south, west, size)
+        hi_i, hi_j = _cell(north, east, size)
+        return {
+            key: agg for key, agg in cells.items()
+            if lo_i <= key[0] <= hi_i and lo_j <= key[1] <= hi_j
+        }
+
+
+def get_court_index(app=None):
+    app = app or current_app
+    return app.extensions.setdefault('court_index', CourtIndex())
+
+
+def load_snapshot(path):
+    """The compiled court snapshot at `path`, or None (logged) when it can't
+    be used."""
+    from backend.snapshot import CourtSnapshot
+
+    started = time.perf_counter()
+    try:
+        snapshot = CourtSnapshot(path)
+    except (OSError, ValueError) as exc:
+        current_app.logger.warning('Ignoring court snapshot %s: %s', path, exc)
+        return None
+    current_app.logger.info(
+        'Loaded %s-court snapshot in %.1fms', len(snapshot), (time.perf_counter() - started) * 1000,
+    )
+    return snapshot
+
+
+def mark_courts_changed():
+    if has_app_context():
+        get_court_index().mark_dirty()
+
+
+@event.listens_for(Court, 'after_insert')
+@event.listens_for(Court, 'after_delete')
+def _court_added_or_removed(_mapper, _connection, _target):
+    mark_courts_changed()
+
+
+@event.listens_for(Court, 'after_update')
+def _court_updated(_mapper, _connection, target):
+    state = sa_inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _INDEXED_ATTRS):
+        mark_courts_changed()
+
@@ -0,0 +1,89 @@
+"""Denormalized court rating aggregates (court.rating_sum / rating_count /
+rating_avg).
+
+Court lists, detail and sort=rating used to AVG/COUNT the whole court_review
+table on every read. The aggregates now live on the court row, are adjusted in
+the same transaction as each review write, and rating sort is a plain indexed
+ORDER BY. rebuild_court_ratings() recomputes them from court_review for
+backfills and repair (`python -m backend.seed --skip-courts --rebuild-ratings`).
+
+Both writers pin updated_at to its current value: a new review is not a court
+edit and must not invalidate the court index or tile ETags.
+"""
+from sqlalchemy import Float, and_, case, cast, func, or_, select, update
+
+from backend.app import db
+from backend.models import Court, CourtReview
+from backend.services.db_pool import lift_statement_timeout
+from backend.services.events import bulk_event, publish
+
+
+def _average(total, count):
+    return case((count > 0, cast(total, Float) / count), else_=None)
+
+
+def record_review_rating(court_id, old_rating, new_rating):
+    """Fold one review insert (old_rating None) or edit into the court's
+    aggregates. Runs in the caller's transaction; increments happen in SQL so
+    concurrent reviews of the same court don't lose updates."""
+    sum_delta = new_rating - (old_rating or 0)
+    count_delta = 1 if old_rating is None else 0
+    if not sum_delta and not count_delta:
+        return
+    total = Court.rating_sum + sum_delta
+    count = Court.rating_count + count_delta
+    db.session.execute(
+        update(Court)
+        .where(Court.id == court_id)
+        .values(
+            rating_sum=total,
+            rating_count=count,
+            rating_avg=_average(total, count),
+            updated_at=Court.updated_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rebuild_court_ratings():
+    """Recompute every court's aggregates from court_review. Returns the
+    number of courts that were out of date."""
+    lift_statement_timeout(db.session)
+    total = func.coalesce(
+        select(func.sum(CourtReview.rating))
+        .where(CourtReview.court_id == Court.id)
+        .scalar_subquery(),
+        0,
+    )
+    count = (
+        select(func.count(CourtReview.id))
+        .where(CourtReview.court_id == Court.id)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        update(Court)
+        .where(or_(
+            Court.rating_sum != total,
+            Court.rating_count != count,
+            and_(Court.rating_count > 0, Court.rating_avg.is_(None)),
+        ))
+        .values(
+            rating_sum=total,
+            rating_count=count,
+            rating_avg=_average(total, count),
+            updated_at=Court.updated_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount:
+        publish([bulk_event('court_ratings')])
+    return result.rowcount or 0
+
+
+def rating_fields(court):
+    """rating_avg / rating_count payload fields for a court row."""
+    return {
+        'rating_avg': round(court.rating_avg, 1) if court.rating_count else None,
+        'rating_count': court.rating_count or 0,
+    }
@@ -0,0 +1,117 @@
+"""In-process court text search: a sorted token vocabulary with prefix lookup.
+
+`q=` on /courts used to be three ILIKE '%q%' filters, a sequential scan of
+every court per keystroke. The search index is built with the court spatial
+index (backend.services.court_index) from the same rows and swapped in the
+same snapshot, so it shares its freshness rules.
+
+Names, cities and addresses are folded to lowercase ASCII tokens. Every query
+token must prefix-match some token of a court (so "lars pa" finds "Larson
+Park" while typing). Matches are ranked by field weight (name > city > state >
+address), with a bonus for whole-word matches and for names starting with
+the query, then by court size.
+"""
+import bisect
+import heapq
+import re
+import unicodedata
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Field weights: a hit in the name counts for more than one in the address.
+NAME_WEIGHT = 8
+CITY_WEIGHT = 4
+STATE_WEIGHT = 2
+ADDRESS_WEIGHT = 1
+EXACT_BONUS = 2
+NAME_PREFIX_BONUS = 16
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', str(text or '').replace("'", ''))
+    return text.encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+class SearchIndex:
+    def __init__(self, docs):
+        """docs: iterable of (court_id, name, city, state, address)."""
+        postings = {}
+        self._names = {}
+        for court_id, name, city, state, address in docs:
+            weights = {}
+            for field_text, weight in (
+                (address, ADDRESS_WEIGHT), (state, STATE_WEIGHT),
+                (city, CITY_WEIGHT), (name, NAME_WEIGHT),
+            ):
+                for token in tokenize(field_text):
+                    weights[token] = max(weight, weights.get(token, 0))
+            for token, weight in weights.items():
+                postings.setdefault(token, []).append((court_id, weight))
+            self._names[court_id] = ' '.join(tokenize(name))
+        self._terms = sorted(postings)
+        self._postings = [postings[term] for term in self._terms]
+        # _offsets[i] = total postings before term i, so the number of
+        # (court, term) hits under a prefix is one subtraction.
+        self._offsets = [0]
+        for hits in self._postings:
+            self._offsets.append(self._offsets[-1] + len(hits))
+
+    def __len__(self):
+        return len(self._names)
+
+    def _prefix_range(self, prefix):
+        lo = bisect.bisect_left(self._terms, prefix)
+        hi = bisect.bisect_left(self._terms, prefix + '\x7f', lo)
+        return lo, hi
+
+    def _token_scores(self, token, lo, hi, within=None):
+        """{court_id: best weight} over every term starting with `token`."""
+        scores = {}
+        for i in range(lo, hi):
+            bonus = EXACT_BONUS if self._terms[i] == token else 1
+            for court_id, weight in self._postings[i]:
+                if within is not None and court_id not in within:
+                    continue
+                weight *= bonus
+                if scores.get(court_id, 0) < weight:
+                    scores[court_id] = weight
+        return scores
+
+    def search(self, query, limit=None, rank_key=None):
+        """Court ids matching every token of `query`, best first.
+
+        `rank_key(court_id)` breaks relevance ties (lower sorts first)."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Most selective token first: later tokens only score its candidates.
+        ranges = sorted(
+            ((token, *self._prefix_range(token)) for token in tokens),
+            key=lambda r: self._offsets[r[2]] - self._offsets[r[1]],
+        )
+        totals = None
+        for token, lo, hi in ranges:
+            scores = self._token_scores(token, lo, hi, totals)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {cid: totals[cid] + score for cid, score in scores.items()}
+            if not totals:
+                return []
+
+        phrase = ' '.join(tokens)
+        names = self._names
+        scored = (
+            (
+                -(score + (NAME_PREFIX_BONUS if names[cid].startswith(phrase) else 0)),
+                rank_key(cid) if rank_key else 0,
+                cid,
+            )
+            for cid, score in totals.items()
+        )
+        ranked = heapq.nsmallest(limit, scored) if limit is not None else sorted(scored)
+        return [cid for _score, _rank, cid in ranked]
@@ -0,0 +1,132 @@
+"""Metered connection pool for Postgres deployments.
+
+Every request thread checks a connection out of SQLAlchemy's QueuePool. When
+all pool_size + max_overflow connections are busy, the thread blocks for up
+to pool_timeout seconds, which shows up as unexplained request latency (or a
+TimeoutError) with nothing in the logs. MeteredQueuePool is a QueuePool that
+times each checkout: a wait-time histogram, a log of recent slow checkouts
+and timeout counts, reported with the live pool state by /health/db.
+
+Sizing comes from the DB_POOL_* settings (backend.config._engine_options).
+This module is imported by the config, so it must not import the app.
+
+Connections also carry DB_STATEMENT_TIMEOUT_MS so a runaway request query is
+cancelled; bulk jobs whose statements legitimately run long (rating replay,
+court imports, sync and fingerprinting, and the rating, location and history
+rebuilds/backfills) lift it for their transaction with
+lift_statement_timeout().
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import exc, text
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds (ms) of the wait-time histogram buckets; the last is open-ended.
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+SLOW_CHECKOUT_LOG = 20
+
+
+class PoolMetrics:
+    def __init__(self, slow_checkout_ms):
+        self.slow_checkout_ms = slow_checkout_ms
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.slow = deque(maxlen=SLOW_CHECKOUT_LOG)
+
+    def record(self, wait_ms, timed_out=False):
+        bucket = next(
+            (i for i, bound in enumerate(WAIT_BUCKETS_MS) if wait_ms <= bound), len(WAIT_BUCKETS_MS),
+        )
+        with self._lock:
+            self.buckets[bucket] += 1
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.total_wait_ms += wait_ms
+            if timed_out or wait_ms >= self.slow_checkout_ms:
+                self.slow_checkouts += 1
+                self.slow.appendleft({
+                    'at': datetime.now(timezone.utc).isoformat(),
+                    'wait_ms': round(wait_ms, 2),
+                    'timed_out': timed_out,
+                    'thread': threading.current_thread().name,
+                })
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait_ms, 2),
+                'slow_checkout_ms': self.slow_checkout_ms,
+                'slow_checkouts': self.slow_checkouts,
+                'wait_histogram': [
+                    {'le_ms': bound, 'count': count}
+                    for bound, count in zip((*WAIT_BUCKETS_MS, None), self.buckets)
+                ],
+                'recent_slow': list(self.slow),
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, creator, slow_checkout_ms=100, **kw):
+        super().__init__(creator, **kw)
+        self.metrics = PoolMetrics(slow_checkout_ms)
+
+    def recreate(self):
+        # Keep the metrics across dispose() (fresh pool, same process).
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        self.metrics.record((time.perf_counter() - started) * 1000)
+        return connection
+
+
+def lift_statement_timeout(session):
+    """Disable the statement timeout for the rest of the session's current
+    transaction (Postgres; SET LOCAL, so the pooled connection keeps its
+    limit once the transaction ends)."""
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text('SET LOCAL statement_timeout = 0'))
+
+
+def pool_metrics(engine):
+    """Live pool state plus checkout metrics (when the pool is metered)."""
+    pool = engine.pool
+    payload = {'pool': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        payload.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'timeout_seconds': pool.timeout(),
+            'recycle_seconds': pool._recycle,
+            'pre_ping': pool._pre_ping,
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        })
+    metrics = getattr(pool, 'metrics', None)
+    if metrics is not None:
+        payload.update(metrics.snapshot())
+    return payload
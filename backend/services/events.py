@@ -0,0 +1,345 @@
+"""Push event bus: fans committed changes out to open /api/stream clients.
+
+Events are derived from ORM flushes (new messages, notifications, friendship,
+block and presence changes, game/roster/invite changes) and published only after
+the transaction commits, so a client that refetches on an event always sees
+the row. Payloads carry ids, never content: clients re-read through the
+normal (authorized) endpoints.
+
+Channels:
+    user:<id>    anything that changes what /me or the user's chats show
+    court:<id>   court chat messages, presence and games at a court
+    bulk         an offline tool rewrote rows wholesale (rating replay,
+                 location/rating rebuilds, court imports); nobody streams it,
+                 but per-process caches keyed on user events invalidate
+
+Backends (EVENT_BUS_BACKEND):
+    local     in-process fan-out; correct for a single worker process
+    postgres  NOTIFY on commit plus a LISTEN thread per worker, so events
+              reach streams held by any worker
+
+One bus lives per app (app.extensions['event_bus']).
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect as sa_inspect, select, text, union
+from sqlalchemy.orm import Session
+
+from backend.app import db
+from backend.models import (
+    BlockedUser,
+    CheckIn,
+    Friendship,
+    Game,
+    GameInvite,
+    GamePlayer,
+    Message,
+    Notification,
+    User,
+)
+
+PG_CHANNEL = 'picklepals_events'
+BULK_CHANNEL = 'bulk'
+# NOTIFY payloads must stay under 8000 bytes; larger batches are split.
+PG_PAYLOAD_LIMIT = 7900
+SUBSCRIPTION_BUFFER = 100
+_PENDING_KEY = 'pending_events'
+
+# Columns no client shows: a change touching only these publishes nothing
+# (presence pings would otherwise emit an event every minute per player).
+_SILENT_ATTRS = {
+    CheckIn: {'last_presence_ping_at'},
+    User: {'last_lat', 'last_lng', 'last_location_at', 'loc_lat', 'loc_lng', 'geo_cell'},
+}
+
+
+class Subscription:
+    def __init__(self, channels):
+        self.channels = frozenset(channels)
+        self._events = deque(maxlen=SUBSCRIPTION_BUFFER)
+        self._cond = threading.Condition()
+
+    def push(self, evt):
+        with self._cond:
+            self._events.append(evt)
+            self._cond.notify_all()
+
+    def get(self, timeout):
+        """Next event, or None once `timeout` seconds pass without one."""
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class LocalBus:
+    name = 'local'
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._listeners = []
+        self._open_streams = 0
+
+    def start(self):
+        pass
+
+    def open_stream(self, limit):
+        """Reserve one of `limit` long-lived stream slots (each holds a
+        worker thread); False when all are taken."""
+        with self._lock:
+            if self._open_streams >= limit:
+                return False
+            self._open_streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._open_streams -= 1
+
+    @property
+    def open_streams(self):
+        return self._open_streams
+
+    def subscribe(self, channels):
+        sub = Subscription(channels)
+        with self._lock:
+            for channel in sub.channels:
+                self._subscribers.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for channel in sub.channels:
+                subs = self._subscribers.get(channel)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[channel]
+
+    def add_listener(self, func):
+        """Call func(event) for every event this process receives."""
+        self._listeners.append(func)
+
+    def publish(self, events):
+        self.dispatch(events)
+
+    def dispatch(self, events):
+        for evt in events:
+            for func in self._listeners:
+                func(evt)
+            with self._lock:
+                subs = list(self._subscribers.get(evt['channel'], ()))
+            for sub in subs:
+                sub.push(evt)
+
+
+class PostgresBus(LocalBus):
+    """Publishes with pg_notify and receives every worker's events (including
+    its own) on a LISTEN connection."""
+    name = 'postgres'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._listen, name='event-bus-listener', daemon=True)
+        self._thread.start()
+
+    def publish(self, events):
+        with db.engine.connect() as conn:
+            for payload in _payloads(events, PG_PAYLOAD_LIMIT):
+                conn.execute(
+                    text('SELECT pg_notify(:channel, :payload)'),
+                    {'channel': PG_CHANNEL, 'payload': payload},
+                )
+            conn.commit()
+
+    def _listen(self):
+        import psycopg
+
+        with self.app.app_context():
+            url = db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        while True:
+            try:
+                with psycopg.connect(url, autocommit=True) as conn:
+                    conn.execute(f'LISTEN {PG_CHANNEL}')
+                    for notify in conn.notifies():
+                        self.dispatch(json.loads(notify.payload))
+            except Exception:
+                self.app.logger.exception('Event bus listener disconnected; retrying')
+                time.sleep(5)
+
+
+def _payloads(events, limit):
+    """JSON arrays of `events`, each at most `limit` bytes. Events carry ids
+    only, so a single event always fits."""
+    batch, size = [], 2
+    for evt in events:
+        encoded = json.dumps(evt, separators=(',', ':'))
+        cost = len(encoded.encode('utf-8')) + 1
+        if batch and size + cost > limit:
+            yield f'[{",".join(batch)}]'
+            batch, size = [], 2
+        batch.append(encoded)
+        size += cost
+    if batch:
+        yield f'[{",".join(batch)}]'
+
+
+_BACKENDS = {'local': LocalBus, 'postgres': PostgresBus}
+
+
+def get_event_bus(app=None):
+    app = app or current_app
+    bus = app.extensions.get('event_bus')
+    if bus is None:
+        backend = str(app.config.get('EVENT_BUS_BACKEND') or 'local').lower()
+        bus = _BACKENDS.get(backend, LocalBus)(app)
+        app.extensions['event_bus'] = bus
+    return bus
+
+
+def publish(events):
+    """Publish already-committed events (bulk UPDATEs the ORM hooks can't see).
+    Best-effort, like the commit hook: the write has already happened."""
+    events = list(events)
+    if events and has_app_context():
+        try:
+            get_event_bus().publish(events)
+        except Exception:
+            current_app.logger.exception('Event publish failed')
+
+
+def _evt(channel, kind, **data):
+    return {'channel': channel, 'type': kind, **data}
+
+
+def presence_events(user_id, court_id, checked_in):
+    return [
+        _evt(f'user:{user_id}', 'presence', court_id=court_id, checked_in=checked_in),
+        _evt(f'court:{court_id}', 'presence', user_id=user_id, checked_in=checked_in),
+    ]
+
+
+def user_event(user_id, kind, **data):
+    return _evt(f'user:{user_id}', kind, **data)
+
+
+def bulk_event(source):
+    return _evt(BULK_CHANNEL, 'bulk_update', source=source)
+
+
+def _loaded_game_user_ids(game):
+    """Creator plus already-loaded players/invitees (for deleted games, whose
+    rows are gone by the time participants are queried)."""
+    loaded = sa_inspect(game).dict
+    ids = {game.creator_id}
+    ids.update(p.user_id for p in loaded.get('players') or ())
+    ids.update(i.user_id for i in loaded.get('invites') or ())
+    return ids
+
+
+def _game_participants(session, game_ids):
+    """{game_id: {user_id, …}} for creators, players and invitees."""
+    rows = session.connection().execute(union(
+        select(Game.id, Game.creator_id).where(Game.id.in_(game_ids)),
+        select(GamePlayer.game_id, GamePlayer.user_id).where(GamePlayer.game_id.in_(game_ids)),
+        select(GameInvite.game_id, GameInvite.user_id).where(GameInvite.game_id.in_(game_ids)),
+    ))
+    participants = {}
+    for game_id, user_id in rows:
+        participants.setdefault(game_id, set()).add(user_id)
+    return participants
+
+
+def _silent_change(obj):
+    silent = _SILENT_ATTRS.get(type(obj))
+    if not silent:
+        return False
+    changed = {attr.key for attr in sa_inspect(obj).attrs if attr.history.has_changes()}
+    return changed <= silent
+
+
+def _events_for(obj, deleted):
+    if isinstance(obj, Message):
+        if obj.court_id:
+            return [_evt(f'court:{obj.court_id}', 'court_message', id=obj.id, court_id=obj.court_id)]
+        kind = 'messages_read' if obj.read_at is not None else 'message'
+        return [
+            _evt(f'user:{uid}', kind, id=obj.id, sender_id=obj.sender_id, recipient_id=obj.recipient_id)
+            for uid in {obj.sender_id, obj.recipient_id}
+        ]
+    if isinstance(obj, Notification):
+        return [_evt(f'user:{obj.user_id}', 'notification', id=obj.id)]
+    if isinstance(obj, Friendship):
+        return [
+            _evt(f'user:{uid}', 'friendship', id=obj.id)
+            for uid in {obj.requester_id, obj.addressee_id}
+        ]
+    if isinstance(obj, CheckIn):
+        return presence_events(obj.user_id, obj.court_id, not deleted and obj.checked_out_at is None)
+    if isinstance(obj, Game):
+        return [_evt(f'court:{obj.court_id}', 'game', id=obj.id)]
+    if isinstance(obj, BlockedUser):
+        # Only the blocker hears about it; the cache on other workers drops
+        # both users' entries.
+        return [_evt(f'user:{obj.blocker_id}', 'block', user_id=obj.blocked_id)]
+    if isinstance(obj, User):
+        return [_evt(f'user:{obj.id}', 'profile')]
+    return []
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_events(session, _flush_context):
+    deleted = session.deleted
+    events = []
+    # Game, roster and invite changes reach every participant of the game
+    # (their /me banner and game screens show the whole roster).
+    game_users = {}
+    for obj in (*session.new, *session.dirty, *deleted):
+        if obj in session.dirty and (not session.is_modified(obj) or _silent_change(obj)):
+            continue
+        events.extend(_events_for(obj, obj in deleted))
+        if isinstance(obj, Game):
+            users = game_users.setdefault(obj.id, set())
+            if obj in deleted:
+                users.update(_loaded_game_user_ids(obj))
+        elif isinstance(obj, (GamePlayer, GameInvite)):
+            game_users.setdefault(obj.game_id, set()).add(obj.user_id)
+    if game_users:
+        for game_id, user_ids in _game_participants(session, list(game_users)).items():
+            game_users[game_id].update(user_ids)
+        events.extend(
+            _evt(f'user:{uid}', 'game', id=game_id)
+            for game_id, user_ids in game_users.items() for uid in user_ids
+        )
+    if events:
+        pending = session.info.setdefault(_PENDING_KEY, {})
+        for evt in events:
+            # One event per (channel, payload) per transaction.
+            pending[json.dumps(evt, sort_keys=True)] = evt
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_events(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending and has_app_context():
+        try:
+            get_event_bus().publish(list(pending.values()))
+        except Exception:
+            # Push is best-effort; clients still poll as a fallback.
+            current_app.logger.exception('Event publish failed')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_events(session):
+    session.info.pop(_PENDING_KEY, None)
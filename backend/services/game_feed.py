@@ -0,0 +1,117 @@
+"""Games feed engine: keyset-paginated pages of upcoming games.
+
+Nearby pages are ordered by (distance, start time, id) from the viewer. The
+candidates are read from the database on every request, so a game created a
+moment ago (in any worker) is listed at once: one column-only query joins
+each upcoming game to its court's coordinates and filters on indexed
+predicates (court latitude/longitude inside the radius's bounding box,
+status, scheduled_at, and the viewer's visibility rules mirroring
+Game.visible_to). Distances are computed for those rows alone, so far-away
+games can't crowd nearby ones out of a fixed SQL window, and only the page's
+games are loaded as objects.
+
+Other feeds (mine, friends, no location) page by (start time, id) in SQL.
+
+Cursors are the opaque sort key of the last item served, so a page never
+repeats or skips games already ordered before it as new games are created.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from backend.app import db
+from backend.models import Court, Game, GameInvite, GamePlayer, utcnow
+from backend.services.court_index import haversine_miles
+from backend.services.live_counters import STARTED_GAME_GRACE
+from backend.services.user_locations import radius_box
+
+PAGE_SIZE = 100
+
+
+def visible_clause(viewer_id, friend_ids=()):
+    """SQL twin of Game.visible_to for feeds."""
+    clauses = [Game.visibility == 'open']
+    if viewer_id:
+        clauses.extend([
+            Game.creator_id == viewer_id,
+            Game.players.any(GamePlayer.user_id == viewer_id),
+            and_(Game.visibility == 'private', Game.invites.any(GameInvite.user_id == viewer_id)),
+        ])
+        if friend_ids:
+            clauses.append(and_(Game.visibility == 'friends', Game.creator_id.in_(friend_ids)))
+    return or_(*clauses)
+
+
+def feed_since():
+    """Earliest start time still listed (games stay up a while after starting)."""
+    return utcnow() - STARTED_GAME_GRACE
+
+
+def encode_cursor(key):
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """The sort key inside `cursor`; ValueError if it isn't one of `size` items."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception as exc:
+        raise ValueError('invalid cursor') from exc
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError('invalid cursor')
+    return tuple(key)
+
+
+def nearby_page(lat, lng, radius, viewer_id, friend_ids, cursor=None, limit=PAGE_SIZE):
+    """([(game, distance_miles), …], next_cursor) within `radius` miles."""
+    after = None
+    if cursor is not None:
+        distance, at, game_id = decode_cursor(cursor, 3)
+        try:
+            after = (float(distance), str(at), int(game_id))
+        except (TypeError, ValueError) as exc:
+            raise ValueError('invalid cursor') from exc
+
+    south, west, north, east = radius_box(lat, lng, radius)
+    rows = db.session.query(Game.id, Game.scheduled_at, Court.latitude, Court.longitude).join(
+        Court, Court.id == Game.court_id,
+    ).filter(
+        Court.latitude.between(south, north),
+        Court.longitude.between(west, east),
+        Game.status == 'upcoming',
+        Game.scheduled_at >= feed_since(),
+        visible_clause(viewer_id, friend_ids),
+    )
+    keys = []
+    for game_id, at, court_lat, court_lng in rows:
+        distance = haversine_miles(lat, lng, court_lat, court_lng)
+        key = (distance, at.isoformat(), game_id)
+        if distance <= radius and (after is None or key > after):
+            keys.append(key)
+    keys.sort()
+    page, more = keys[:limit], len(keys) > limit
+    games = {game.id: game for game in Game.query.filter(Game.id.in_([key[2] for key in page]))}
+    items = [(games[key[2]], key[0]) for key in page if key[2] in games]
+    return items, encode_cursor(page[-1]) if more else None
+
+
+def time_page(query, cursor=None, limit=PAGE_SIZE):
+    """Page `query` by (scheduled_at, id): ([game, …], next_cursor)."""
+    if cursor is not None:
+        at, game_id = decode_cursor(cursor, 2)
+        try:
+            at, game_id = datetime.fromisoformat(at), int(game_id)
+        except (TypeError, ValueError) as exc:
+            raise ValueError('invalid cursor') from exc
+        query = query.filter(or_(
+            Game.scheduled_at > at,
+            and_(Game.scheduled_at == at, Game.id > game_id),
+        ))
+    games = query.order_by(Game.scheduled_at.asc(), Game.id.asc()).limit(limit + 1).all()
+    if len(games) <= limit:
+        return games, None
+    last = games[limit - 1]
+    return games[:limit], encode_cursor([last.scheduled_at.isoformat(), last.id])
@@ -0,0 +1,47 @@
+"""Bulk game serialization.
+
+Game.to_dict reaches the court, every player's user, each of those users'
+home court (through to_public_dict) and the score submitter. Serializing a
+feed game by game lazy-loads each of those separately; prefetch_games loads
+them for the whole list in a fixed number of queries (rosters, users, courts)
+and attaches them, so the to_dict calls afterwards issue no further SQL.
+"""
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from backend.app import db
+from backend.models import Court, Game, User
+
+
+def prefetch_games(games):
+    """Load everything to_dict touches for `games`; returns them as a list."""
+    games = list(games)
+    if not games:
+        return games
+    # Rosters are selectin-loaded with the games; this only fills any that
+    # weren't (games fetched one by one, or with the relationship expired).
+    unloaded = [game.id for game in games if 'players' not in db.inspect(game).dict]
+    if unloaded:
+        Game.query.options(selectinload(Game.players)).filter(Game.id.in_(unloaded)).all()
+
+    players = [p for game in games for p in game.players]
+    user_ids = {p.user_id for p in players}
+    users = {u.id: u for u in User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+    court_ids = {game.court_id for game in games}
+    court_ids.update(u.home_court_id for u in users.values() if u.home_court_id)
+    courts = {c.id: c for c in Court.query.filter(Court.id.in_(court_ids))}
+
+    # Attach them: the identity map only holds weak references, so merely
+    # having loaded the rows wouldn't keep the lazy loads away.
+    for game in games:
+        set_committed_value(game, 'court', courts.get(game.court_id))
+    for player in players:
+        set_committed_value(player, 'user', users.get(player.user_id))
+    for user in users.values():
+        set_committed_value(user, 'home_court', courts.get(user.home_court_id))
+    return games
+
+
+def serialize_games(games, viewer_id=None):
+    """[game.to_dict(viewer_id) …] without per-game lazy loads."""
+    return [game.to_dict(viewer_id) for game in prefetch_games(games)]
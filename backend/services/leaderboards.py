@@ -0,0 +1,246 @@
+"""Materialized leaderboards: ranked players per region, in rating order.
+
+The leaderboard used to sort every ranked user by rating on each read, with
+no way to page past the top 50 or say where a given player stands. The store
+keeps one sorted list per region instead:
+
+    ('global', None)      every ranked player
+    ('state', 'CA')       home court's state, else the latest check-in court's
+    ('metro', geo_cell)   effective location's grid cell (user_locations)
+
+each holding (-rating, user_id) keys, so a page is a slice and a rank is a
+bisect; neither touches the user table.
+
+Ratings move when games finalize (ELO), and regions move with home courts
+and check-ins. Those flushes mark the users stale once the transaction
+commits; other worker processes hear about them through the `profile` and
+`presence` events on the event bus. Stale users are re-read by primary key
+on the next leaderboard read. A periodic `leaderboards_reconcile` job
+rebuilds everything (court state edits, writes that bypassed the ORM).
+
+One store lives per app (app.extensions['leaderboards']).
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect as sa_inspect, select
+from sqlalchemy.orm import Session
+
+from backend.app import db
+from backend.models import CheckIn, User
+from backend.services.court_index import get_court_index, haversine_miles
+from backend.services.events import get_event_bus
+from backend.services.user_locations import cell_bounds, radius_box
+
+GLOBAL = ('global', None)
+
+_PENDING_KEY = 'leaderboard_changes'
+# User columns that decide rank or region membership.
+_RANKED_ATTRS = ('rating', 'ranked_wins', 'ranked_losses', 'home_court_id', 'geo_cell')
+
+
+def _load_entries(user_ids=None):
+    """{user_id: (sort key, regions)} for ranked users (all, or `user_ids`)."""
+    latest_court = (
+        select(CheckIn.court_id)
+        .where(CheckIn.user_id == User.id)
+        .order_by(CheckIn.checked_in_at.desc(), CheckIn.id.desc())
+        .limit(1)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    query = db.session.query(
+        User.id, User.rating, User.geo_cell, User.home_court_id, latest_court,
+    ).filter(User.ranked_wins + User.ranked_losses > 0)
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    index = get_court_index()
+    index.ensure_fresh()
+    entries = {}
+    for uid, rating, cell, home_court_id, checkin_court_id in query:
+        court = index.get(home_court_id if home_court_id else checkin_court_id)
+        regions = [GLOBAL]
+        if court is not None and court.state:
+            regions.append(('state', court.state.upper()))
+        if cell is not None:
+            regions.append(('metro', cell))
+        entries[uid] = ((-rating, uid), tuple(regions))
+    return entries
+
+
+class Leaderboards:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._boards = {}
+        self._entries = {}
+        self._stale = set()
+
+    def mark_changed(self, user_ids):
+        with self._lock:
+            self._stale.update(user_ids)
+
+    def ensure_fresh(self):
+        """Load on first use, then re-read any users marked stale."""
+        if not self._loaded:
+            self.reconcile()
+            return
+        with self._lock:
+            stale, self._stale = self._stale, set()
+        if not stale:
+            return
+        entries = _load_entries(stale)
+        with self._lock:
+            for uid in stale:
+                self._remove_locked(uid)
+                if uid in entries:
+                    self._insert_locked(uid, entries[uid])
+
+    def reconcile(self):
+        """Rebuild from the database. Returns the number of players whose
+        rating or regions were corrected (0 on first load)."""
+        with self._lock:
+            # Anything marked from here on is re-read after this snapshot.
+            self._stale.clear()
+        entries = _load_entries()
+        boards = {}
+        for uid, (key, regions) in entries.items():
+            for region in regions:
+                boards.setdefault(region, []).append(key)
+        for keys in boards.values():
+            keys.sort()
+        with self._lock:
+            drift = 0
+            if self._loaded:
+                drift = sum(
+                    1 for uid in self._entries.keys() | entries.keys()
+                    if self._entries.get(uid) != entries.get(uid)
+                )
+            self._boards, self._entries = boards, entries
+            self._loaded = True
+        return drift
+
+    def _remove_locked(self, uid):
+        entry = self._entries.pop(uid, None)
+        if entry is None:
+            return
+        key, regions = entry
+        for region in regions:
+            board = self._boards[region]
+            del board[bisect_left(board, key)]
+            if not board:
+                del self._boards[region]
+
+    def _insert_locked(self, uid, entry):
+        key, regions = entry
+        self._entries[uid] = entry
+        for region in regions:
+            insort(self._boards.setdefault(region, []), key)
+
+    def page(self, region, offset=0, limit=50):
+        """([(rank, user_id), …], total players in the region).
+
+        Ranks are competition-style: equal ratings share a rank."""
+        self.ensure_fresh()
+        with self._lock:
+            board = self._boards.get(region, ())
+            return (
+                [(bisect_left(board, (key[0],)) + 1, key[1]) for key in board[offset:offset + limit]],
+                len(board),
+            )
+
+    def rank(self, region, user_id):
+        """(rank, total) of a player in a region, or None when not on it."""
+        self.ensure_fresh()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or region not in entry[1]:
+                return None
+            board = self._boards[region]
+            return bisect_left(board, (entry[0][0],)) + 1, len(board)
+
+    def regions_of(self, user_id):
+        """The regions a ranked player appears in (empty when unranked)."""
+        self.ensure_fresh()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry[1] if entry else ()
+
+    def on_event(self, evt):
+        if evt.get('type') in ('profile', 'presence') and evt['channel'].startswith('user:'):
+            self.mark_changed([int(evt['channel'].split(':', 1)[1])])
+
+
+def get_leaderboards(app=None):
+    app = app or current_app
+    boards = app.extensions.get('leaderboards')
+    if boards is None:
+        boards = Leaderboards()
+        get_event_bus(app).add_listener(boards.on_event)
+        app.extensions['leaderboards'] = boards
+    return boards
+
+
+def reconcile_leaderboards():
+    return get_leaderboards().reconcile()
+
+
+def state_near(lat, lng, radius_miles=25.0):
+    """State of the court closest to a point, or None with none in range."""
+    index = get_court_index()
+    index.ensure_fresh()
+    best = None
+    for court in index.within(*radius_box(lat, lng, radius_miles)):
+        distance = haversine_miles(lat, lng, court.lat, court.lng)
+        if court.state and (best is None or distance < best[0]):
+            best = (distance, court.state.upper())
+    return best[1] if best else None
+
+
+def region_label(region):
+    """Human name for a region: 'CA', or a metro's most common court city."""
+    scope, key = region
+    if scope == 'state':
+        return key
+    if scope == 'metro':
+        index = get_court_index()
+        index.ensure_fresh()
+        cities = Counter(
+            (court.city, court.state) for court in index.within(*cell_bounds(key)) if court.city
+        )
+        if cities:
+            city, state = cities.most_common(1)[0][0]
+            return f'{city}, {state}' if state else city
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, _flush_context):
+    changed = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            state = sa_inspect(obj)
+            if obj in session.dirty and not any(
+                state.attrs[name].history.has_changes() for name in _RANKED_ATTRS
+            ):
+                continue
+            changed.add(obj.id)
+        elif isinstance(obj, CheckIn) and obj in session.new:
+            # The latest check-in court places home-court-less players in a state.
+            changed.add(obj.user_id)
+    if changed:
+        session.info.setdefault(_PENDING_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changed = session.info.pop(_PENDING_KEY, None)
+    if changed and has_app_context():
+        get_leaderboards().mark_changed(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_changes(session):
+    session.info.pop(_PENDING_KEY, None)
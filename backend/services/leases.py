@@ -0,0 +1,58 @@
+"""Cross-process leader leases backed by the worker_lease table.
+
+A lease is a named row holding (holder, expires_at). Whoever holds an
+unexpired lease owns the task; the holder renews it on every run and anyone
+may take it over once it lapses, so a crashed worker never wedges the task.
+"""
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from backend.app import db
+from backend.models import WorkerLease, utcnow
+
+_worker_ids = {}
+
+
+def worker_id():
+    """Identifies this process as a lease holder.
+
+    Computed per pid at call time: a module-level constant would be shared
+    by every worker forked after import (gunicorn --preload), and they would
+    all renew each other's leases.
+    """
+    pid = os.getpid()
+    if pid not in _worker_ids:
+        _worker_ids[pid] = f'{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}'
+    return _worker_ids[pid]
+
+
+def acquire_lease(name, ttl_seconds, holder=None):
+    """Take or renew the named lease. Returns True if `holder` (this
+    process by default) now owns it."""
+    holder = holder or worker_id()
+    now = utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    result = db.session.execute(
+        update(WorkerLease)
+        .where(
+            WorkerLease.name == name,
+            or_(WorkerLease.holder == holder, WorkerLease.expires_at < now),
+        )
+        .values(holder=holder, expires_at=expires_at, updated_at=now)
+    )
+    if result.rowcount:
+        db.session.commit()
+        return True
+    try:
+        db.session.add(WorkerLease(name=name, holder=holder, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # Row exists and someone else holds it.
+        db.session.rollback()
+        return False
@@ -0,0 +1,228 @@
+"""In-process live activity counters: players checked in and upcoming games
+per court.
+
+Every court list, favorites read and map overlay used to run two GROUP BY
+queries (CheckIn, Game) to decorate results with players_here and
+upcoming_games. The counters keep the same answer in memory, keyed by court
+id, as sets of ids rather than bare integers so replaying a change is
+idempotent:
+
+    checkins[court_id] = {checkin_id, ...}          # currently checked in
+    games[court_id]    = {game_id: scheduled_at}    # status == 'upcoming'
+
+Upcoming games stay in the store for STARTED_GAME_GRACE after their start
+time (the games feed, backend.services.game_feed, still lists them); counts
+only include games that haven't started.
+
+Changes are picked up from ORM flushes (check-in, check-out, game create,
+cancel, completion) and applied only once the transaction commits; bulk
+UPDATEs report the rows they touched via apply_checkouts(). A periodic
+`live_counters_reconcile` job rebuilds the store from the database, which
+also catches writes made by other worker processes; changes applied while
+the rebuild reads are replayed onto it before the swap.
+
+One store lives per app (app.extensions['live_counters']).
+"""
+import threading
+from datetime import timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.app import db
+from backend.models import CheckIn, Game, utcnow
+
+_PENDING_KEY = 'live_counter_changes'
+STARTED_GAME_GRACE = timedelta(hours=2)
+
+
+class LiveCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._checkins = {}
+        self._games = {}
+        self._checkin_court = {}
+        self._game_court = {}
+        # One buffer per reconcile in flight: changes applied during its read.
+        self._replays = []
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.reconcile()
+
+    def reconcile(self):
+        """Rebuild from the database. Returns the number of courts whose
+        counts were corrected (0 on first load)."""
+        replay = []
+        with self._lock:
+            self._replays.append(replay)
+        try:
+            checkin_rows = db.session.query(CheckIn.id, CheckIn.court_id).filter(
+                CheckIn.checked_out_at.is_(None),
+            ).all()
+            game_rows = db.session.query(Game.id, Game.court_id, Game.scheduled_at).filter(
+                Game.status == 'upcoming',
+                Game.scheduled_at >= utcnow() - STARTED_GAME_GRACE,
+            ).all()
+        except Exception:
+            with self._lock:
+                self._replays.remove(replay)
+            raise
+        checkins, games = {}, {}
+        for checkin_id, court_id in checkin_rows:
+            checkins.setdefault(court_id, set()).add(checkin_id)
+        for game_id, court_id, scheduled_at in game_rows:
+            games.setdefault(court_id, {})[game_id] = scheduled_at
+        with self._lock:
+            self._replays.remove(replay)
+            now = utcnow()
+            before = self._counts_locked(None, now) if self._loaded else None
+            self._checkins = checkins
+            self._games = games
+            self._checkin_court = {
+                cid: court_id for court_id, ids in checkins.items() for cid in ids
+            }
+            self._game_court = {
+                gid: court_id for court_id, by_id in games.items() for gid in by_id
+            }
+            # Commits that landed after the read; replaying one it already
+            # saw is a no-op.
+            for changes in replay:
+                self._apply_locked(*changes)
+            drift = 0
+            if before is not None:
+                after = self._counts_locked(None, now)
+                drift = len(_diff(before[0], after[0]) | _diff(before[1], after[1]))
+            self._loaded = True
+        return drift
+
+    def apply(self, checkins=(), games=()):
+        """Apply committed changes.
+
+        checkins: (checkin_id, court_id, active) tuples.
+        games: (game_id, court_id, scheduled_at or None when not upcoming).
+        """
+        with self._lock:
+            for replay in self._replays:
+                replay.append((checkins, games))
+            if self._loaded:
+                self._apply_locked(checkins, games)
+
+    def _apply_locked(self, checkins, games):
+        for checkin_id, court_id, active in checkins:
+            _discard(self._checkins, self._checkin_court.pop(checkin_id, None), checkin_id)
+            if active:
+                self._checkins.setdefault(court_id, set()).add(checkin_id)
+                self._checkin_court[checkin_id] = court_id
+        for game_id, court_id, scheduled_at in games:
+            _discard(self._games, self._game_court.pop(game_id, None), game_id)
+            if scheduled_at is not None:
+                self._games.setdefault(court_id, {})[game_id] = scheduled_at
+                self._game_court[game_id] = court_id
+
+    def apply_checkouts(self, rows):
+        """Record check-outs done with a bulk UPDATE: (checkin_id, court_id) rows."""
+        self.apply(checkins=[(checkin_id, court_id, False) for checkin_id, court_id in rows])
+
+    def counts(self, court_ids=None):
+        """({court_id: players checked in}, {court_id: upcoming games}); every
+        court with activity when court_ids is None."""
+        self.ensure_loaded()
+        with self._lock:
+            return self._counts_locked(court_ids, utcnow())
+
+    def _counts_locked(self, court_ids, now):
+        return (
+            _player_counts(self._checkins, court_ids),
+            _game_counts(self._games, court_ids, now),
+        )
+
+    def courts_with_players(self):
+        """Ids of courts with at least one player checked in right now."""
+        self.ensure_loaded()
+        with self._lock:
+            return {court_id for court_id, ids in self._checkins.items() if ids}
+
+
+def _discard(buckets, court_id, member_id):
+    if court_id is None:
+        return
+    bucket = buckets.get(court_id)
+    if bucket is None:
+        return
+    if isinstance(bucket, dict):
+        bucket.pop(member_id, None)
+    else:
+        bucket.discard(member_id)
+    if not bucket:
+        del buckets[court_id]
+
+
+def _player_counts(checkins, court_ids):
+    if court_ids is None:
+        return {court_id: len(ids) for court_id, ids in checkins.items() if ids}
+    counts = {}
+    for court_id in court_ids:
+        ids = checkins.get(court_id)
+        if ids:
+            counts[court_id] = len(ids)
+    return counts
+
+
+def _game_counts(games, court_ids, now):
+    keys = games.keys() if court_ids is None else court_ids
+    counts = {}
+    for court_id in keys:
+        by_id = games.get(court_id)
+        if not by_id:
+            continue
+        # Games whose start time passed without being completed drop out here
+        # (the first reconcile after STARTED_GAME_GRACE prunes them for good).
+        count = sum(1 for scheduled_at in by_id.values() if scheduled_at >= now)
+        if count:
+            counts[court_id] = count
+    return counts
+
+
+def _diff(a, b):
+    return {key for key in a.keys() | b.keys() if a.get(key) != b.get(key)}
+
+
+def get_live_counters(app=None):
+    app = app or current_app
+    return app.extensions.setdefault('live_counters', LiveCounters())
+
+
+def reconcile_live_counters():
+    return get_live_counters().reconcile()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, _flush_context):
+    pending = None
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CheckIn):
+            active = obj not in session.deleted and obj.checked_out_at is None
+            change = ('checkins', (obj.id, obj.court_id, active))
+        elif isinstance(obj, Game):
+            upcoming = obj not in session.deleted and obj.status == 'upcoming'
+            change = ('games', (obj.id, obj.court_id, obj.scheduled_at if upcoming else None))
+        else:
+            continue
+        if pending is None:
+            pending = session.info.setdefault(_PENDING_KEY, {'checkins': [], 'games': []})
+        pending[change[0]].append(change[1])
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending and has_app_context():
+        get_live_counters().apply(**pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_changes(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,80 @@
+"""Per-user version counters for cheap /api/me revalidation.
+
+Everything /me shows (messages, friend requests, notifications, presence,
+games, profile) already publishes a `user:<id>` event on the event bus when it
+commits, so a counter bumped by each of those events changes exactly when the
+payload can. GET /me hands the counter out as an ETag; a poll carrying the
+current one gets a 304 without any of the payload queries.
+
+Bulk tools (rating replay, location and court-rating rebuilds, court
+imports) rewrite rows with Core statements that publish no per-user events.
+They publish one `bulk` event instead, which bumps a global counter that is
+part of every tag.
+
+The one input that changes without a write is the clock: an upcoming game
+turns "live" at its start time. Each snapshot records when the banner next
+changes on its own and stops validating after it.
+
+Tags embed a per-process epoch, so a restart (or a different worker, whose
+counters started elsewhere) simply misses once and rebuilds. With several
+workers the counters are only complete on the postgres event bus, where every
+worker receives every event.
+"""
+import secrets
+import threading
+
+from flask import current_app
+
+from backend.services.events import BULK_CHANNEL, get_event_bus
+
+
+class MeVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = secrets.token_hex(4)
+        self._versions = {}
+        self._bulk = 0
+        # user_id -> (etag, valid_until) of the last snapshot served.
+        self._snapshots = {}
+
+    def on_event(self, evt):
+        channel = evt.get('channel', '')
+        if channel.startswith('user:'):
+            self.bump(int(channel[5:]))
+        elif channel == BULK_CHANNEL:
+            with self._lock:
+                self._bulk += 1
+
+    def bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def etag(self, user_id):
+        return f'me-{user_id}-{self._epoch}.{self._bulk}-{self._versions.get(user_id, 0)}'
+
+    def remember(self, user_id, etag, valid_until):
+        """Record a snapshot built at version `etag` (taken before the payload
+        was read, so a change racing the build leaves it already stale)."""
+        with self._lock:
+            self._snapshots[user_id] = (etag, valid_until)
+
+    def valid_etag(self, user_id, now):
+        """ETag of the last snapshot served to the user if it still matches
+        their current version and clock, else None."""
+        snapshot = self._snapshots.get(user_id)
+        if snapshot is None:
+            return None
+        etag, valid_until = snapshot
+        if etag != self.etag(user_id) or (valid_until is not None and now >= valid_until):
+            return None
+        return etag
+
+
+def get_me_versions(app=None):
+    app = app or current_app
+    versions = app.extensions.get('me_versions')
+    if versions is None:
+        versions = MeVersions()
+        get_event_bus(app).add_listener(versions.on_event)
+        app.extensions['me_versions'] = versions
+    return versions
@@ -0,0 +1,40 @@
+"""Presence reaper: auto check-out of players whose presence pings went stale.
+
+This used to run as a sweep at the top of every court read, putting a scan
+and a commit on the hottest read path. It now runs as the `presence_reaper`
+background job (backend.jobs), expiring everything stale with a single bulk
+UPDATE per run. The expired rows are handed to the live counters
+(backend.services.live_counters) so players_here drops without a reconcile,
+and pushed as presence events to the affected users and courts.
+"""
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import update
+
+from backend.app import db
+from backend.models import CheckIn, utcnow
+from backend.services.events import presence_events, publish
+from backend.services.live_counters import get_live_counters
+
+
+def expire_stale_presence():
+    """Check out every presence older than the staleness window. Returns the
+    number of check-ins expired."""
+    cutoff = utcnow() - timedelta(
+        seconds=int(current_app.config.get('PRESENCE_STALE_AFTER_SECONDS', 7200) or 7200),
+    )
+    rows = db.session.execute(
+        update(CheckIn)
+        .where(CheckIn.checked_out_at.is_(None), CheckIn.last_presence_ping_at < cutoff)
+        .values(checked_out_at=cutoff)
+        .returning(CheckIn.id, CheckIn.court_id, CheckIn.user_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    get_live_counters().apply_checkouts((checkin_id, court_id) for checkin_id, court_id, _ in rows)
+    publish(
+        evt for _, court_id, user_id in rows
+        for evt in presence_events(user_id, court_id, checked_in=False)
+    )
+    return len(rows)
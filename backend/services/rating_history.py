@@ -0,0 +1,125 @@
+"""Append-only rating history (rating_history table).
+
+_apply_elo only updates User.rating, and GamePlayer.rating_delta keeps each
+game's delta but not the rating around it, so a player's rating curve used to
+mean replaying every completed game. Every finalized ranked game now appends
+one (before, after) row per player in the same transaction, indexed by
+(user_id, recorded_at) for per-user range reads.
+
+Profile charts read through rating_series(), which thins long histories to a
+fixed number of points with largest-triangle-three-buckets: the kept points
+are real games, chosen to preserve peaks, slumps and streaks.
+backfill_rating_history() reconstructs rows for games finalized before the
+table existed from their recorded deltas.
+"""
+from sqlalchemy import func, insert
+
+from backend.app import db
+from backend.models import Game, GamePlayer, RatingHistory, User
+from backend.services.db_pool import lift_statement_timeout
+
+
+def record_rating_changes(game_id, users, deltas, recorded_at):
+    """Append a row per user whose rating just moved by deltas[user.id]
+    (runs in the caller's transaction)."""
+    db.session.add_all(
+        RatingHistory(
+            user_id=user.id,
+            game_id=game_id,
+            rating_before=user.rating - deltas[user.id],
+            rating_after=user.rating,
+            recorded_at=recorded_at,
+        )
+        for user in users if user.id in deltas
+    )
+
+
+def rating_series(user_id, since=None, until=None, points=None):
+    """(rows, total) of (recorded_at, rating_before, rating_after, game_id)
+    oldest first, thinned to at most `points` rows when given."""
+    query = db.session.query(
+        RatingHistory.recorded_at, RatingHistory.rating_before,
+        RatingHistory.rating_after, RatingHistory.game_id,
+    ).filter(RatingHistory.user_id == user_id)
+    if since is not None:
+        query = query.filter(RatingHistory.recorded_at >= since)
+    if until is not None:
+        query = query.filter(RatingHistory.recorded_at < until)
+    rows = query.order_by(RatingHistory.recorded_at, RatingHistory.id).all()
+    if points is None or len(rows) <= points:
+        return rows, len(rows)
+    thinned = downsample(
+        rows, points, x=lambda r: r.recorded_at.timestamp(), y=lambda r: r.rating_after,
+    )
+    return thinned, len(rows)
+
+
+def downsample(rows, target, x, y):
+    """Largest-triangle-three-buckets: `target` (>= 3) of `rows`, ordered by
+    x, always keeping the first and last."""
+    n = len(rows)
+    if n <= target:
+        return list(rows)
+    xs = [x(r) for r in rows]
+    ys = [y(r) for r in rows]
+    every = (n - 2) / (target - 2)
+    kept = [rows[0]]
+    prev = 0
+    for bucket in range(target - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        # The point is judged against the average of the next bucket (the
+        # last point, for the final bucket).
+        next_end = min(int((bucket + 2) * every) + 1, n)
+        span = next_end - end
+        avg_x = sum(xs[end:next_end]) / span
+        avg_y = sum(ys[end:next_end]) / span
+        best, best_area = start, -1.0
+        for i in range(start, end):
+            area = abs(
+                (xs[prev] - avg_x) * (ys[i] - ys[prev]) - (xs[prev] - xs[i]) * (avg_y - ys[prev])
+            )
+            if area > best_area:
+                best, best_area = i, area
+        kept.append(rows[best])
+        prev = best
+    kept.append(rows[-1])
+    return kept
+
+
+def backfill_rating_history():
+    """Write history for players who have none yet, walking their recorded
+    GamePlayer.rating_delta values back from the current rating. Returns the
+    number of rows written."""
+    lift_statement_timeout(db.session)
+    logged = {uid for (uid,) in db.session.query(RatingHistory.user_id).distinct()}
+    finished_at = func.coalesce(Game.completed_at, Game.scheduled_at)
+    rows = (
+        db.session.query(
+            GamePlayer.user_id, Game.id, GamePlayer.rating_delta, finished_at, User.rating,
+        )
+        .join(Game, Game.id == GamePlayer.game_id)
+        .join(User, User.id == GamePlayer.user_id)
+        .filter(
+            Game.game_type == 'ranked',
+            Game.status == 'completed',
+            GamePlayer.rating_delta.isnot(None),
+        )
+        .order_by(GamePlayer.user_id, finished_at.desc(), Game.id.desc())
+    )
+    entries = []
+    current_user, after = None, None
+    for uid, game_id, delta, at, rating in rows:
+        if uid in logged:
+            continue
+        if uid != current_user:
+            current_user, after = uid, rating
+        entries.append({
+            'user_id': uid, 'game_id': game_id,
+            'rating_before': after - delta, 'rating_after': after, 'recorded_at': at,
+        })
+        after -= delta
+    if entries:
+        db.session.execute(insert(RatingHistory), entries)
+        db.session.commit()
+    return len(entries)
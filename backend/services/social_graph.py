@@ -0,0 +1,157 @@
+"""In-process cache of the social graph: each user's accepted friends and
+the users hidden from them by a block (either direction).
+
+friend_ids() runs on nearly every request (court detail, games feeds, results,
+profiles, discovery, game creation) and the block checks on every discovery,
+chat and friend request; each used to be an OR query. The cache keeps one
+adjacency set per user and relation, loaded on first use and evicted
+least-recently-used past SOCIAL_GRAPH_CACHE_SIZE users.
+
+Friendship and block changes invalidate both users once the transaction
+commits (ORM flushes; accept, remove, block and unblock all go through the
+ORM). Other worker processes learn about them from the `friendship` and
+`block` events on the event bus, so with several workers the cache is exact
+on the postgres bus.
+
+One graph lives per app (app.extensions['social_graph']).
+"""
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session
+
+from backend.app import db
+from backend.models import BlockedUser, Friendship
+from backend.services.events import get_event_bus
+
+_PENDING_KEY = 'social_graph_changes'
+
+
+class AdjacencyCache:
+    """LRU of {user_id: frozenset(neighbour ids)} filled by `loader`."""
+
+    def __init__(self, loader, capacity):
+        self._loader = loader
+        self._capacity = max(1, int(capacity))
+        self._lock = threading.Lock()
+        self._sets = OrderedDict()
+        # Bumped by every invalidation: a load that raced one isn't cached,
+        # since it may have read the rows from before the change.
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._sets)
+
+    def get(self, user_id):
+        with self._lock:
+            neighbours = self._sets.get(user_id)
+            if neighbours is not None:
+                self._sets.move_to_end(user_id)
+                return neighbours
+            generation = self._generation
+        neighbours = frozenset(self._loader(user_id))
+        with self._lock:
+            if generation == self._generation:
+                self._sets[user_id] = neighbours
+                while len(self._sets) > self._capacity:
+                    self._sets.popitem(last=False)
+        return neighbours
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._sets.pop(user_id, None)
+
+
+def _load_friend_ids(user_id):
+    rows = db.session.query(Friendship.requester_id, Friendship.addressee_id).filter(
+        Friendship.status == 'accepted',
+        or_(Friendship.requester_id == user_id, Friendship.addressee_id == user_id),
+    )
+    return {addressee if requester == user_id else requester for requester, addressee in rows}
+
+
+def _load_blocked_ids(user_id):
+    rows = db.session.query(BlockedUser.blocker_id, BlockedUser.blocked_id).filter(
+        or_(BlockedUser.blocker_id == user_id, BlockedUser.blocked_id == user_id),
+    )
+    return {blocked if blocker == user_id else blocker for blocker, blocked in rows}
+
+
+class SocialGraph:
+    def __init__(self, capacity):
+        self._friends = AdjacencyCache(_load_friend_ids, capacity)
+        self._blocked = AdjacencyCache(_load_blocked_ids, capacity)
+
+    def friend_ids(self, user_id):
+        return self._friends.get(user_id)
+
+    def mutual_friend_ids(self, user_a, user_b):
+        return self._friends.get(user_a) & self._friends.get(user_b)
+
+    def blocked_ids(self, user_id):
+        """Users hidden from user_id: people they blocked or who blocked them."""
+        return self._blocked.get(user_id)
+
+    def is_blocked_between(self, user_a, user_b):
+        return user_b in self._blocked.get(user_a)
+
+    def filter_blocked(self, user_id, candidate_ids):
+        """candidate_ids minus anyone hidden from user_id, order kept."""
+        hidden = self._blocked.get(user_id)
+        return [cid for cid in candidate_ids if cid not in hidden]
+
+    def invalidate(self, friends=(), blocked=()):
+        if friends:
+            self._friends.invalidate(friends)
+        if blocked:
+            self._blocked.invalidate(blocked)
+
+    def on_event(self, evt):
+        kind = evt.get('type')
+        if kind == 'friendship':
+            self.invalidate(friends=[int(evt['channel'].split(':', 1)[1])])
+        elif kind == 'block':
+            self.invalidate(blocked=[int(evt['channel'].split(':', 1)[1]), evt['user_id']])
+
+
+def get_social_graph(app=None):
+    app = app or current_app
+    graph = app.extensions.get('social_graph')
+    if graph is None:
+        graph = SocialGraph(app.config.get('SOCIAL_GRAPH_CACHE_SIZE', 10000))
+        get_event_bus(app).add_listener(graph.on_event)
+        app.extensions['social_graph'] = graph
+    return graph
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, _flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Friendship):
+            relation, pair = 'friends', (obj.requester_id, obj.addressee_id)
+        elif isinstance(obj, BlockedUser):
+            relation, pair = 'blocked', (obj.blocker_id, obj.blocked_id)
+        else:
+            continue
+        pending = session.info.setdefault(_PENDING_KEY, {'friends': set(), 'blocked': set()})
+        pending[relation].update(pair)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending and has_app_context():
+        get_social_graph().invalidate(**pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_changes(session):
+    # A load later in the rolled-back transaction may have cached its
+    # uncommitted rows; forget those users too.
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending and has_app_context():
+        get_social_graph().invalidate(**pending)
@@ -0,0 +1,155 @@
+"""Effective player locations and the grid index behind radius queries.
+
+Players Near You and area leaderboards place each player at their last
+check-in location, falling back to their home court. That used to be an OR
+over two bounding boxes (one through a join to the home court) with the
+candidates capped before the exact-distance pass, so dense metros silently
+lost players.
+
+Every user row now carries the resolved location (loc_lat/loc_lng) and its
+grid cell (geo_cell, GEO_CELL_DEGREES square), kept current by mapper hooks
+whenever last_lat/last_lng or home_court_id change, or a home court moves.
+near_clause() turns a radius into "cell in (…covering cells…) and inside the
+box", served by the (geo_cell, rating) index; callers finish with an exact
+haversine pass over the (id, location) rows, which stays cheap because no
+full rows are loaded until the final page is known.
+"""
+import math
+
+from sqlalchemy import event, inspect as sa_inspect, select, update
+
+from backend.app import db
+from backend.models import Court, User
+from backend.services.court_index import haversine_miles
+from backend.services.db_pool import lift_statement_timeout
+from backend.services.events import bulk_event, publish
+
+GEO_CELL_DEGREES = 0.5
+_CELLS_PER_ROW = int(360 / GEO_CELL_DEGREES)
+
+
+def geo_cell(lat, lng):
+    if lat is None or lng is None:
+        return None
+    row = int(math.floor((lat + 90) / GEO_CELL_DEGREES))
+    col = int(math.floor((min(lng, 179.999999) + 180) / GEO_CELL_DEGREES))
+    return row * _CELLS_PER_ROW + col
+
+
+def cell_bounds(cell):
+    """(south, west, north, east) of a geo_cell."""
+    row, col = divmod(cell, _CELLS_PER_ROW)
+    south, west = row * GEO_CELL_DEGREES - 90, col * GEO_CELL_DEGREES - 180
+    return south, west, south + GEO_CELL_DEGREES, west + GEO_CELL_DEGREES
+
+
+def radius_box(lat, lng, radius_miles):
+    """(south, west, north, east) enclosing the radius."""
+    lat_delta = radius_miles / 69.0
+    lng_delta = radius_miles / max(0.1, 69.0 * math.cos(math.radians(lat)))
+    return (
+        max(-90.0, lat - lat_delta), max(-180.0, lng - lng_delta),
+        min(90.0, lat + lat_delta), min(180.0, lng + lng_delta),
+    )
+
+
+def cells_covering(south, west, north, east):
+    lo, hi = geo_cell(south, west), geo_cell(north, east)
+    lo_row, lo_col = divmod(lo, _CELLS_PER_ROW)
+    hi_row, hi_col = divmod(hi, _CELLS_PER_ROW)
+    return [
+        row * _CELLS_PER_ROW + col
+        for row in range(lo_row, hi_row + 1)
+        for col in range(lo_col, hi_col + 1)
+    ]
+
+
+def near_clause(lat, lng, radius_miles):
+    """SQL predicate: effective location inside the radius's bounding box."""
+    south, west, north, east = radius_box(lat, lng, radius_miles)
+    return db.and_(
+        User.geo_cell.in_(cells_covering(south, west, north, east)),
+        User.loc_lat.between(south, north),
+        User.loc_lng.between(west, east),
+    )
+
+
+def within_radius(rows, lat, lng, radius_miles):
+    """[(row, distance)] for (…, loc_lat, loc_lng) rows inside the radius."""
+    hits = []
+    for row in rows:
+        distance = haversine_miles(lat, lng, row.loc_lat, row.loc_lng)
+        if distance <= radius_miles:
+            hits.append((row, distance))
+    return hits
+
+
+def _resolve(connection, user):
+    if user.last_lat is not None and user.last_lng is not None:
+        return user.last_lat, user.last_lng
+    if user.home_court_id is None:
+        return None, None
+    home = sa_inspect(user).dict.get('home_court')
+    if home is not None and home.id == user.home_court_id:
+        return home.latitude, home.longitude
+    row = connection.execute(
+        select(Court.latitude, Court.longitude).where(Court.id == user.home_court_id)
+    ).first()
+    return (row.latitude, row.longitude) if row else (None, None)
+
+
+def _set_location(user, lat, lng):
+    user.loc_lat, user.loc_lng, user.geo_cell = lat, lng, geo_cell(lat, lng)
+
+
+@event.listens_for(User, 'before_insert')
+def _locate_new_user(_mapper, connection, target):
+    _set_location(target, *_resolve(connection, target))
+
+
+@event.listens_for(User, 'before_update')
+def _relocate_user(_mapper, connection, target):
+    state = sa_inspect(target)
+    if any(state.attrs[name].history.has_changes()
+           for name in ('last_lat', 'last_lng', 'home_court_id')):
+        _set_location(target, *_resolve(connection, target))
+
+
+@event.listens_for(Court, 'after_update')
+def _home_court_moved(_mapper, connection, target):
+    state = sa_inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in ('latitude', 'longitude')):
+        return
+    connection.execute(
+        update(User)
+        .where(User.home_court_id == target.id, User.last_lat.is_(None))
+        .values(
+            loc_lat=target.latitude, loc_lng=target.longitude,
+            geo_cell=geo_cell(target.latitude, target.longitude),
+        )
+    )
+
+
+def rebuild_user_locations():
+    """Recompute every user's effective location (backfill, or after bulk
+    court imports that bypass the ORM). Returns the number of rows fixed."""
+    lift_statement_timeout(db.session)
+    rows = db.session.execute(
+        select(
+            User.id, User.last_lat, User.last_lng, User.loc_lat, User.loc_lng, User.geo_cell,
+            Court.latitude, Court.longitude,
+        ).outerjoin(Court, User.home_court_id == Court.id)
+    ).all()
+    changes = []
+    for uid, last_lat, last_lng, loc_lat, loc_lng, cell, home_lat, home_lng in rows:
+        if last_lat is not None and last_lng is not None:
+            lat, lng = last_lat, last_lng
+        else:
+            lat, lng = home_lat, home_lng
+        if (lat, lng, geo_cell(lat, lng)) != (loc_lat, loc_lng, cell):
+            changes.append({'id': uid, 'loc_lat': lat, 'loc_lng': lng, 'geo_cell': geo_cell(lat, lng)})
+    if changes:
+        db.session.execute(update(User), changes)
+        db.session.commit()
+        publish([bulk_event('user_locations')])
+    return len(changes)
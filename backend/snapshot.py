@@ -0,0 +1,209 @@
+"""Compiled court snapshot for instant cold starts.
+
+Usage:
+    python -m backend.snapshot                     # data/courts.json.gz -> data/courts.snapshot
+    python -m backend.snapshot --courts-file out.json.gz --out /tmp/courts.snapshot
+
+A fresh deploy starts with an empty court table and used to show no courts
+until the bundled export had been parsed and inserted. The build step
+(render.yaml / Dockerfile) compiles that export into one columnar file:
+
+    header      magic, format version, court count, string count, blob size,
+                schema tag
+    ids         u32[count]   court ids (1..n: what a fresh import assigns)
+    latitude    f64[count]
+    longitude   f64[count]
+    num_courts  u32[count]
+    flags       u8[count]    one bit per FLAG_FIELDS entry
+    <field>     u32[count]   string table index, one column per STRING_FIELDS
+    offsets     u32[strings + 1]
+    blob        UTF-8 bytes of every distinct string
+
+Sections are little-endian and 8-byte aligned, so the loader mmaps the file
+and reads the arrays in place. While the court table is empty the court index
+serves map, search and court detail from the snapshot
+(backend.services.court_index.load_snapshot); a background thread hydrates
+the table from the same rows, keeping the ids (backend.seed.hydrate_courts),
+after which the index switches to the database and the snapshot is dropped.
+
+This module runs at build time, before any database or app secrets exist,
+so it must not import the app, the models or anything that does.
+"""
+import argparse
+import hashlib
+import mmap
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+from backend.court_records import (
+    BUNDLED_COURTS_FILE,
+    BUNDLED_SNAPSHOT_FILE,
+    SOURCE_FIELDS,
+    _court_file_records,
+    _new_court_rows,
+    _normalized_rows,
+    fingerprint,
+)
+
+FORMAT_VERSION = 1
+MAGIC = b'TSCS'
+HEADER = struct.Struct('<4sHxxIII8s')
+FLAG_FIELDS = ('indoor', 'lighted', 'has_restrooms', 'has_water', 'nets_provided', 'verified')
+STRING_FIELDS = tuple(
+    name for name in SOURCE_FIELDS
+    if name not in FLAG_FIELDS and name not in ('latitude', 'longitude', 'num_courts')
+)
+# Changes whenever the layout or field set does, so stale files are refused.
+SCHEMA_TAG = hashlib.sha1(repr((FORMAT_VERSION, STRING_FIELDS, FLAG_FIELDS)).encode()).digest()[:8]
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _layout(count, strings, blob_size):
+    """[(name, typecode, offset, length)] of every section after the header."""
+    sections = [('ids', 'I', count), ('lat', 'd', count), ('lng', 'd', count),
+                ('num_courts', 'I', count), ('flags', 'B', count)]
+    sections += [(name, 'I', count) for name in STRING_FIELDS]
+    sections += [('offsets', 'I', strings + 1), ('blob', 'B', blob_size)]
+    layout = []
+    offset = _align(HEADER.size)
+    for name, typecode, length in sections:
+        layout.append((name, typecode, offset, length))
+        offset = _align(offset + length * array(typecode).itemsize)
+    return layout
+
+
+def build_snapshot(rows, path):
+    """Compile normalized court rows (dicts with SOURCE_FIELDS, in import
+    order) into `path`. Ids are assigned 1..n. Returns the court count."""
+    columns = {name: array(typecode) for name, typecode, _o, _l in _layout(0, 0, 0)}
+    strings = {'': 0}
+    for court_id, values in enumerate(rows, start=1):
+        columns['ids'].append(court_id)
+        columns['lat'].append(values['latitude'])
+        columns['lng'].append(values['longitude'])
+        columns['num_courts'].append(min(values['num_courts'], 0xFFFFFFFF))
+        columns['flags'].append(sum(1 << bit for bit, name in enumerate(FLAG_FIELDS) if values[name]))
+        for name in STRING_FIELDS:
+            columns[name].append(strings.setdefault(values[name], len(strings)))
+    blob = bytearray()
+    offsets = columns['offsets']
+    for value in strings:  # dicts keep insertion order: index order
+        offsets.append(len(blob))
+        blob += value.encode('utf-8')
+    offsets.append(len(blob))
+    columns['blob'] = array('B', blob)
+
+    count = len(columns['ids'])
+    with open(path, 'wb') as handle:
+        handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, len(strings), len(blob), SCHEMA_TAG))
+        for name, _typecode, offset, _length in _layout(count, len(strings), len(blob)):
+            handle.write(b'\0' * (offset - handle.tell()))
+            column = columns[name]
+            if sys.byteorder != 'little':
+                column.byteswap()
+            column.tofile(handle)
+    return count
+
+
+class CourtSnapshot:
+    """Read-only view over a compiled snapshot file (memory-mapped)."""
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError('snapshots are little-endian')
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError('truncated snapshot')
+        magic, version, count, strings, blob_size, schema = HEADER.unpack_from(self._map)
+        if (magic, version, schema) != (MAGIC, FORMAT_VERSION, SCHEMA_TAG):
+            raise ValueError('incompatible snapshot (rebuild with python -m backend.snapshot)')
+        layout = _layout(count, strings, blob_size)
+        _name, typecode, end, length = layout[-1]
+        if len(self._map) < end + length:
+            raise ValueError('truncated snapshot')
+        view = memoryview(self._map)
+        self._columns = {
+            name: view[offset:offset + length * array(typecode).itemsize].cast(typecode)
+            for name, typecode, offset, length in layout
+        }
+        self.count = count
+        self.digest = hashlib.sha1(self._map).hexdigest()[:16]
+        # Decoded strings, filled on first use (cities, states and counties repeat).
+        self._strings = [None] * strings
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, index):
+        value = self._strings[index]
+        if value is None:
+            offsets = self._columns['offsets']
+            value = self._strings[index] = str(
+                self._columns['blob'][offsets[index]:offsets[index + 1]], 'utf-8',
+            )
+        return value
+
+    def _row(self, court_id):
+        ids = self._columns['ids']
+        row = bisect_left(ids, court_id)
+        return row if row < self.count and ids[row] == court_id else None
+
+    def values(self, row):
+        """SOURCE_FIELDS column values of the row-th court."""
+        columns = self._columns
+        flags = columns['flags'][row]
+        values = {name: self._string(columns[name][row]) for name in STRING_FIELDS}
+        values.update({name: bool(flags & (1 << bit)) for bit, name in enumerate(FLAG_FIELDS)})
+        values.update(
+            latitude=columns['lat'][row], longitude=columns['lng'][row],
+            num_courts=columns['num_courts'][row],
+        )
+        return values
+
+    def index_rows(self):
+        """(id, lat, lng, num_courts, indoor, lighted, name, city, state,
+        address) per court: the court index's build rows."""
+        c = self._columns
+        name, city, state, address = c['name'], c['city'], c['state'], c['address']
+        string = self._string
+        for row in range(self.count):
+            flags = c['flags'][row]
+            yield (
+                c['ids'][row], c['lat'][row], c['lng'][row], c['num_courts'][row],
+                bool(flags & 1), bool(flags & 2), string(name[row]), string(city[row]),
+                string(state[row]), string(address[row]),
+            )
+
+    def court_values(self, court_id):
+        """SOURCE_FIELDS column values of a court id, or None."""
+        row = self._row(court_id)
+        return self.values(row) if row is not None else None
+
+    def rows(self):
+        """Insertable court rows, ids included."""
+        for row in range(self.count):
+            values = self.values(row)
+            yield {'id': self._columns['ids'][row], **values, 'source_hash': fingerprint(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the court export into a snapshot.')
+    parser.add_argument('--courts-file', default=BUNDLED_COURTS_FILE)
+    parser.add_argument('--out', default=BUNDLED_SNAPSHOT_FILE)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows = _new_court_rows(_normalized_rows(_court_file_records(args.courts_file)), set())
+    count = build_snapshot(rows, args.out)
+    print(f'Wrote {count} courts to {args.out} in {time.perf_counter() - started:.2f}s.')
+
+
+if __name__ == '__main__':
+    main()
@@ -27,8 +27,12 @@
     areaLoc: null,
     courtsInView: [],
     activeThreadUserId: null,
-    threadPollTimer: null,
     mePollTimer: null,
+    stream: null,
+    streamLive: false,
+    streamRetryTimer: null,
+    streamRetryMs: 3000,
+    streamCourtId: null,
   };
 
   const $ = (sel) => document.querySelector(sel);
@@ -54,6 +58,19 @@
     return data;
   }
 
+  // Every page of a cursor-paged list endpoint (games feeds), concatenated.
+  async function apiAllPages(path) {
+    const sep = path.includes('?') ? '&' : '?';
+    const items = [];
+    let cursor = null;
+    do {
+      const page = await api(cursor ? `${path}${sep}cursor=${encodeURIComponent(cursor)}` : path);
+      items.push(...(page.items || []));
+      cursor = page.next_cursor;
+    } while (cursor);
+    return { items, next_cursor: null };
+  }
+
   const ERROR_TEXT = {
     invalid_email: 'Please enter a valid email.',
     password_too_short: 'Password must be at least 6 characters.',
@@ -192,7 +209,7 @@
     state.me = null;
     localStorage.removeItem('pp_token');
     clearInterval(state.mePollTimer);
-    clearInterval(state.threadPollTimer);
+    disconnectStream();
     $('#main-screen').classList.add('hidden');
     $('#auth-screen').classList.remove('hidden');
   }
@@ -327,6 +344,75 @@
     try { applyMe(await api('/me')); } catch { /* logged out */ }
   }
 
+  // ---------- Push (SSE) ----------
+  // One EventSource per tab. Events carry ids only; screens refetch through
+  // the normal endpoints. The pollers stay as a fallback and skip their work
+  // while the stream is live. Each connection authenticates with a fresh
+  // short-lived ticket (the session token never goes in a URL), so the app
+  // reconnects itself instead of leaving it to EventSource.
+  const STREAM_EVENTS = ['message', 'messages_read', 'notification', 'notifications_read', 'friendship', 'presence', 'game', 'profile', 'court_message'];
+  const streamHandlers = new Set();
+  const onStreamEvent = (fn) => { streamHandlers.add(fn); return () => streamHandlers.delete(fn); };
+
+  async function connectStream() {
+    disconnectStream();
+    if (!state.token || typeof EventSource === 'undefined') return;
+    const retry = (ms) => {
+      disconnectStream();
+      state.streamRetryTimer = setTimeout(connectStream, ms);
+    };
+    let ticket;
+    try {
+      ({ ticket } = await api('/stream/ticket', { method: 'POST' }));
+    } catch {
+      retry(60000);
+      return;
+    }
+    if (!state.token || state.stream) return; // logged out, or a newer connect won
+    const court = state.streamCourtId ? `&court=${state.streamCourtId}` : '';
+    const es = new EventSource(`/api/stream?ticket=${encodeURIComponent(ticket)}${court}`);
+    state.stream = es;
+    es.addEventListener('ready', () => {
+      state.streamLive = true;
+      state.streamRetryMs = 3000;
+      refreshMe(); // catch up on anything that happened between connections
+    });
+    es.addEventListener('busy', () => retry(60000));
+    STREAM_EVENTS.forEach((type) => es.addEventListener(type, (e) => {
+      let evt;
+      try { evt = JSON.parse(e.data); } catch { return; }
+      streamHandlers.forEach((fn) => fn(evt));
+    }));
+    es.onerror = () => {
+      if (state.stream !== es) return;
+      // The stream ended (it is capped at about a minute) or was refused: the
+      // ticket is spent, so reconnect with a new one, backing off on failures.
+      const delay = state.streamLive ? 0 : state.streamRetryMs;
+      state.streamRetryMs = Math.min(state.streamRetryMs * 2, 60000);
+      retry(delay);
+    };
+  }
+
+  function disconnectStream() {
+    clearTimeout(state.streamRetryTimer);
+    if (state.stream) state.stream.close();
+    state.stream = null;
+    state.streamLive = false;
+  }
+
+  // Route a court's chat over the stream while it's open (reconnects once).
+  function streamCourt(courtId) {
+    if (state.streamCourtId === courtId) return;
+    state.streamCourtId = courtId;
+    if (state.token) connectStream();
+  }
+
+  let meRefreshTimer;
+  onStreamEvent(() => {
+    clearTimeout(meRefreshTimer);
+    meRefreshTimer = setTimeout(refreshMe, 250);
+  });
+
   // ---------- Tabs ----------
   function setupTabs() {
     document.querySelectorAll('.nav-btn').forEach((btn) => {
@@ -405,6 +491,8 @@
         })
       : L.layerGroup();
     state.markers.addTo(state.map);
+    // Server-side clusters for zoomed-out views (see fetchCourtsInView).
+    state.clusterLayer = L.layerGroup().addTo(state.map);
 
     $('#map-filters').addEventListener('click', (e) => {
       const btn = e.target.closest('button');
@@ -449,10 +537,13 @@
     });
 
     let searchTimer;
+    let suggestTimer;
     $('#court-search').addEventListener('input', (e) => {
       clearTimeout(searchTimer);
+      clearTimeout(suggestTimer);
       const q = e.target.value.trim();
       searchTimer = setTimeout(() => q ? searchCourts(q) : fetchCourtsInView(), 350);
+      suggestTimer = setTimeout(() => suggestCourts(q), 120);
     });
 
     // Only auto-locate when we have neither a saved view nor a saved home area.
@@ -496,24 +587,128 @@
     fetchCourtsInView();
   }
 
+  // At or below this zoom the map shows server-computed clusters for the whole
+  // view instead of an arbitrary slice of individual courts.
+  const CLUSTER_MAX_ZOOM = 8;
+
   async function fetchCourtsInView() {
     if (!state.map) return;
     const b = state.map.getBounds();
     const bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map((v) => v.toFixed(4)).join(',');
-    let url = `/courts?bbox=${bbox}&limit=250&sort=${state.listSort}`;
+    const zoom = state.map.getZoom();
+    const clustered = zoom <= CLUSTER_MAX_ZOOM && state.mapFilter !== 'active';
+    let filters = '';
+    if (state.mapFilter === 'lighted') filters += '&lighted=1';
+    if (state.mapFilter === 'indoor') filters += '&indoor=1';
+    if (state.mapFilter === 'active') filters += '&active=1';
+    const tiled = !clustered && tileRange(b, zoom) != null;
+    let url = `/courts?bbox=${bbox}&limit=${clustered || tiled ? 60 : 250}&sort=${state.listSort}${filters}`;
     if (state.userLoc) url += `&lat=${state.userLoc[0]}&lng=${state.userLoc[1]}`;
-    if (state.mapFilter === 'lighted') url += '&lighted=1';
-    if (state.mapFilter === 'indoor') url += '&indoor=1';
     try {
-      const data = await api(url);
-      let items = data.items;
-      if (state.mapFilter === 'active') items = items.filter((c) => c.players_here > 0);
+      const [data, clusters, tileCourts] = await Promise.all([
+        api(url),
+        clustered ? api(`/courts/clusters?bbox=${bbox}&zoom=${zoom}${filters}`) : null,
+        tiled ? fetchTileCourts(b, zoom, bbox) : null,
+      ]);
+      const items = data.items;
       state.courtsInView = items;
-      drawMarkers(items);
+      if (clusters) drawClusters(clusters.items);
+      else drawMarkers(tileCourts ? filterTileCourts(tileCourts) : items);
       renderCourtList(items);
     } catch { /* network hiccup */ }
   }
 
+  // ---- Tiled markers: static geometry from cacheable z/x/y tiles, plus a
+  // small live overlay of players/games for the current view. ----
+  const TILE_MIN_ZOOM = 6;
+  const TILE_MAX_ZOOM = 12;
+  const TILE_MAX_COUNT = 36;
+
+  function tileRange(bounds, zoom) {
+    const z = Math.min(zoom, TILE_MAX_ZOOM);
+    if (z < TILE_MIN_ZOOM) return null;
+    const n = 2 ** z;
+    const clamp = (v) => Math.min(n - 1, Math.max(0, Math.floor(v)));
+    const tx = (lng) => clamp((lng + 180) / 360 * n);
+    const ty = (lat) => {
+      const r = lat * Math.PI / 180;
+      return clamp((1 - Math.log(Math.tan(r) + 1 / Math.cos(r)) / Math.PI) / 2 * n);
+    };
+    const range = { z, x0: tx(bounds.getWest()), x1: tx(bounds.getEast()), y0: ty(bounds.getNorth()), y1: ty(bounds.getSouth()) };
+    if ((range.x1 - range.x0 + 1) * (range.y1 - range.y0 + 1) > TILE_MAX_COUNT) return null;
+    return range;
+  }
+
+  async function fetchTileCourts(bounds, zoom, bbox) {
+    const { z, x0, x1, y0, y1 } = tileRange(bounds, zoom);
+    const tiles = [];
+    for (let x = x0; x <= x1; x += 1) {
+      for (let y = y0; y <= y1; y += 1) {
+        // Plain fetch (no auth header) so the HTTP cache / service worker can reuse tiles.
+        tiles.push(fetch(`/api/courts/tiles/${z}/${x}/${y}.json`)
+          .then((r) => (r.ok ? r.json() : { courts: [] }))
+          .catch(() => ({ courts: [] })));
+      }
+    }
+    const [live, ...results] = await Promise.all([
+      api(`/courts/live?bbox=${bbox}`).catch(() => ({ items: [] })),
+      ...tiles,
+    ]);
+    const liveById = new Map(live.items.map((c) => [c.id, c]));
+    return results.flatMap((t) => t.courts.map(([id, lat, lng, num, flags]) => ({
+      id,
+      latitude: lat,
+      longitude: lng,
+      num_courts: num,
+      indoor: Boolean(flags & 1),
+      lighted: Boolean(flags & 2),
+      players_here: liveById.has(id) ? liveById.get(id).players_here : 0,
+      upcoming_games: liveById.has(id) ? liveById.get(id).upcoming_games : 0,
+    })));
+  }
+
+  function filterTileCourts(courts) {
+    if (state.mapFilter === 'lighted') return courts.filter((c) => c.lighted);
+    if (state.mapFilter === 'indoor') return courts.filter((c) => c.indoor);
+    if (state.mapFilter === 'active') return courts.filter((c) => c.players_here > 0);
+    return courts;
+  }
+
+  function drawClusters(clusters) {
+    state.markers.clearLayers();
+    state.clusterLayer.clearLayers();
+    clusters.forEach((c) => {
+      const n = c.count;
+      const size = n >= 500 ? 52 : n >= 50 ? 44 : n >= 10 ? 38 : 32;
+      const live = c.players_here > 0
+        ? `<span class="marker-game-badge">${c.players_here}👤</span>` : '';
+      const icon = L.divIcon({
+        className: '',
+        html: `<div class="cluster-icon" style="width:${size}px;height:${size}px">${n}${live}</div>`,
+        iconSize: [size, size],
+      });
+      L.marker([c.lat, c.lng], { icon })
+        .addTo(state.clusterLayer)
+        .on('click', () => {
+          if (c.court_id) { openCourtDetail(c.court_id); return; }
+          const [w, s, e, nn] = c.bounds;
+          state.map.fitBounds([[s, w], [nn, e]], { padding: [30, 30] });
+        });
+    });
+  }
+
+  // Typeahead names from the server's in-memory search index (no DB hit).
+  async function suggestCourts(q) {
+    const list = $('#court-suggestions');
+    if (!list) return;
+    if (q.length < 2) { list.innerHTML = ''; return; }
+    try {
+      const data = await api(`/courts/suggest?q=${encodeURIComponent(q)}&limit=8`);
+      list.innerHTML = data.items.map((c) =>
+        `<option value="${esc(c.name)}">${esc([c.city, c.state].filter(Boolean).join(', '))}</option>`).join('');
+    } catch { /* ignore */ }
+  }
+
   async function searchCourts(q) {
     try {
       const [courtData, placeData] = await Promise.all([
@@ -534,6 +729,7 @@
 
   function drawMarkers(courts) {
     state.markers.clearLayers();
+    if (state.clusterLayer) state.clusterLayer.clearLayers();
     courts.forEach((court) => {
       if (court.latitude == null) return;
       const busy = court.players_here > 0;
@@ -1372,9 +1568,9 @@
     try {
       if (seg === 'scores') {
         const scope = state.boardScope || 'near';
-        const boardUrl = scope === 'near'
-          ? `/leaderboard?lat=${loc.lat}&lng=${loc.lng}&radius=50`
-          : '/leaderboard';
+        const boardUrl = scope === 'all'
+          ? '/leaderboard?scope=global'
+          : `/leaderboard?scope=${scope === 'near' ? 'metro' : 'state'}&lat=${loc.lat}&lng=${loc.lng}`;
         const [board, results] = await Promise.all([
           api(boardUrl),
           api(`/games/results?lat=${loc.lat}&lng=${loc.lng}`),
@@ -1382,14 +1578,18 @@
         let html = `
           <div class="segmented" id="board-scope" style="margin:2px 0 12px">
             <button data-scope="near" class="${scope === 'near' ? 'active' : ''}">📍 Near me</button>
+            <button data-scope="state" class="${scope === 'state' ? 'active' : ''}">🗺️ State</button>
             <button data-scope="all" class="${scope === 'all' ? 'active' : ''}">🌎 Everyone</button>
           </div>`;
+        if (board.region && board.region.label) {
+          html += `<div class="section-label">${esc(board.region.label)}${scope === 'near' ? ' area' : ''} · ${board.total} ranked</div>`;
+        }
 
         if (board.items.length) {
           const top3 = board.items.slice(0, 3);
           // Podium order: 2nd, 1st, 3rd
           const order = [top3[1], top3[0], top3[2]].filter(Boolean);
-          const place = (u) => board.items.indexOf(u) + 1;
+          const place = (u) => u.rank;
           html += '<div class="podium">' + order.map((u) => `
             <div class="podium-col place-${place(u)}" data-view-user="${u.id}">
               <div class="podium-medal">${['🥇', '🥈', '🥉'][place(u) - 1]}</div>
@@ -1401,9 +1601,9 @@
 
           const rest = board.items.slice(3, 10);
           if (rest.length) {
-            html += rest.map((u, i) => `
+            html += rest.map((u) => `
               <div class="card row ${state.me && u.id === state.me.id ? 'you-row' : ''}" data-view-user="${u.id}" style="cursor:pointer;padding:10px 14px">
-                <div class="rank-num">${i + 4}</div>
+                <div class="rank-num">${u.rank}</div>
                 ${avatarHtml(u, 'sm')}
                 <div class="row-main">
                   <div class="row-title" style="font-size:14px">${esc(u.display_name)}${u.current_streak >= 2 ? ` <span title="Win streak">🔥${u.current_streak}</span>` : ''}</div>
@@ -1413,19 +1613,21 @@
               </div>`).join('');
           }
           const me = state.me;
-          if (me && !board.items.some((u) => u.id === me.id)) {
+          if (me && !board.items.slice(0, 10).some((u) => u.id === me.id)) {
             html += `<div class="card row" style="padding:10px 14px">
-              <div class="rank-num">—</div>
+              <div class="rank-num">${board.me ? board.me.rank : '—'}</div>
               ${avatarHtml(me, 'sm')}
               <div class="row-main">
                 <div class="row-title" style="font-size:14px">You</div>
-                <div class="row-sub">Win a ranked game to enter the leaderboard</div>
+                <div class="row-sub">${board.me
+                  ? `#${board.me.rank} of ${board.me.total}${board.region.label ? ` in ${esc(board.region.label)}` : ''}`
+                  : 'Win a ranked game to enter the leaderboard'}</div>
               </div>
               <div class="stat-value" style="font-size:16px">${me.rating}</div>
             </div>`;
           }
         } else {
-          html += scope === 'near'
+          html += scope !== 'all'
             ? '<div class="empty-state"><span class="big">🏆</span>No ranked players in your area yet.<br>Win a ranked game and claim the local crown!</div>'
             : '<div class="empty-state"><span class="big">🏆</span>No ranked games yet.<br>Win one and claim the podium!</div>';
         }
@@ -1457,8 +1659,8 @@
 
       // --- Games: everything actionable + yours + friends + nearby, one scroll ---
       const [mine, friends, nearby] = await Promise.all([
-        api('/games?mine=1'),
-        api('/games?friends=1').catch(() => ({ items: [] })),
+        apiAllPages('/games?mine=1'),
+        apiAllPages('/games?friends=1').catch(() => ({ items: [] })),
         api(`/games?lat=${loc.lat}&lng=${loc.lng}&radius=60`),
       ]);
       const nowMs = Date.now();
@@ -2200,11 +2402,14 @@
     const msgsEl = modal.querySelector('#thread-msgs');
     let lastId = 0;
     const renderMsgs = (items, append) => {
+      // Push, long-poll and send can deliver the same message; keep one copy.
+      if (append) items = items.filter((m) => m.id > lastId);
       const html = items.map((m) => `
         <div class="bubble ${m.sender_id === state.me.id ? 'me' : 'them'}">
           ${esc(m.body)}
           <div class="bubble-time">${fmtTimeShort(m.created_at)}</div>
         </div>`).join('');
+      if (append && !html) return;
       if (append && !msgsEl.querySelector('.empty-state')) msgsEl.insertAdjacentHTML('beforeend', html);
       else if (append) msgsEl.innerHTML = html;
       else msgsEl.innerHTML = html || '<div class="empty-state" style="padding:20px">Say hi! 👋</div>';
@@ -2215,14 +2420,19 @@
     attachChatViewport(modal, msgsEl, modal.querySelector('#thread-text'));
     refreshMe();
 
-    clearInterval(state.threadPollTimer);
-    state.threadPollTimer = setInterval(async () => {
-      if (!document.body.contains(msgsEl)) { clearInterval(state.threadPollTimer); return; }
+    const fetchNew = async () => {
       try {
         const fresh = await api(`/chat/${userId}?since_id=${lastId}`);
         if (fresh.items.length) renderMsgs(fresh.items, true);
       } catch { /* offline */ }
-    }, 4000);
+    };
+    const offStream = onStreamEvent((evt) => {
+      if (!document.body.contains(msgsEl)) { offStream(); return; }
+      if (evt.type === 'message' && evt.sender_id === userId) fetchNew();
+    });
+    // Pushed events cover this thread while the stream is up; long-poll otherwise.
+    longPollMessages(msgsEl, () => `/chat/${userId}?since_id=${lastId}`,
+      (items) => renderMsgs(items, true), () => state.streamLive);
 
     modal.querySelector('#thread-form').addEventListener('submit', async (e) => {
       e.preventDefault();
@@ -2237,6 +2447,26 @@
     });
   }
 
+  // Chat long-poll loop: each request parks server-side until a message lands
+  // (or ~25s pass), so an idle conversation costs one held request instead of
+  // a query every few seconds. Stops once `el` leaves the DOM; `paused()`
+  // lets the caller defer to the push stream.
+  async function longPollMessages(el, pathFn, onItems, paused = () => false) {
+    while (state.token && document.body.contains(el)) {
+      const started = Date.now();
+      let got = false;
+      if (!paused()) {
+        try {
+          const fresh = await api(`${pathFn()}&wait=25`);
+          got = fresh.items.length > 0;
+          if (got && document.body.contains(el)) onItems(fresh.items);
+        } catch { /* offline */ }
+      }
+      // Paused, failed, or answered at once with nothing (server busy): back off.
+      if (!got && Date.now() - started < 1000) await new Promise((r) => setTimeout(r, 4000));
+    }
+  }
+
   async function openCourtChat(court) {
     let data;
     try { data = await api(`/courts/${court.id}/chat`); } catch (e) { toast(e.message); return; }
@@ -2262,6 +2492,7 @@
     const msgsEl = modal.querySelector('#cc-msgs');
     let lastId = 0;
     const renderMsgs = (items, append) => {
+      if (append) items = items.filter((m) => m.id > lastId);
       const html = items.map((m) => {
         const mine = m.sender_id === state.me.id;
         return `
@@ -2274,6 +2505,7 @@
           </div>
         </div>`;
       }).join('');
+      if (append && !html) return;
       if (append && !msgsEl.querySelector('.empty-state')) msgsEl.insertAdjacentHTML('beforeend', html);
       else if (append) msgsEl.innerHTML = html;
       else msgsEl.innerHTML = html || '<div class="empty-state" style="padding:20px">No messages yet — say hi to the court! 👋</div>';
@@ -2283,13 +2515,25 @@
     renderMsgs(data.items, false);
     attachChatViewport(modal, msgsEl, modal.querySelector('#cc-text'));
 
-    const pollTimer = setInterval(async () => {
-      if (!document.body.contains(msgsEl)) { clearInterval(pollTimer); return; }
+    const fetchNew = async () => {
       try {
         const fresh = await api(`/courts/${court.id}/chat?since_id=${lastId}`);
         if (fresh.items.length) renderMsgs(fresh.items, true);
       } catch { /* offline */ }
-    }, 5000);
+    };
+    streamCourt(court.id);
+    const offStream = onStreamEvent((evt) => {
+      if (!document.body.contains(msgsEl)) {
+        offStream();
+        if (state.streamCourtId === court.id) streamCourt(null);
+        return;
+      }
+      if (evt.type === 'court_message' && evt.court_id === court.id) fetchNew();
+    });
+    // Same as direct threads: the stream carries this room while it's live
+    // (and subscribed to it); the long-poll only covers the gaps.
+    longPollMessages(msgsEl, () => `/courts/${court.id}/chat?since_id=${lastId}`,
+      (items) => renderMsgs(items, true), () => state.streamLive && state.streamCourtId === court.id);
 
     modal.querySelector('#cc-form').addEventListener('submit', async (e) => {
       e.preventDefault();
@@ -2305,6 +2549,22 @@
   }
 
   // ---------- User profile ----------
+  function ratingChartHtml(points) {
+    const w = 300;
+    const h = 64;
+    const ratings = points.map((p) => p.rating);
+    const lo = Math.min(...ratings);
+    const hi = Math.max(...ratings);
+    const span = Math.max(hi - lo, 1);
+    const line = points.map((p, i) => `${(i / (points.length - 1) * w).toFixed(1)},${(h - 4 - (p.rating - lo) / span * (h - 8)).toFixed(1)}`).join(' ');
+    return `<div class="card" style="padding:10px 12px">
+      <div class="row-sub" style="margin-bottom:4px">Rating trend · ${lo}–${hi}</div>
+      <svg viewBox="0 0 ${w} ${h}" preserveAspectRatio="none" style="width:100%;height:${h}px;display:block">
+        <polyline points="${line}" fill="none" stroke="var(--green-600)" stroke-width="2" stroke-linejoin="round" vector-effect="non-scaling-stroke"/>
+      </svg>
+    </div>`;
+  }
+
   async function openUserProfile(userId) {
     let user;
     try { user = await api(`/users/${userId}`); } catch (e) { toast(e.message); return; }
@@ -2345,12 +2605,17 @@
         <div class="profile-name">${esc(user.display_name)}</div>
         <div class="profile-sub">${skillLabel(user.skill_level)}${user.home_court_name ? ` · 🏠 ${esc(user.home_court_name)}` : ''}</div>
         ${user.bio ? `<p class="profile-sub" style="margin-top:8px">${esc(user.bio)}</p>` : ''}
+        ${user.mutual_friends ? `<div class="profile-sub">👥 ${user.mutual_friends} mutual friend${user.mutual_friends === 1 ? '' : 's'}</div>` : ''}
+        ${(user.ranks || []).filter((r) => r.scope !== 'global' && r.label).length
+          ? `<div class="profile-sub">🏆 ${user.ranks.filter((r) => r.scope !== 'global' && r.label).map((r) => `#${r.rank} in ${esc(r.label)}`).join(' · ')}</div>`
+          : ''}
       </div>
       <div class="stat-grid">
         <div class="stat-card"><div class="stat-value">${user.rating}</div><div class="stat-label">Rating</div></div>
         <div class="stat-card"><div class="stat-value">${user.ranked_wins}</div><div class="stat-label">Wins</div></div>
         <div class="stat-card"><div class="stat-value">${user.ranked_losses}</div><div class="stat-label">Losses</div></div>
       </div>
+      <div id="up-rating-chart"></div>
       <div class="action-row">${friendAction}</div>
       ${upcoming.length ? `<div class="section-label">Upcoming games</div>${upcoming.map((g) => gameCardHtml(g, { compact: true })).join('')}` : ''}
       ${courts.length ? `<div class="section-label">Courts</div>${courts.map(courtRow).join('')}` : ''}
@@ -2364,6 +2629,12 @@
     `);
 
     bindGameButtons(modal, () => { closeModal(modal); openUserProfile(userId); });
+    if (user.ranked_wins + user.ranked_losses > 1) {
+      api(`/users/${userId}/rating-history?points=60`).then((hist) => {
+        const chart = modal.querySelector('#up-rating-chart');
+        if (chart && hist.items.length > 1) chart.innerHTML = ratingChartHtml(hist.items);
+      }).catch(() => {});
+    }
     modal.querySelectorAll('[data-pcourt]').forEach((row) => row.addEventListener('click', () => {
       closeModal(modal);
       openCourtDetail(Number(row.dataset.pcourt));
@@ -2503,7 +2774,7 @@
 
     // My upcoming games (parity with public profiles), tappable into the game screen.
     try {
-      const mine = await api('/games?mine=1');
+      const mine = await apiAllPages('/games?mine=1');
       const nowMs = Date.now();
       const up = (mine.items || []).filter((game) =>
         game.status === 'upcoming' && new Date(game.scheduled_at).getTime() > nowMs);
@@ -2842,8 +3113,7 @@
     render(game);
 
     // Live sync: while this screen is open, pick up joins, scores, confirmations…
-    const pollTimer = setInterval(async () => {
-      if (!document.body.contains(box)) { clearInterval(pollTimer); return; }
+    const sync = async () => {
       try {
         const fresh = await api(`/games/${gameId}`);
         if (gameFingerprint(fresh) !== fingerprint) {
@@ -2851,6 +3121,14 @@
           refreshMe();
         }
       } catch { /* offline */ }
+    };
+    // Pushed game events only reach players and invitees, so keep polling too.
+    const offStream = onStreamEvent((evt) => {
+      if (evt.type === 'game' && evt.id === gameId) sync();
+    });
+    const pollTimer = setInterval(() => {
+      if (!document.body.contains(box)) { clearInterval(pollTimer); offStream(); return; }
+      sync();
     }, 5000);
   }
 
@@ -3036,9 +3314,10 @@
     startLocationWatch();
     maybeOnboardHomeArea();
     clearInterval(state.mePollTimer);
+    connectStream();
     let tick = 0;
     state.mePollTimer = setInterval(() => {
-      refreshMe();
+      if (!state.streamLive) refreshMe();
       tick += 1;
       if (tick % 3 === 0 && state.presence && state.presence.checked_in) {
         api('/presence/ping', { method: 'POST' }).catch(() => {});
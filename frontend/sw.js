@@ -1,6 +1,8 @@
 /* Third Shot service worker: offline fallback for the app shell.
-   Network-first everywhere so deploys are never stale. */
-const CACHE = 'thirdshot-v3';
+   Network-first everywhere so deploys are never stale — except court map
+   tiles, which are static geometry served stale-while-revalidate. */
+const CACHE = 'thirdshot-v4';
+const TILE_CACHE = 'thirdshot-tiles-v1';
 const SHELL = ['/', '/styles.css', '/app.js', '/manifest.webmanifest', '/icon-512.png', '/logo.jpg'];
 
 self.addEventListener('install', (event) => {
@@ -12,7 +14,7 @@ self.addEventListener('install', (event) => {
 self.addEventListener('activate', (event) => {
   event.waitUntil(
     caches.keys().then((keys) =>
-      Promise.all(keys.filter((k) => k !== CACHE).map((k) => caches.delete(k))),
+      Promise.all(keys.filter((k) => k !== CACHE && k !== TILE_CACHE).map((k) => caches.delete(k))),
     ).then(() => self.clients.claim()),
   );
 });
@@ -20,6 +22,22 @@ self.addEventListener('activate', (event) => {
 self.addEventListener('fetch', (event) => {
   const url = new URL(event.request.url);
   if (event.request.method !== 'GET' || url.origin !== location.origin) return;
+  if (url.pathname.startsWith('/api/courts/tiles/')) {
+    // Serve the cached tile immediately; revalidate (ETag → 304) in the background.
+    event.respondWith(caches.open(TILE_CACHE).then((cache) =>
+      cache.match(event.request).then((cached) => {
+        const network = fetch(event.request).then((res) => {
+          if (res.ok) cache.put(event.request, res.clone());
+          return res;
+        });
+        if (cached) {
+          event.waitUntil(network.catch(() => {}));
+          return cached;
+        }
+        return network;
+      })));
+    return;
+  }
   if (url.pathname.startsWith('/api')) return; // API is always live
   event.respondWith(
     fetch(event.request)
@@ -55,6 +55,20 @@ def auth_headers(token):
     return {'Authorization': f'Bearer {token}'}
 
 
+def get_counting_queries(client, path, token):
+    """GET path with a cold identity map; returns (json, SQL statements run)."""
+    from sqlalchemy import event as sa_event
+    statements = []
+    db.session.expunge_all()
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    sa_event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        res = client.get(path, headers=auth_headers(token))
+    finally:
+        sa_event.remove(db.engine, 'before_cursor_execute', listener)
+    return res.get_json(), len(statements)
+
+
 # ---------- Auth ----------
 
 def test_register_login_me(client):
@@ -128,6 +142,343 @@ def test_courts_nearby_distance(client):
     assert items[0]['distance_miles'] < 5
 
 
+def test_court_index_tracks_new_courts(client, app):
+    from backend.services.court_index import get_court_index
+    bbox = '/api/courts?bbox=-118.5,33.0,-117.0,34.0'
+    assert [c['name'] for c in client.get(bbox).get_json()['items']] == ['Larson Park']
+
+    with app.app_context():
+        db.session.add(Court(name='Bigger Park', state='CA', latitude=33.70,
+                             longitude=-117.80, num_courts=12))
+        db.session.commit()
+        # Outside the box: indexed, but never returned for this bbox.
+        db.session.add(Court(name='Far Away', state='WA', latitude=47.6,
+                             longitude=-122.3, num_courts=20))
+        db.session.commit()
+
+    names = [c['name'] for c in client.get(bbox).get_json()['items']]
+    assert names == ['Bigger Park', 'Larson Park']  # most courts first
+    with app.app_context():
+        assert len(get_court_index(app)) == 4
+
+
+def test_streaming_court_import(client, app, tmp_path):
+    import gzip
+    import io
+    import json
+
+    from backend.court_records import iter_json_array
+    from backend.seed import import_courts_file
+    records = [
+        {'name': 'Larson Park', 'latitude': 33.66, 'longitude': -117.91},  # already stored
+        {'name': 'Harbor Courts', 'city': 'Irvine', 'latitude': 33.68, 'longitude': -117.83,
+         'num_courts': '8', 'lighted': 'yes', 'notes': 'x' * 300},
+        {'name': 'harbor courts', 'latitude': 33.680001, 'longitude': -117.83},  # dup in file
+        {'name': 'No Location'},
+        'not a record',
+        {'name': 'Bay Park', 'state': 'ca', 'latitude': 33.6, 'longitude': -117.9},
+    ]
+    text = json.dumps(records, indent=2)
+    # Items straddling every chunk boundary parse the same as json.loads.
+    assert list(iter_json_array(io.StringIO(text), chunk_size=7)) == records
+    assert list(iter_json_array(io.StringIO(' [ ] '))) == []
+
+    path = tmp_path / 'courts.json.gz'
+    with gzip.open(path, 'wt') as handle:
+        handle.write(text)
+    logged = []
+    with app.app_context():
+        assert import_courts_file(str(path), log=logged.append) == 2
+        assert import_courts_file(str(path)) == 0
+        harbor = Court.query.filter_by(name='Harbor Courts').one()
+        assert (harbor.num_courts, harbor.lighted, harbor.rating_count) == (8, True, 0)
+        assert harbor.created_at is not None and Court.query.count() == 4
+    assert 'rows/s' in logged[-1]
+    # The court index sees the Core-inserted rows straight away.
+    found = client.get('/api/courts?q=harbor').get_json()['items']
+    assert [c['name'] for c in found] == ['Harbor Courts']
+
+    (tmp_path / 'bad.json').write_text('{"not": "a list"}')
+    with app.app_context(), pytest.raises(ValueError):
+        import_courts_file(str(tmp_path / 'bad.json'))
+
+
+def test_parallel_court_dir_import_matches_serial(app, tmp_path, capsys):
+    import json
+
+    from backend.seed import _court_json_files, _rows_from_files, import_courts
+    for county in range(6):
+        county_dir = tmp_path / f'county-{county}'
+        county_dir.mkdir()
+        (county_dir / 'courts.json').write_text(json.dumps([
+            {'name': f'Court {county}-{n}', 'latitude': 34 + county, 'longitude': -118 + n / 10}
+            for n in range(5)
+        ] + [{'name': 'Shared Park', 'latitude': 35.5, 'longitude': -119.5}]))
+    (tmp_path / 'county-3' / 'broken.json').write_text('{not json')
+
+    paths = _court_json_files(str(tmp_path))
+    serial = list(_rows_from_files(paths))
+    assert list(_rows_from_files(paths, jobs=3)) == serial
+    assert len(serial) == 36 and 'broken.json' in capsys.readouterr().err
+    with app.app_context():
+        # The cross-file duplicate is dropped by the single writer.
+        assert import_courts(str(tmp_path), jobs=3) == 31
+        assert Court.query.filter_by(name='Shared Park').count() == 1
+        assert import_courts(str(tmp_path), jobs=3) == 0
+        first = Court.query.filter(Court.name.like('Court %')).order_by(Court.id).first()
+        assert first.name == 'Court 0-0' and first.source_hash
+
+
+def test_court_snapshot_serves_cold_start_then_hydrates(client, app, tmp_path):
+    import subprocess
+    import sys
+    from pathlib import Path
+    from backend.court_records import _normalized_rows
+    from backend.seed import hydrate_courts
+    from backend.services.court_index import get_court_index
+    from backend.snapshot import CourtSnapshot, build_snapshot
+    path = str(tmp_path / 'courts.snapshot')
+    records = [
+        {'name': 'Harbor Courts', 'city': 'Irvine', 'latitude': 33.68, 'longitude': -117.83,
+         'num_courts': 8, 'lighted': True, 'fees': 'Free'},
+        {'name': 'Bay Park', 'city': 'Irvine', 'latitude': 33.6, 'longitude': -117.9, 'indoor': 'yes'},
+        {'name': 'Café Courts', 'city': 'Eureka', 'latitude': 40.8, 'longitude': -124.1},
+    ]
+    assert build_snapshot(_normalized_rows(records), path) == 3
+    (tmp_path / 'bad.snapshot').write_bytes(b'TSCS' + b'\0' * 40)
+    with pytest.raises(ValueError):
+        CourtSnapshot(str(tmp_path / 'bad.snapshot'))
+
+    # The build step compiles without app config or a database.
+    probe = subprocess.run(
+        [sys.executable, '-c', 'import sys, backend.snapshot; print("backend.app" in sys.modules)'],
+        capture_output=True, text=True, check=True, env={'PATH': '', 'APP_ENV': 'production'},
+        cwd=str(Path(__file__).resolve().parents[1]),
+    )
+    assert probe.stdout.strip() == 'False'
+
+    snapshot = CourtSnapshot(path)
+    with app.app_context():
+        Court.query.delete()
+        db.session.commit()
+        get_court_index().use_snapshot(snapshot)
+
+    # Empty table: search, map and detail are served from the snapshot.
+    items = client.get('/api/courts?q=irvine').get_json()['items']
+    assert [(c['id'], c['name']) for c in items] == [(1, 'Harbor Courts'), (2, 'Bay Park')]
+    assert client.get('/api/courts?sort=rating&indoor=1').get_json()['items'][0]['name'] == 'Bay Park'
+    detail = client.get('/api/courts/3').get_json()
+    assert (detail['name'], detail['players_here'], detail['rating_count']) == ('Café Courts', [], 0)
+    assert client.get('/api/courts/4').status_code == 404
+
+    with app.app_context():
+        assert hydrate_courts(snapshot) == 3
+        harbor = db.session.get(Court, 1)
+        assert (harbor.name, harbor.fees, harbor.num_courts, harbor.lighted) == ('Harbor Courts', 'Free', 8, True)
+        assert harbor.source_hash
+    # Same ids once the table is hydrated; the index now reads the table.
+    assert client.get('/api/courts/3').get_json()['name'] == 'Café Courts'
+    assert len(client.get('/api/courts').get_json()['items']) == 3
+    with app.app_context():
+        assert not get_court_index().serving_snapshot
+
+
+def test_court_sync_updates_skips_and_stales(client, app):
+    from backend.seed import fingerprint_courts, sync_courts
+    feed = [
+        {'name': 'Larson Park', 'city': 'Costa Mesa', 'latitude': 33.66, 'longitude': -117.91,
+         'num_courts': 8, 'fees': 'Free'},
+        {'name': 'Harbor Courts', 'city': 'Irvine', 'latitude': 33.68, 'longitude': -117.83},
+    ]
+    with app.app_context():
+        assert fingerprint_courts() == 2
+        adorni_id = Court.query.filter_by(name='Adorni Center').one().id
+        report = sync_courts(feed)
+        assert (report['added'], report['changed'], report['unchanged'], report['stale']) == (1, 1, 0, 1)
+        assert report['samples']['stale'] == ['Adorni Center']
+        larson = Court.query.filter_by(name='Larson Park').one()
+        assert (larson.num_courts, larson.fees, larson.stale) == (8, 'Free', False)
+        assert db.session.get(Court, adorni_id).stale
+
+        # Re-running the same export is a no-op.
+        report = sync_courts(feed)
+        assert (report['added'], report['changed'], report['unchanged'], report['stale']) == (0, 0, 2, 0)
+
+        # A dry run reports the diff (Adorni returning, Harbor edited) and writes nothing.
+        edited = [feed[0], {**feed[1], 'lighted': True},
+                  {'name': 'Adorni Center', 'latitude': 40.81, 'longitude': -124.16}]
+        report = sync_courts(edited, dry_run=True)
+        assert (report['added'], report['changed'], report['unchanged'], report['stale']) == (0, 2, 1, 0)
+        assert ('Harbor Courts', ['lighted']) in report['samples']['changed']
+        assert db.session.get(Court, adorni_id).stale
+        assert not Court.query.filter_by(name='Harbor Courts').one().lighted
+
+    # Stale courts leave the map and search but keep their detail page.
+    names = {c['name'] for c in client.get('/api/courts').get_json()['items']}
+    assert names == {'Larson Park', 'Harbor Courts'}
+    assert client.get('/api/courts?sort=rating').get_json()['items'][0]['name'] != 'Adorni Center'
+    assert client.get(f'/api/courts/{adorni_id}').status_code == 200
+
+
+def test_court_sync_keeps_community_photos(client, app):
+    from backend.seed import fingerprint_courts, sync_courts
+    with app.app_context():
+        larson = Court.query.filter_by(name='Larson Park').one()
+        larson.photo_url = f'/api/courts/{larson.id}/photo'
+        larson.photo_data = 'data:image/png;base64,AAAA'
+        db.session.commit()
+        larson_id = larson.id
+        fingerprint_courts()
+        feed = [
+            {'name': 'Larson Park', 'city': 'Costa Mesa', 'latitude': 33.66, 'longitude': -117.91},
+            {'name': 'Adorni Center', 'city': 'Eureka', 'latitude': 40.81, 'longitude': -124.16},
+        ]
+        sync_courts(feed)
+        assert db.session.get(Court, larson_id).photo_url == f'/api/courts/{larson_id}/photo'
+
+        # The uploaded photo isn't scraped data: an identical export leaves it alone.
+        report = sync_courts(feed)
+        assert (report['changed'], report['unchanged']) == (0, 2)
+
+        feed[0]['open_play_schedule'] = 'Sat 8-11am'
+        report = sync_courts(feed)
+        assert report['changed'] == 1
+        assert report['samples']['changed'] == [('Larson Park', ['open_play_schedule'])]
+        larson = db.session.get(Court, larson_id)
+        assert larson.open_play_schedule == 'Sat 8-11am'
+        assert larson.photo_url == f'/api/courts/{larson_id}/photo'
+    assert client.get(f'/api/courts/{larson_id}/photo').status_code == 200
+
+def test_court_sync_refuses_partial_exports(client, app, monkeypatch):
+    from backend import seed
+    from backend.seed import SyncAborted, sync_court_rows, sync_courts
+    user = register(client, 'a@example.com', 'Ana')
+    with app.app_context():
+        larson_id = Court.query.filter_by(name='Larson Park').one().id
+    client.patch('/api/me', json={'home_court_id': larson_id}, headers=auth_headers(user['token']))
+    feed = [
+        {'name': 'Larson Park', 'city': 'Costa Mesa', 'latitude': 33.66, 'longitude': -117.91},
+        {'name': 'Adorni Center', 'city': 'Eureka', 'latitude': 40.81, 'longitude': -124.16},
+    ]
+    with app.app_context():
+        sync_courts(feed)
+        # An empty export, a file that failed to parse, or a stream that
+        # breaks midway aborts the whole sync.
+        with pytest.raises(SyncAborted):
+            sync_courts([])
+        with pytest.raises(SyncAborted):
+            sync_court_rows(seed._normalized_rows(feed), errors=['Skipping a.json: bad JSON'])
+
+        def broken():
+            yield from seed._normalized_rows([{**feed[0], 'num_courts': 9}])
+            raise ValueError('courts.json.gz: malformed JSON list near offset 10')
+
+        with pytest.raises(SyncAborted):
+            sync_court_rows(broken())
+        assert Court.query.filter_by(name='Larson Park').one().num_courts != 9
+
+        # Dropping more courts than the limit needs allow_mass_stale.
+        monkeypatch.setattr(seed, 'SYNC_MAX_STALE_MIN', 0)
+        with pytest.raises(SyncAborted):
+            sync_courts(feed[:1])
+        assert sync_courts(feed[:1], dry_run=True)['stale'] == 1
+        assert not Court.query.filter_by(name='Adorni Center').one().stale
+        assert sync_courts(feed[:1], allow_mass_stale=True)['stale'] == 1
+
+        # A home court nudged in place moves its players' effective location.
+        sync_courts([{**feed[0], 'latitude': 33.660004}], allow_mass_stale=True)
+        assert db.session.get(User, user['user']['id']).loc_lat == 33.660004
+
+
+def test_court_search_ranking_and_suggest(client, app):
+    with app.app_context():
+        db.session.add(Court(name='Parkside Courts', city='Larson City', state='CA',
+                             latitude=34.0, longitude=-118.0, num_courts=10))
+        db.session.commit()
+
+    # Prefix match on every token; a name hit outranks a bigger court whose
+    # city merely matches.
+    names = [c['name'] for c in client.get('/api/courts?q=lars').get_json()['items']]
+    assert names == ['Larson Park', 'Parkside Courts']
+    names = [c['name'] for c in client.get('/api/courts?q=lars par').get_json()['items']]
+    assert names == ['Larson Park', 'Parkside Courts']
+    assert client.get('/api/courts?q=eureka').get_json()['items'][0]['name'] == 'Adorni Center'
+    assert client.get('/api/courts?q=zzz').get_json()['items'] == []
+
+    res = client.get('/api/courts/suggest?q=Park&limit=1')
+    assert res.status_code == 200
+    items = res.get_json()['items']
+    assert [c['name'] for c in items] == ['Parkside Courts']
+    assert items[0]['city'] == 'Larson City'
+    assert client.get('/api/courts/suggest?q=').get_json()['items'] == []
+
+
+def test_court_clusters(client):
+    token = register(client, 'a@example.com', 'Ana')['token']
+    larson = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+    client.post(f'/api/courts/{larson}/checkin', json={}, headers=auth_headers(token))
+
+    # Whole-state view at low zoom: both courts fall in one cluster.
+    res = client.get('/api/courts/clusters?bbox=-125,32,-114,42&zoom=2')
+    assert res.status_code == 200
+    data = res.get_json()
+    assert data['total'] == 2
+    assert [c['count'] for c in data['items']] == [2]
+    assert data['items'][0]['players_here'] == 1
+    assert data['items'][0]['court_id'] is None
+
+    # Zoomed in: each court is its own single-court cluster.
+    items = client.get('/api/courts/clusters?bbox=-125,32,-114,42&zoom=10').get_json()['items']
+    assert sorted(c['count'] for c in items) == [1, 1]
+    single = next(c for c in items if c['court_id'] == larson)
+    assert single['players_here'] == 1
+
+    indoor = client.get('/api/courts/clusters?bbox=-125,32,-114,42&zoom=2&indoor=1').get_json()
+    assert indoor['total'] == 1 and indoor['items'][0]['players_here'] == 0
+    assert client.get('/api/courts/clusters?bbox=nope').status_code == 400
+
+
+def test_court_tiles_and_live_overlay(client, app):
+    import struct
+    token = register(client, 'a@example.com', 'Ana')['token']
+    larson = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+    # z10 tile holding Larson Park (33.66, -117.91)
+    url = '/api/courts/tiles/10/176/410'
+
+    res = client.get(f'{url}.json')
+    assert res.status_code == 200
+    data = res.get_json()
+    assert [c[0] for c in data['courts']] == [larson]
+    assert data['courts'][0][4] == 2  # lighted flag
+    etag = res.headers['ETag']
+    assert 'max-age' in res.headers['Cache-Control']
+
+    # Conditional re-fetch is a bodyless 304.
+    again = client.get(f'{url}.json', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+
+    binary = client.get(f'{url}.bin')
+    magic, version, count = struct.unpack_from('<4sHI', binary.data)
+    assert (magic, version, count) == (b'TSCT', 1, 1)
+    cid, lat, lng, num, flags = struct.unpack_from('<IffHB', binary.data, 10)
+    assert cid == larson and num == 6 and abs(lat - 33.66) < 1e-4
+
+    # Any court change bumps the table version, so the old ETag stops matching.
+    with app.app_context():
+        court = db.session.get(Court, larson)
+        court.num_courts = 8
+        db.session.commit()
+    changed = client.get(f'{url}.json', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.get_json()['courts'][0][3] == 8
+
+    assert client.get('/api/courts/tiles/2/0/0.json').status_code == 404
+    assert client.get(f'{url}.png').status_code == 404
+
+    client.post(f'/api/courts/{larson}/checkin', json={}, headers=auth_headers(token))
+    live = client.get('/api/courts/live?bbox=-118.5,33.0,-117.0,34.0').get_json()['items']
+    assert live == [{'id': larson, 'players_here': 1, 'upcoming_games': 0}]
+
+
 def test_geocode(client, monkeypatch):
     import backend.routes.courts as courts_mod
     courts_mod._GEOCODE_CACHE.clear()
@@ -192,6 +543,67 @@ def test_leaderboard_area_scope(client, app):
     assert hum == [b['user']['id']]
 
 
+def test_regional_leaderboards_rank_and_page(client, app):
+    from backend.services.events import get_event_bus, user_event
+    from backend.services.leaderboards import get_leaderboards
+    a = register(client, 'a@example.com', 'Ana')
+    b = register(client, 'b@example.com', 'Ben')
+    c = register(client, 'c@example.com', 'Cam')
+    larson = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+    adorni = client.get('/api/courts?q=adorni').get_json()['items'][0]['id']
+    with app.app_context():
+        portland = Court(name='Portland Park', city='Portland', state='OR',
+                         latitude=45.52, longitude=-122.68, num_courts=4)
+        db.session.add(portland)
+        db.session.flush()
+        for uid, court_id, rating in ((a['user']['id'], larson, 1300),
+                                      (b['user']['id'], adorni, 1250),
+                                      (c['user']['id'], portland.id, 1200)):
+            u = db.session.get(User, uid)
+            u.home_court_id, u.rating, u.ranked_wins = court_id, rating, 1
+        db.session.commit()
+
+    def board(query, token=None):
+        res = client.get(f'/api/leaderboard?{query}', headers=auth_headers(token) if token else {})
+        return res.get_json()
+
+    first = board('scope=global&limit=2')
+    assert [(u['id'], u['rank']) for u in first['items']] == [(a['user']['id'], 1), (b['user']['id'], 2)]
+    assert first['total'] == 3 and first['next_offset'] == 2
+    rest = board('scope=global&limit=2&offset=2')
+    assert [u['id'] for u in rest['items']] == [c['user']['id']] and rest['next_offset'] is None
+
+    assert [u['id'] for u in board('scope=state&state=ca')['items']] == [a['user']['id'], b['user']['id']]
+    oregon = board('scope=state&lat=45.5&lng=-122.6')
+    assert oregon['region']['key'] == 'OR' and [u['id'] for u in oregon['items']] == [c['user']['id']]
+    metro = board('scope=metro&lat=33.66&lng=-117.91', b['token'])
+    assert metro['region']['label'] == 'Costa Mesa, CA'
+    assert [u['id'] for u in metro['items']] == [a['user']['id']] and metro['me'] is None
+    assert board('scope=global', b['token'])['me'] == {'rank': 2, 'total': 3}
+    assert client.get('/api/leaderboard?scope=county').status_code == 400
+
+    # Rating changes move players right away; ties share a rank.
+    with app.app_context():
+        db.session.get(User, b['user']['id']).rating = 1300
+        db.session.commit()
+    assert [u['rank'] for u in board('scope=global')['items']] == [1, 1, 3]
+    profile = client.get(f"/api/users/{b['user']['id']}", headers=auth_headers(a['token'])).get_json()
+    assert {(r['scope'], r['rank']) for r in profile['ranks']} >= {('global', 1), ('state', 1)}
+
+    # A write from another worker arrives as a bus event; anything that
+    # bypassed both is fixed by the reconcile.
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.id == c['user']['id']).values(rating=1500))
+        db.session.commit()
+        get_event_bus(app).dispatch([user_event(c['user']['id'], 'profile')])
+    assert board('scope=global', c['token'])['me'] == {'rank': 1, 'total': 3}
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.id == a['user']['id']).values(ranked_wins=0))
+        db.session.commit()
+        assert get_leaderboards(app).reconcile() == 1
+    assert board('scope=global')['total'] == 2
+
+
 def test_public_profile_extras(client):
     a = register(client, 'a@example.com', 'Ana')
     b = register(client, 'b@example.com', 'Ben')  # viewer (not a friend)
@@ -285,6 +697,27 @@ def test_court_reviews(client):
     assert client.post(f'/api/courts/{court_id}/reviews', json={}, headers=auth_headers(a['token'])).status_code == 400
 
 
+def test_rebuild_court_ratings(client, app):
+    from backend.models import Court
+    from backend.services.court_ratings import rebuild_court_ratings
+    a = register(client, 'a@example.com', 'Ana')
+    court_id = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+    court = db.session.get(Court, court_id)
+    stamp = court.updated_at
+    client.post(f'/api/courts/{court_id}/reviews', json={'rating': 4}, headers=auth_headers(a['token']))
+    db.session.refresh(court)
+    assert (court.rating_sum, court.rating_count, court.rating_avg) == (4, 1, 4.0)
+    # A review isn't a court edit: the index/tile version must not move.
+    assert court.updated_at == stamp
+
+    assert rebuild_court_ratings() == 0
+    court.rating_sum, court.rating_count, court.rating_avg = 0, 0, None
+    db.session.commit()
+    assert rebuild_court_ratings() == 1
+    db.session.refresh(court)
+    assert (court.rating_sum, court.rating_count, court.rating_avg) == (4, 1, 4.0)
+
+
 def test_avatar_url(client):
     token = register(client, 'a@example.com', 'Ana')['token']
     res = client.patch('/api/me', json={'avatar_url': 'https://example.com/me.jpg'},
@@ -548,6 +981,165 @@ def test_checkin_flow(client):
     assert res.get_json()['presence']['checked_in'] is False
 
 
+def test_presence_reaper_expires_stale_checkins(client, app, monkeypatch):
+    from datetime import timedelta
+    from backend.jobs import get_scheduler
+    from backend.models import CheckIn, utcnow
+    from backend.services import leases
+    from backend.services.leases import acquire_lease, worker_id
+    a = register(client, 'a@example.com', 'Ana')
+    b = register(client, 'b@example.com', 'Ben')
+    court_id = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+    for user in (a, b):
+        client.post(f'/api/courts/{court_id}/checkin', json={}, headers=auth_headers(user['token']))
+
+    with app.app_context():
+        stale = CheckIn.query.filter_by(user_id=a['user']['id']).one()
+        stale.last_presence_ping_at = utcnow() - timedelta(hours=3)
+        db.session.commit()
+
+    # Reads no longer sweep: Ana still shows until the reaper runs.
+    detail = client.get(f'/api/courts/{court_id}').get_json()
+    assert len(detail['players_here']) == 2
+
+    scheduler = get_scheduler(app)
+    assert scheduler.run_job('presence_reaper') == 1
+    detail = client.get(f'/api/courts/{court_id}').get_json()
+    assert [p['id'] for p in detail['players_here']] == [b['user']['id']]
+
+    # The detailed report needs the shared health token.
+    assert client.get('/health/jobs').status_code == 403
+    app.config['HEALTH_TOKEN'] = 'ops-secret'
+    assert client.get('/health/jobs', headers={'X-Health-Token': 'wrong'}).status_code == 403
+    health = {'X-Health-Token': 'ops-secret'}
+    metrics = client.get('/health/jobs', headers=health).get_json()['presence_reaper']
+    assert metrics['runs'] == 1 and metrics['total_result'] == 1 and metrics['is_leader']
+    assert metrics['history'][0]['result'] == 1
+    assert set(client.get('/health/jobs', headers=health).get_json()) >= {
+        'auto_confirm_scores', 'roll_forward_recurring', 'game_reminders',
+    }
+
+    # Another worker can't take the lease while this one holds it.
+    with app.app_context():
+        assert acquire_lease('job:presence_reaper', 60, holder='other-worker') is False
+    assert scheduler.run_job('presence_reaper') == 0
+    assert scheduler.metrics()['presence_reaper']['runs'] == 2
+
+    # A process forked after import gets its own holder id.
+    parent = worker_id()
+    assert worker_id() == parent
+    monkeypatch.setattr(leases.os, 'getpid', lambda: -1)
+    assert worker_id() != parent and ':-1:' in worker_id()
+
+
+def test_db_pool_config_and_checkout_metrics(client, app, monkeypatch, tmp_path):
+    from sqlalchemy import create_engine, exc
+    from backend import config
+    from backend.services.db_pool import MeteredQueuePool, pool_metrics
+
+    monkeypatch.setenv('DATABASE_URL', 'postgres://u:p@db/app')
+    monkeypatch.setenv('DB_POOL_SIZE', '4')
+    monkeypatch.setenv('DB_STATEMENT_TIMEOUT_MS', '2500')
+    options = config._engine_options()
+    assert (options['poolclass'], options['pool_size'], options['pool_pre_ping']) == (
+        MeteredQueuePool, 4, True,
+    )
+    assert options['connect_args']['options'] == (
+        f'-csearch_path={config.PG_SCHEMA} -cstatement_timeout=2500'
+    )
+
+    # Bulk jobs lift the timeout for their own transaction only (Postgres).
+    from types import SimpleNamespace
+    from backend.services.db_pool import lift_statement_timeout
+    executed = []
+    session = SimpleNamespace(
+        get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name='postgresql')),
+        execute=lambda statement: executed.append(str(statement)),
+    )
+    lift_statement_timeout(session)
+    assert executed == ['SET LOCAL statement_timeout = 0']
+
+    engine = create_engine(
+        f'sqlite:///{tmp_path / "pool.db"}', poolclass=MeteredQueuePool,
+        pool_size=1, max_overflow=0, pool_timeout=0.05, slow_checkout_ms=20,
+    )
+    held = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    held.close()
+    engine.connect().close()
+    metrics = pool_metrics(engine)
+    assert (metrics['checkouts'], metrics['timeouts'], metrics['slow_checkouts']) == (2, 1, 1)
+    assert metrics['recent_slow'][0]['timed_out'] and metrics['checked_out'] == 0
+    assert sum(b['count'] for b in metrics['wait_histogram']) == 3
+    engine.dispose()
+
+    # The test app's StaticPool isn't metered; the endpoint still reports it,
+    # to holders of the health token only.
+    assert client.get('/health/db').status_code == 403
+    app.config['HEALTH_TOKEN'] = 'ops-secret'
+    res = client.get('/health/db', headers={'X-Health-Token': 'ops-secret'})
+    assert res.get_json()['pool'] == 'StaticPool'
+
+
+def test_live_counters_track_activity(client, app, monkeypatch):
+    from datetime import timedelta
+    from backend.jobs import get_scheduler
+    from backend.models import CheckIn, utcnow
+    a = register(client, 'a@example.com', 'Ana')
+    b = register(client, 'b@example.com', 'Ben')
+    court_id = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+
+    def larson():
+        return client.get('/api/courts?q=larson').get_json()['items'][0]
+
+    for user in (a, b):
+        client.post(f'/api/courts/{court_id}/checkin', json={}, headers=auth_headers(user['token']))
+    assert larson()['players_here'] == 2
+    active = client.get('/api/courts?active=1').get_json()['items']
+    assert [c['id'] for c in active] == [court_id]
+
+    client.post('/api/checkout', headers=auth_headers(b['token']))
+    assert larson()['players_here'] == 1
+
+    game = client.post('/api/games', json={
+        'court_id': court_id,
+        'scheduled_at': (utcnow() + timedelta(days=1)).isoformat() + 'Z',
+        'game_type': 'casual', 'visibility': 'open',
+    }, headers=auth_headers(a['token'])).get_json()
+    assert larson()['upcoming_games'] == 1
+    client.post(f"/api/games/{game['id']}/cancel", headers=auth_headers(a['token']))
+    assert larson()['upcoming_games'] == 0
+
+    # Bulk expiry by the reaper is reflected without a reconcile.
+    with app.app_context():
+        row = CheckIn.query.filter_by(user_id=a['user']['id']).one()
+        row.last_presence_ping_at = utcnow() - timedelta(hours=3)
+        db.session.commit()
+    assert get_scheduler(app).run_job('presence_reaper') == 1
+    assert larson()['players_here'] == 0
+    assert client.get('/api/courts?active=1').get_json()['items'] == []
+    # Counters and database agree, so reconciling corrects nothing.
+    assert get_scheduler(app).run_job('live_counters_reconcile') == 0
+
+    # A check-in committed while a reconcile is reading survives its swap.
+    from backend.services import live_counters
+    counters = live_counters.get_live_counters(app)
+    real_utcnow = live_counters.utcnow
+    landed = []
+
+    def utcnow_with_commit():
+        if not landed:
+            landed.append(True)
+            counters.apply(checkins=[(9999, court_id, True)])
+        return real_utcnow()
+
+    monkeypatch.setattr(live_counters, 'utcnow', utcnow_with_commit)  # between the two reads
+    with app.app_context():
+        counters.reconcile()
+    assert landed and larson()['players_here'] == 1
+
+
 def test_court_photo_upload_and_serve(client):
     import base64 as b64
     a = register(client, 'a@example.com', 'Ana')
@@ -944,16 +1536,70 @@ def test_players_nearby(client):
     assert client.get('/api/players/nearby', headers=auth_headers(a['token'])).status_code == 400
 
 
-def test_players_nearby_home_court_fallback(client):
+def test_players_nearby_home_court_fallback(client, app, monkeypatch):
     # A player who never checked in but set a home court is still discoverable.
+    from backend.routes import social
     a = register(client, 'a@example.com', 'Ana')
     homer = register(client, 'homer@example.com', 'Homer')
+    roamer = register(client, 'roamer@example.com', 'Roamer')
     larson = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
     client.patch('/api/me', json={'home_court_id': larson}, headers=auth_headers(homer['token']))
 
     res = client.get('/api/players/nearby?lat=33.66&lng=-117.91&radius=25', headers=auth_headers(a['token']))
     assert 'Homer' in [p['display_name'] for p in res.get_json()['items']]
 
+    # Wide radii fetch only the closest candidates from SQL.
+    with app.app_context():
+        user = db.session.get(User, roamer['user']['id'])
+        user.last_lat, user.last_lng = 34.9, -117.0  # ~100 miles out
+        db.session.commit()
+    wide = '/api/players/nearby?lat=33.66&lng=-117.91&radius=250'
+    names = [p['display_name'] for p in client.get(wide, headers=auth_headers(a['token'])).get_json()['items']]
+    assert names == ['Homer', 'Roamer']
+    monkeypatch.setattr(social, 'NEARBY_PLAYERS_CANDIDATES', 1)
+    names = [p['display_name'] for p in client.get(wide, headers=auth_headers(a['token'])).get_json()['items']]
+    assert names == ['Homer']
+
+
+def test_user_locations_follow_courts_and_checkins(client, app):
+    from backend.services.user_locations import rebuild_user_locations
+    a = register(client, 'a@example.com', 'Ana')
+    homer = register(client, 'homer@example.com', 'Homer')
+    larson = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+    adorni = client.get('/api/courts?q=adorni').get_json()['items'][0]['id']
+    client.patch('/api/me', json={'home_court_id': larson}, headers=auth_headers(homer['token']))
+
+    def nearby(lat, lng):
+        res = client.get(f'/api/players/nearby?lat={lat}&lng={lng}&radius=25',
+                         headers=auth_headers(a['token'])).get_json()
+        return [p['display_name'] for p in res['items']], res['count']
+
+    assert nearby(33.66, -117.91) == (['Homer'], 1)
+
+    # The home court moves: home-court-only players move with it.
+    with app.app_context():
+        court = db.session.get(Court, larson)
+        court.latitude, court.longitude = 40.80, -124.15
+        db.session.commit()
+    assert nearby(33.66, -117.91) == ([], 0)
+    assert nearby(40.81, -124.16) == (['Homer'], 1)
+
+    # A check-in location beats the home court.
+    client.post(f'/api/courts/{adorni}/checkin', json={}, headers=auth_headers(homer['token']))
+    with app.app_context():
+        court = db.session.get(Court, larson)
+        court.latitude, court.longitude = 33.66, -117.91
+        db.session.commit()
+    assert nearby(40.81, -124.16) == (['Homer'], 1)
+
+    # Writes that bypass the ORM are repaired by a rebuild.
+    with app.app_context():
+        db.session.execute(db.update(User).values(loc_lat=None, loc_lng=None, geo_cell=None))
+        db.session.commit()
+        assert nearby(40.81, -124.16) == ([], 0)
+        assert rebuild_user_locations() == 1
+    assert nearby(40.81, -124.16) == (['Homer'], 1)
+
 
 # ---------- Chat ----------
 
@@ -1008,6 +1654,316 @@ def test_court_chat(client):
     assert [m['body'] for m in fresh['items']] == ['Yes!']
 
 
+def test_event_stream_pushes_user_events(client, app):
+    import json as _json
+    from backend.services.events import get_event_bus
+    a = register(client, 'a@example.com', 'Ana')
+    b = register(client, 'b@example.com', 'Ben')
+    assert client.get('/api/stream').status_code == 401
+    # The session token never goes in the URL: the stream takes a short-lived
+    # ticket, which in turn is no good as a session token.
+    assert client.get(f"/api/stream?ticket={a['token']}").status_code == 401
+    ticket = client.post('/api/stream/ticket', headers=auth_headers(a['token'])).get_json()['ticket']
+    assert client.get('/api/me', headers=auth_headers(ticket)).status_code == 401
+    court_id = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+
+    app.config['EVENT_STREAM_MAX_SECONDS'] = 1
+    stream = client.get(f"/api/stream?ticket={ticket}&court={court_id}", buffered=False)
+    assert stream.status_code == 200
+    assert stream.mimetype == 'text/event-stream'
+    chunks = iter(stream.response)
+    assert 'event: ready' in next(chunks).decode()
+
+    client.post(f"/api/chat/{a['user']['id']}", json={'body': 'Hi'}, headers=auth_headers(b['token']))
+    client.post('/api/friends/request', json={'user_id': a['user']['id']}, headers=auth_headers(b['token']))
+    client.post(f'/api/courts/{court_id}/chat', json={'body': 'Courts open'}, headers=auth_headers(b['token']))
+    events = []
+    for chunk in chunks:
+        text = chunk.decode()
+        if text.startswith('event:'):
+            events.append(_json.loads(text.split('data: ', 1)[1]))
+    stream.close()
+    assert events[0]['type'] == 'message' and events[0]['sender_id'] == b['user']['id']
+    assert {'friendship', 'notification', 'court_message'} <= {e['type'] for e in events[1:]}
+    # Ids only, never message content.
+    assert 'body' not in events[0]
+
+    # A response dropped before its first chunk holds no slot or subscription.
+    bus = get_event_bus(app)
+    with app.test_request_context(f'/api/stream?ticket={ticket}'):
+        resp = app.view_functions['stream.event_stream']()
+        assert resp.status_code == 200
+        del resp
+    assert bus.open_streams == 0 and not bus._subscribers
+
+    # Streams are capped per worker; clients fall back to polling.
+    app.config['EVENT_STREAM_MAX_CLIENTS'] = 0
+    res = client.get(f'/api/stream?ticket={ticket}')
+    assert res.status_code == 503 and res.headers['Retry-After'] == '60'
+
+
+def test_event_publish_chunks_payloads_and_is_best_effort(app, monkeypatch):
+    import json as _json
+    from backend.services import events as events_mod
+    batch = [events_mod.user_event(uid, 'profile') for uid in range(1, 2001)]
+    payloads = list(events_mod._payloads(batch, events_mod.PG_PAYLOAD_LIMIT))
+    assert len(payloads) > 1
+    assert all(len(p.encode()) <= events_mod.PG_PAYLOAD_LIMIT for p in payloads)
+    assert [e for p in payloads for e in _json.loads(p)] == batch
+
+    def broken(_events):
+        raise RuntimeError('bus down')
+
+    with app.app_context():
+        monkeypatch.setattr(events_mod.get_event_bus(), 'publish', broken)
+        events_mod.publish(batch[:1])  # logged, not raised
+
+
+def test_court_chat_long_poll(client, app):
+    import threading
+    import time as _time
+    from backend.models import Message
+    a = register(client, 'a@example.com', 'Ana')
+    court_id = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+    url = f'/api/courts/{court_id}/chat?since_id=0&wait=0.2'
+
+    # Nothing arrives: the wait runs out and the poll comes back empty.
+    started = _time.monotonic()
+    assert client.get(url, headers=auth_headers(a['token'])).get_json()['items'] == []
+    assert _time.monotonic() - started >= 0.2
+
+    def post_later():
+        _time.sleep(0.2)
+        with app.app_context():
+            db.session.add(Message(sender_id=a['user']['id'], court_id=court_id, body='Courts open'))
+            db.session.commit()
+
+    writer = threading.Thread(target=post_later)
+    writer.start()
+    started = _time.monotonic()
+    res = client.get(url.replace('wait=0.2', 'wait=10'), headers=auth_headers(a['token']))
+    writer.join()
+    assert [m['body'] for m in res.get_json()['items']] == ['Courts open']
+    assert _time.monotonic() - started < 5
+
+
+def test_me_etag_revalidation(client):
+    a = register(client, 'a@example.com', 'Ana')
+    b = register(client, 'b@example.com', 'Ben')
+    court_id = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+
+    def poll(etag):
+        return client.get('/api/me', headers={**auth_headers(a['token']), 'If-None-Match': etag})
+
+    first = client.get('/api/me', headers=auth_headers(a['token']))
+    etag = first.headers['ETag'].strip('"')
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    assert poll(etag).status_code == 304
+
+    # Anything feeding /me moves the version: a DM, a challenge (game invite),
+    # marking notifications read.
+    client.post(f"/api/chat/{a['user']['id']}", json={'body': 'Hi'}, headers=auth_headers(b['token']))
+    res = poll(etag)
+    assert res.status_code == 200 and res.get_json()['unread_messages'] == 1
+    etag = res.headers['ETag'].strip('"')
+    assert poll(etag).status_code == 304
+
+    client.post(f"/api/users/{a['user']['id']}/challenge", json={'court_id': court_id}, headers=auth_headers(b['token']))
+    res = poll(etag)
+    assert res.status_code == 200 and res.get_json()['active_game']['banner_state'] == 'challenge'
+    etag = res.headers['ETag'].strip('"')
+
+    client.post('/api/notifications/read', headers=auth_headers(a['token']))
+    res = poll(etag)
+    assert res.status_code == 200 and res.get_json()['unread_notifications'] == 0
+    # Another user's tag never validates.
+    assert client.get('/api/me', headers={
+        **auth_headers(b['token']), 'If-None-Match': res.headers['ETag'].strip('"'),
+    }).status_code == 200
+
+    # Bulk tools rewrite rows without per-user events; they invalidate every tag.
+    from backend.services.events import bulk_event, publish
+    etag = res.headers['ETag'].strip('"')
+    assert poll(etag).status_code == 304
+    with client.application.app_context():
+        publish([bulk_event('ratings')])
+    assert poll(etag).status_code == 200
+
+
+def test_game_feeds_use_fixed_query_count(client, app):
+    from datetime import timedelta
+    from backend.models import utcnow
+    users = [register(client, f'p{i}@example.com', f'P{i}') for i in range(3)]
+    court_ids = [c['id'] for c in client.get('/api/courts').get_json()['items']]
+    for i, user in enumerate(users):
+        client.patch('/api/me', json={'home_court_id': court_ids[i % 2]}, headers=auth_headers(user['token']))
+
+    def add_games(count):
+        for i in range(count):
+            game = client.post('/api/games', json={
+                'court_id': court_ids[i % 2],
+                'scheduled_at': (utcnow() + timedelta(days=1, hours=i)).isoformat() + 'Z',
+                'visibility': 'open',
+            }, headers=auth_headers(users[0]['token'])).get_json()
+            for user in users[1:]:
+                client.post(f"/api/games/{game['id']}/join", headers=auth_headers(user['token']))
+
+    def count_queries(path):
+        return get_counting_queries(client, path, users[0]['token'])
+
+    add_games(1)
+    count_queries('/api/games')  # warm per-process caches (friend lists)
+    feed, one_game = count_queries('/api/games')
+    assert len(feed['items']) == 1
+    add_games(5)
+    feed, six_games = count_queries('/api/games')
+    assert len(feed['items']) == 6
+    assert all(len(item['players']) == 3 and item['court'] for item in feed['items'])
+    assert feed['items'][0]['players'][1]['home_court_name']
+    # Rosters, users and courts are batched: more games, same number of queries.
+    assert six_games == one_game <= 6
+    _, mine = count_queries('/api/games?mine=1')
+    assert mine <= 7
+
+
+def test_games_feed_pages_by_distance(client):
+    from datetime import timedelta
+    from backend.models import utcnow
+    a = register(client, 'a@example.com', 'Ana')
+    b = register(client, 'b@example.com', 'Ben')
+    c = register(client, 'c@example.com', 'Cy')
+    courts = {c['name']: c['id'] for c in client.get('/api/courts').get_json()['items']}
+
+    def create(user, court, hours, **extra):
+        return client.post('/api/games', json={
+            'court_id': courts[court],
+            'scheduled_at': (utcnow() + timedelta(hours=hours)).isoformat() + 'Z', **extra,
+        }, headers=auth_headers(user['token'])).get_json()['id']
+
+    # Far-away games that start sooner must not crowd out nearby ones.
+    far = [create(b, 'Adorni Center', h) for h in (1, 2)]
+    near = [create(b, 'Larson Park', h) for h in (5, 3, 4)]
+    private = create(b, 'Larson Park', 1, visibility='private', invite_user_ids=[c['user']['id']])
+
+    def page(user, query):
+        return client.get(f'/api/games?{query}', headers=auth_headers(user['token'])).get_json()
+
+    nearby = 'lat=33.66&lng=-117.91&radius=60&limit=2'
+    first = page(a, nearby)
+    assert [g['id'] for g in first['items']] == [near[1], near[2]]
+    assert first['items'][0]['distance_miles'] == 0
+    second = page(a, f"{nearby}&cursor={first['next_cursor']}")
+    assert [g['id'] for g in second['items']] == [near[0]] and second['next_cursor'] is None
+    # Private games only reach their invitees (and players).
+    assert [g['id'] for g in page(c, nearby)['items']] == [private, near[1]]
+
+    # A game written by another process (no in-memory counters touched) is
+    # listed on the very next request.
+    from backend.models import Game
+    with client.application.app_context():
+        db.session.execute(Game.__table__.insert().values(
+            court_id=courts['Larson Park'], creator_id=b['user']['id'],
+            scheduled_at=utcnow() + timedelta(hours=2),
+        ))
+        db.session.commit()
+        outside = db.session.query(db.func.max(Game.id)).scalar()
+    assert [g['id'] for g in page(a, nearby)['items']] == [outside, near[1]]
+    with client.application.app_context():
+        db.session.execute(Game.__table__.delete().where(Game.id == outside))
+        db.session.commit()
+
+    # Without a location: soonest first, same cursor paging.
+    first = page(a, 'limit=4')
+    assert [g['id'] for g in first['items']] == [far[0], far[1], near[1], near[2]]
+    rest = page(a, f"limit=4&cursor={first['next_cursor']}")
+    assert [g['id'] for g in rest['items']] == [near[0]]
+    assert client.get('/api/games?cursor=bogus').status_code == 400
+
+
+def test_friend_graph_cache_invalidation(client, app):
+    from backend.routes.social import friend_ids
+    a = register(client, 'a@example.com', 'Ana')
+    b = register(client, 'b@example.com', 'Ben')
+    c = register(client, 'c@example.com', 'Cy')
+    ids = {u['user']['display_name']: u['user']['id'] for u in (a, b, c)}
+
+    def befriend(sender, receiver):
+        req = client.post('/api/friends/request', json={'user_id': receiver['user']['id']},
+                          headers=auth_headers(sender['token'])).get_json()
+        client.post(f"/api/friends/{req['friendship_id']}/respond", json={'accept': True},
+                    headers=auth_headers(receiver['token']))
+        return req['friendship_id']
+
+    assert friend_ids(ids['Ana']) == set()  # cached empty
+    ab = befriend(a, b)
+    befriend(c, b)
+    befriend(a, c)
+    assert friend_ids(ids['Ana']) == {ids['Ben'], ids['Cy']}
+    profile = client.get(f"/api/users/{ids['Cy']}", headers=auth_headers(a['token'])).get_json()
+    assert profile['mutual_friends'] == 1  # Ben
+
+    client.delete(f'/api/friends/{ab}', headers=auth_headers(a['token']))
+    assert friend_ids(ids['Ana']) == {ids['Cy']} and ids['Ana'] not in friend_ids(ids['Ben'])
+    client.post(f"/api/users/{ids['Cy']}/block", headers=auth_headers(a['token']))
+    assert friend_ids(ids['Ana']) == set() and friend_ids(ids['Cy']) == {ids['Ben']}
+
+
+def test_block_cache_filters_and_cross_worker_invalidation(client, app):
+    from sqlalchemy import text
+    from backend.services.events import get_event_bus
+    from backend.services.social_graph import get_social_graph
+    a, b, c = (register(client, f'{n}@example.com', n) for n in ('a', 'b', 'c'))
+    ids = [u['user']['id'] for u in (a, b, c)]
+    graph = get_social_graph()
+
+    client.post(f'/api/users/{ids[1]}/block', headers=auth_headers(a['token']))
+    assert graph.filter_blocked(ids[0], ids) == [ids[0], ids[2]]
+    assert graph.filter_blocked(ids[1], ids) == [ids[1], ids[2]]  # both directions
+
+    # Another worker blocks: its SQL bypasses this process's ORM hooks, and the
+    # event bus carries the invalidation over.
+    db.session.execute(text(
+        'INSERT INTO blocked_user (blocker_id, blocked_id, created_at, updated_at) '
+        'VALUES (:a, :b, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)'
+    ), {'a': ids[2], 'b': ids[0]})
+    db.session.commit()
+    assert not graph.is_blocked_between(ids[0], ids[2])
+    get_event_bus().dispatch([{'channel': f'user:{ids[2]}', 'type': 'block', 'user_id': ids[0]}])
+    assert graph.is_blocked_between(ids[0], ids[2])
+    assert client.post(f'/api/chat/{ids[2]}', json={'body': 'hi'},
+                       headers=auth_headers(a['token'])).status_code == 403
+
+
+def test_discovery_uses_fixed_query_count(client):
+    me = register(client, 'me@example.com', 'Me')
+    court_id = client.get('/api/courts?q=larson').get_json()['items'][0]['id']
+
+    def add_players(start, count):
+        for i in range(start, start + count):
+            user = register(client, f'p{i}@example.com', f'Player {i}')
+            client.patch('/api/me', json={'home_court_id': court_id}, headers=auth_headers(user['token']))
+            if i % 2:
+                client.post(f'/api/courts/{court_id}/checkin', headers=auth_headers(user['token']))
+            client.post('/api/friends/request', json={'user_id': me['user']['id']},
+                        headers=auth_headers(user['token']))
+
+    nearby = '/api/players/nearby?lat=33.66&lng=-117.91&radius=10'
+    counts = {}
+    for start, count in ((0, 2), (2, 4)):
+        add_players(start, count)
+        get_counting_queries(client, nearby, me['token'])  # warm per-process caches
+        players, counts[nearby] = get_counting_queries(client, nearby, me['token'])
+        friends, counts['friends'] = get_counting_queries(client, '/api/friends', me['token'])
+        found, counts['search'] = get_counting_queries(client, '/api/users/search?q=player', me['token'])
+        if start:
+            assert counts == baseline
+        baseline = dict(counts)
+    assert len(players['items']) == len(friends['incoming']) == len(found['items']) == 6
+    assert all(p['friendship_status'] == 'pending' and not p['outgoing'] for p in players['items'])
+    assert sum(1 for p in players['items'] if p['checked_in_court']) == 3
+    assert players['items'][0]['home_court_name'] == 'Larson Park'
+
+
 def test_challenge(client):
     a = register(client, 'a@example.com', 'Ana')
     b = register(client, 'b@example.com', 'Ben')
@@ -1171,6 +2127,80 @@ def test_ranked_score_needs_confirmation(client, app):
     assert me_player['rating_delta'] == 16
 
 
+def test_rating_history_records_and_downsamples(client, app):
+    from datetime import timedelta
+
+    from backend.models import RatingHistory, utcnow
+    from backend.services.rating_history import backfill_rating_history
+    players, game, _ = setup_ranked_doubles(client)
+    a, c = players['a'], players['c']
+    submit_doubles_score(client, a['token'], game['id'], players)
+    client.post(f"/api/games/{game['id']}/confirm", headers=auth_headers(c['token']))
+    url = f"/api/users/{a['user']['id']}/rating-history"
+
+    res = client.get(url, headers=auth_headers(c['token'])).get_json()
+    assert res['total'] == 1 and res['downsampled'] is False
+    assert [(p['rating'], p['delta'], p['game_id']) for p in res['items']] == [(1216, 16, game['id'])]
+
+    # A long career comes back thinned to `points` real games, ends kept.
+    start = utcnow() - timedelta(days=400)
+    with app.app_context():
+        db.session.add_all(
+            RatingHistory(user_id=a['user']['id'], recorded_at=start + timedelta(hours=i),
+                          rating_before=1200 + i % 37, rating_after=1201 + i % 37)
+            for i in range(600)
+        )
+        db.session.commit()
+    res = client.get(f'{url}?points=50', headers=auth_headers(c['token'])).get_json()
+    assert res['total'] == 601 and res['downsampled'] is True and len(res['items']) == 50
+    assert res['items'][0]['rating'] == 1201 and res['items'][-1]['game_id'] == game['id']
+    recent = client.get(f"{url}?since={(utcnow() - timedelta(days=1)).isoformat()}Z",
+                        headers=auth_headers(c['token'])).get_json()
+    assert [p['rating'] for p in recent['items']] == [1216]
+    assert client.get(f'{url}?since=nope', headers=auth_headers(c['token'])).status_code == 400
+
+    # Games finalized before the table existed are reconstructed from deltas.
+    with app.app_context():
+        db.session.execute(db.delete(RatingHistory))
+        db.session.commit()
+        assert backfill_rating_history() == 4
+        rows = {r.user_id: (r.rating_before, r.rating_after) for r in RatingHistory.query}
+    assert rows[a['user']['id']] == (1200, 1216) and rows[c['user']['id']] == (1200, 1184)
+
+
+def test_replay_ratings_recomputes_from_game_log(client, app):
+    from backend.models import GamePlayer, RatingHistory
+    from backend.replay_ratings import replay
+    players, game, _ = setup_ranked_doubles(client)
+    a, c = players['a'], players['c']
+    submit_doubles_score(client, a['token'], game['id'], players)
+    client.post(f"/api/games/{game['id']}/confirm", headers=auth_headers(c['token']))
+
+    with app.app_context():
+        ana = db.session.get(User, a['user']['id'])
+        ana.rating, ana.ranked_wins, ana.best_streak = 1500, 9, 9
+        db.session.commit()
+
+        # Dry run reports the drift without writing anything.
+        stats = replay(dry_run=True, log=lambda *_: None)
+        assert (stats['games'], stats['players_changed'], stats['deltas_changed']) == (1, 1, 0)
+        assert db.session.get(User, a['user']['id']).rating == 1500
+
+        stats = replay(log=lambda *_: None)
+        assert stats['players_changed'] == 1 and stats['history_rows'] == 4
+        db.session.expire_all()
+        ana = db.session.get(User, a['user']['id'])
+        assert (ana.rating, ana.ranked_wins, ana.current_streak, ana.best_streak) == (1216, 1, 1, 1)
+
+        # A new K factor rewrites ratings, per-game deltas and history.
+        stats = replay(k=64, log=lambda *_: None)
+        assert (stats['players_changed'], stats['deltas_changed']) == (4, 4)
+        db.session.expire_all()
+        assert db.session.get(User, c['user']['id']).rating == 1168
+        assert {p.rating_delta for p in GamePlayer.query.filter_by(game_id=game['id'])} == {32, -32}
+        assert sorted(r.rating_after for r in RatingHistory.query) == [1168, 1168, 1232, 1232]
+
+
 def test_status_column_fits_all_statuses():
     # Postgres enforces VARCHAR lengths (SQLite doesn't) — regression for the
     # 500 caused by 'awaiting_confirmation' (21 chars) vs VARCHAR(20).
@@ -1399,8 +2429,12 @@ def test_auto_confirm_stale_score(client, app):
         row.score_submitted_at = utcnow() - timedelta(hours=25)
         db.session.commit()
 
-    # Any games-list request sweeps stale confirmations
+    # Feed reads no longer sweep; the background job finalizes it.
     client.get('/api/games?mine=1', headers=auth_headers(a['token']))
+    assert client.get(f"/api/games/{game['id']}").get_json()['status'] == 'awaiting_confirmation'
+    from backend.jobs import get_scheduler
+    assert get_scheduler(app).run_job('auto_confirm_scores') == 1
+    db.session.expire_all()  # the job committed from its own app context/session
     detail = client.get(f"/api/games/{game['id']}").get_json()
     assert detail['status'] == 'completed'
     with app.app_context():